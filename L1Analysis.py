@@ -2,6 +2,9 @@ import ROOT as root
 
 from sys import exit
 import logging
+import os
+import Queue
+import threading
 
 
 class L1Ana(object):
@@ -123,13 +126,101 @@ class L1Data(object):
         self.gen = None
 
 
+class FilePrefetcher(object):
+
+    """
+    Prepares the next files of a file list while the current one is processed,
+    so that the TChain does not stall when it switches to the next file.
+    Remote files are opened with TFile::AsyncOpen, the chain then picks up the
+    open file in TFile::Open. Local files are checked and their header, first
+    clusters and key list are read into the page cache by a background thread.
+    warm_func(fname) can replace the reading of local files, e.g. for tests.
+    """
+
+    def __init__(self, file_list, depth=1, warm_bytes=16*1024*1024, warm_func=None):
+        super(FilePrefetcher, self).__init__()
+        self.file_list = file_list
+        self.depth = depth
+        self.warm_bytes = warm_bytes
+        self.warm_func = warm_func if warm_func else self.warm_local_file
+        self.handles = {}
+        self._scheduled = set()
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._work, name="FilePrefetcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def is_remote(fname):
+        return '://' in fname and not fname.startswith('file:')
+
+    def advance(self, current):
+        """
+        Prepare the files after file number current
+        To be called when the chain has switched to file number current
+        """
+        for k in range(current+1, min(current+1+self.depth, len(self.file_list))):
+            if k in self._scheduled:
+                continue
+            self._scheduled.add(k)
+            fname = self.file_list[k]
+            if self.is_remote(fname):
+                self.handles[k] = root.TFile.AsyncOpen(fname)
+            else:
+                self._queue.put(fname)
+        # the handle of the current file has been used by the chain
+        handle = self.handles.pop(current, None)
+        if handle and root.TFile.GetAsyncOpenStatus(handle) == root.TFile.kAOSFailure:
+            L1Ana.log.warning("Prefetching failed for {fname}".format(fname=self.file_list[current]))
+
+    def stop(self):
+        """Stop the background thread and close the files that were opened in advance and not used"""
+        self._queue.put(None)
+        self._thread.join()
+        for k, handle in self.handles.items():
+            infile = root.TFile.Open(handle)
+            if infile:
+                infile.Close()
+        self.handles = {}
+
+    def _work(self):
+        while True:
+            fname = self._queue.get()
+            if fname is None:
+                return
+            try:
+                self.warm_func(fname)
+            except EnvironmentError as err:
+                L1Ana.log.warning("Could not prefetch {fname}: {err}".format(fname=fname, err=err))
+
+    def warm_local_file(self, fname):
+        """Read the beginning and the end of a local ROOT file"""
+        if fname.startswith('file:'):
+            fname = fname[len('file:'):]
+        chunk = 1024*1024
+        with open(fname, 'rb') as f:
+            if f.read(4) != 'root':
+                L1Ana.log.warning("{fname} is not a ROOT file".format(fname=fname))
+                return
+            # file header and the first baskets of the trees
+            nread = 4
+            while nread < self.warm_bytes and len(f.read(chunk)) == chunk:
+                nread += chunk
+            # the keys and streamer info are at the end of the file
+            size = os.fstat(f.fileno()).st_size
+            if size > nread:
+                f.seek(max(nread, size-chunk))
+                f.read()
+        L1Ana.log.debug("Prefetched {fname}".format(fname=fname))
+
+
 class L1Ntuple(object):
 
     """
     The interface to the user, it is based on the L1NTuple c++ class
     """
 
-    def __init__(self, nevents=-1):
+    def __init__(self, nevents=-1, prefetch=0, entry_list=None):
         super(L1Ntuple, self).__init__()
         self.data = L1Data()
         self.do_upgrade = False
@@ -165,6 +256,12 @@ class L1Ntuple(object):
         self.current = 0
         self.curr_file = None
         self.init = False
+        # number of files to prepare ahead of the one being processed
+        self.prefetch = prefetch
+        self.prefetcher = None
+        self.tree_number = -1
+        # entries to process per file name, None to process all entries
+        self.entry_list = entry_list
 
     def open_with_file_list(self, fname_list):
         """
@@ -175,9 +272,13 @@ class L1Ntuple(object):
         if not L1Ana.l1init:
             L1Ana.init_l1_analysis()
         self.open_file_list(fname_list)
+        if self.entry_list is not None:
+            self.select_listed_files()
         self.check_first_file()
         self.open_no_init()
         self.init_branches()
+        if self.prefetch > 0 and len(self.file_list) > 1:
+            self.prefetcher = FilePrefetcher(self.file_list, self.prefetch)
 
         L1Ana.log.info("Ready to analyse.")
         self.init = True
@@ -190,12 +291,20 @@ class L1Ntuple(object):
         if not L1Ana.l1init:
             L1Ana.init_l1_analysis()
         self.file_list = [fname]
+        if self.entry_list is not None:
+            self.select_listed_files()
         self.check_first_file()
         self.open_no_init()
         self.init_branches()
         L1Ana.log.info("Ready to analyse.")
         self.init = True
 
+    def close(self):
+        """Stop preparing the next files, to be called when the event loop is done"""
+        if self.prefetcher:
+            self.prefetcher.stop()
+            self.prefetcher = None
+
     def open_no_init(self):
         """
         Initializes the TChains and adds present Trees as friends to the main tree
@@ -293,6 +402,17 @@ class L1Ntuple(object):
         for name in self.file_list:
             L1Ana.log.info("-- {fname}".format(fname=name))
 
+    def select_listed_files(self):
+        """
+        Keep only the files with entries in the entry list, so that the other files are not opened at all
+        """
+        missing = [fname for fname in self.entry_list if len(self.entry_list[fname]) > 0 and fname not in self.file_list]
+        if len(missing) > 0:
+            L1Ana.log.warning("{n} files of the entry list are not in the input, e.g. {fname}".format(n=len(missing), fname=missing[0]))
+        listed = [fname for fname in self.file_list if len(self.entry_list.get(fname, [])) > 0]
+        L1Ana.log.info("{n} of {N} files have entries in the entry list.".format(n=len(listed), N=len(self.file_list)))
+        self.file_list = listed
+
     def check_first_file(self):
         """
         Checks which branches and trees are present in the first root-file.
@@ -594,6 +714,56 @@ class L1Ntuple(object):
             return -1
         return self.nentries
 
+    def listed_entries(self):
+        """
+        RETURNS: the chain entries of the entry list in increasing order
+        Only the clusters that contain listed entries are read when processing them.
+        """
+        offsets = self.tree_main.GetTreeOffset()
+        entries = []
+        for tree_number, fname in enumerate(self.file_list):
+            nentries = offsets[tree_number+1] - offsets[tree_number]
+            entries += [offsets[tree_number] + entry for entry in sorted(self.entry_list[fname]) if entry < nentries]
+        return entries
+
+    def file_entry(self, index):
+        """
+        RETURNS: the file name and the entry number in the file of chain entry index, as used in entry lists
+        """
+        entry = self.tree_main.LoadTree(index)
+        return self.file_list[self.tree_main.GetTreeNumber()], entry
+
+    def clusters(self, start=0, stop=-1):
+        """
+        Entry ranges of the clusters of the main tree, the entries that are compressed together
+        Every file of the chain is loaded once to read its cluster layout.
+        TAKES: the range of chain entries to consider, stop=-1 for all entries
+        RETURNS: list of (tree number, first entry, last entry + 1) with chain entry numbers
+        """
+        if stop < 0 or stop > self.nentries:
+            stop = self.nentries
+        clusters = []
+        offsets = self.tree_main.GetTreeOffset()
+        for tree_number in range(self.tree_main.GetNtrees()):
+            offset = offsets[tree_number]
+            if offset >= stop:
+                break
+            self.tree_main.LoadTree(offset)
+            tree = self.tree_main.GetTree()
+            nentries = tree.GetEntries()
+            if offset + nentries <= start:
+                continue
+            cluster_iter = tree.GetClusterIterator(0)
+            first = cluster_iter.Next()
+            while first < nentries:
+                last = min(cluster_iter.GetNextEntry(), nentries)
+                first_entry = max(offset + first, start)
+                last_entry = min(offset + last, stop)
+                if first_entry < last_entry:
+                    clusters.append((tree_number, first_entry, last_entry))
+                first = cluster_iter.Next()
+        return clusters
+
     def __getitem__(self, index):
         """
         This is the iterator, it will get the next entry and return the updated L1Data container
@@ -608,4 +778,9 @@ class L1Ntuple(object):
             raise IndexError("Reached the end")
 
         self.tree_main.GetEntry(index)
+        if self.prefetcher:
+            tree_number = self.tree_main.GetTreeNumber()
+            if tree_number != self.tree_number:
+                self.tree_number = tree_number
+                self.prefetcher.advance(tree_number)
         return self.data
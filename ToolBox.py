@@ -12,6 +12,19 @@ def parse_options_and_init_log(loglevel=logging.INFO):
     parser.add_argument("-l", "--flist", dest="flist", default="", type=str, help="A txt file containing list of L1Ntuple files, one file per line.")
     parser.add_argument("-n", "--nevents", dest="nevents", default=-1, type=int, help="Number of events to run, -1 for all [default: %default]")
     parser.add_argument("-s", "--start", dest="start_event", default=0, type=int, help="At which event should processing start [default: %default]")
+    parser.add_argument("--profile", dest="profile", default=None, type=str, help="A json file to write the event rate and the time spent reading, selecting, matching, filling and writing to. Only for scripts looping over L1Ntuples.")
+    parser.add_argument("--checkpoint", dest="checkpoint", default=None, type=str, help="A file to periodically write the histograms and the position in the input to. Only for scripts looping over L1Ntuples.")
+    parser.add_argument("--checkpoint-every", dest="checkpoint_every", default=0, type=int, help="Write a checkpoint every N events, 0 to only use --checkpoint-minutes.")
+    parser.add_argument("--checkpoint-minutes", dest="checkpoint_minutes", default=15., type=float, help="Write a checkpoint every N minutes, 0 to only use --checkpoint-every.")
+    parser.add_argument("--snapshot-minutes", dest="snapshot_minutes", default=0., type=float, help="Write the current histograms of every output file to <output>.snapshot.root every N minutes, 0 to switch off. Only for scripts looping over L1Ntuples.")
+    parser.add_argument("--prefetch", dest="prefetch", default=0, type=int, help="Number of files of the file list to open and read ahead in the background, 0 to switch off.")
+    parser.add_argument("--workers", dest="workers", default=1, type=int, help="Number of local processes that share the events. Only for scripts looping over L1Ntuples.")
+    parser.add_argument("--task-size", dest="task_size", default=10000, type=int, help="Number of consecutive events that a worker takes at a time with --workers.")
+    parser.add_argument("--sample-fraction", dest="sample_fraction", default=0., type=float, help="Process only this fraction of the input, drawn as random clusters from all files, 0 to process everything.")
+    parser.add_argument("--sample-seed", dest="sample_seed", default=1, type=int, help="Random seed for --sample-fraction.")
+    parser.add_argument("--entry-list", dest="entry_list", default=None, type=str, help="A json file with the entries to process per input file, as written with --write-entry-list.")
+    parser.add_argument("--write-entry-list", dest="write_entry_list", default=None, type=str, help="A json file to write the entries of the events kept by the analyses to, e.g. events with a tag muon in the tag and probe analysis.")
+    parser.add_argument("--resume", dest="resume", default=False, action="store_true", help="Continue from the checkpoint file given with --checkpoint if it exists.")
 
     opts, unknown = parser.parse_known_args()
     if opts.fname == "" and opts.flist == "":
@@ -3,14 +3,15 @@ from ToolBox import parse_options_and_init_log
 # have to do this first or ROOT masks the -h messages
 opts, parser = parse_options_and_init_log()
 
-from L1Analysis import L1Ana, L1Ntuple
+from L1Analysis import L1Ana
+from analysis_tools.eventloop import Analyzer, EventLoop
 from analysis_tools.plotting import HistManager
 from analysis_tools.selections import MuonSelections, Matcher
 import exceptions
-import json
 import ROOT as root
+import argparse
 
-def parse_options_upgradeMuonHistos(parser):
+def parse_options_upgradeMuonHistos(parser, args=None):
     """
     Adds often used options to the OptionParser...
     """
@@ -20,7 +21,7 @@ def parse_options_upgradeMuonHistos(parser):
     sub_parser.add_argument("-j", "--json", dest="json", type=str, default=None, help="A json file with good lumi sections per run.")
     sub_parser.add_argument("-r", "--runs", dest="runs", type=str, default=None, help="A string of runs to check.")
 
-    opts, unknown = parser.parse_known_args()
+    opts, unknown = parser.parse_known_args(args)
     return opts
 
 def get_tftype(tf_muon_index):
@@ -123,78 +124,41 @@ def save_histos(hm, outfile):
         hm.get(varname).Write()
         
 
+class TemplateAnalyzer(Analyzer):
+    def book(self):
+        # book the histograms
+        L1Ana.log.info("Booking combined run histograms.")
+        self.hm = book_histograms()
+
+    def process(self, event):
+        analyse(event, self.hm)
+
+    def save(self, outfile):
+        save_histos(self.hm, outfile)
+
+
+def make_analyzer(args=None):
+    """
+    Set up the analyzer with the options from the command line,
+    or from args if it is run together with other analyses by runAnalyses.py
+    """
+    if args is None:
+        opts = parse_options_upgradeMuonHistos(parser)
+    else:
+        opts = parse_options_upgradeMuonHistos(argparse.ArgumentParser(), args)
+
+    return TemplateAnalyzer(opts.outname), opts
+
 def main():
     L1Ana.init_l1_analysis()
-    opts = parse_options_upgradeMuonHistos(parser)
+    analyzer, opts = make_analyzer()
     print ""
 
-    # book the histograms
-    L1Ana.log.info("Booking combined run histograms.")
-    hm = book_histograms()
-
-    ntuple = L1Ntuple(opts.nevents)
-
-    # open the list of files or the single file
-    if opts.flist:
-        ntuple.open_with_file_list(opts.flist)
-    if opts.fname:
-        ntuple.open_with_file(opts.fname)
-
-    # good runs from json file
-    good_ls = None
-    if opts.json:
-        with open(opts.json) as json_file:    
-            good_ls = json.load(json_file)
-
-    # list of runs to run on
-    runs_list = []
-    if opts.runs:
-        runs_list = [int(r) for r in opts.runs.split(",")]
-        L1Ana.log.info("Processing only runs:")
-        print runs_list
-
-    start_evt = opts.start_event
-    end_evt = opts.start_event+ntuple.nevents
-    analysed_evt_ctr = 0
-    try:
-        for i in range(start_evt, end_evt):
-            event = ntuple[i]
-            if (i+1) % 1000 == 0:
-                L1Ana.log.info("Processing event: {n}. Analysed events from selected runs/LS until now: {nAna}".format(n=i+1, nAna=analysed_evt_ctr))
-
-            # if given, only process selected runs
-            runnr = event.event.run
-            if len(runs_list) > 0 and not runnr in runs_list:
-                continue
-
-            # apply json file if loaded
-            if good_ls:
-                analyze_this_ls = False
-                ls = event.event.lumi
-                if str(runnr) in good_ls:
-                    for ls_list in good_ls[str(runnr)]:
-                        if ls >= ls_list[0] and ls <= ls_list[1]:
-                            analyze_this_ls = True
-                            break
-                if not analyze_this_ls:
-                    continue
-
-            # now do the analysis
-            analyse(event, hm)
-            analysed_evt_ctr += 1
-    except KeyboardInterrupt:
-        L1Ana.log.info("Analysis interrupted after {n} events".format(n=i))
-
-    L1Ana.log.info("Analysis of {nAna} events in selected runs/LS finished.".format(nAna=analysed_evt_ctr))
-
+    loop = EventLoop(opts, [analyzer])
     # save histos to root file
-    if saveHistos:
-        output = root.TFile(opts.outname, 'recreate')
-        output.cd()
-        save_histos(hm, output)
-        output.Close()
+    loop.run(save=saveHistos)
+
+saveHistos = True
 
 if __name__ == "__main__":
-    saveHistos = True
     main()
-
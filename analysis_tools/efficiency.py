@@ -0,0 +1,212 @@
+import ROOT as root
+import numpy as np
+from math import erf, lgamma, sqrt
+from array import array
+
+# default confidence level of TEfficiency (one sigma)
+CONF_LEVEL = 0.682689492137
+
+_lgamma = np.vectorize(lgamma, otypes=['d'])
+
+
+class Efficiency(object):
+    """
+    Efficiency per bin with asymmetric binomial errors, including underflow and overflow bins
+    Lightweight replacement for TEfficiency, to_graph() gives a TGraphAsymmErrors for drawing
+    """
+    def __init__(self, name, axis, passed, total, efficiency, err_low, err_up):
+        super(Efficiency, self).__init__()
+        self.name = name
+        self.axis = axis
+        self.passed = passed
+        self.total = total
+        self.efficiency = efficiency
+        self.err_low = err_low
+        self.err_up = err_up
+
+    def to_graph(self):
+        """TGraphAsymmErrors with one point per bin with entries in the total, like TEfficiency::CreateGraph"""
+        edges = self.axis.bin_edges()
+        bins = np.flatnonzero(self.total[1:self.axis.nbins+1]) + 1
+        x = 0.5 * (edges[bins-1] + edges[bins])
+        g = root.TGraphAsymmErrors(len(bins), array('d', x), array('d', self.efficiency[bins]),
+                                   array('d', x - edges[bins-1]), array('d', edges[bins] - x),
+                                   array('d', self.err_low[bins]), array('d', self.err_up[bins]))
+        g.SetName(self.name)
+        g.GetXaxis().SetTitle(self.axis.title)
+        return g
+
+
+def compute_efficiencies(names, axes, passed, total, statistic='clopper_pearson', level=CONF_LEVEL):
+    """
+    Efficiency objects for lists of names, axes and passed and total content arrays
+    The intervals of the bins of all efficiencies are computed in one go
+    """
+    all_passed = np.concatenate(passed).astype('d')
+    all_total = np.concatenate(total).astype('d')
+    efficiency = np.zeros(len(all_total))
+    filled = all_total > 0
+    efficiency[filled] = all_passed[filled] / all_total[filled]
+    low, up = binomial_interval(all_passed, all_total, statistic, level)
+    effs = []
+    start = 0
+    for name, axis, p, t in zip(names, axes, passed, total):
+        stop = start + len(t)
+        effs.append(Efficiency(name, axis, p, t, efficiency[start:stop], efficiency[start:stop]-low[start:stop], up[start:stop]-efficiency[start:stop]))
+        start = stop
+    return effs
+
+
+def binomial_interval(passed, total, statistic='clopper_pearson', level=CONF_LEVEL):
+    """Lower and upper bounds of the efficiency for arrays of passed and total counts"""
+    passed = np.asarray(passed, dtype='d')
+    total = np.asarray(total, dtype='d')
+    if statistic == 'clopper_pearson':
+        return clopper_pearson(passed, total, level)
+    elif statistic == 'wilson':
+        return wilson(passed, total, level)
+    raise ValueError("Unknown statistic: {s}".format(s=statistic))
+
+
+def clopper_pearson(passed, total, level=CONF_LEVEL):
+    """Clopper-Pearson interval as TEfficiency::ClopperPearson, bins without entries get [0, 0]"""
+    alpha = 0.5 * (1. - level)
+    filled = total > 0
+    low = np.zeros(len(total))
+    up = np.zeros(len(total))
+    up[filled] = 1.
+    sel = filled & (passed > 0)
+    low[sel] = _beta_quantile(alpha, passed[sel], total[sel]-passed[sel]+1.)
+    sel = filled & (passed < total)
+    up[sel] = _beta_quantile(1.-alpha, passed[sel]+1., total[sel]-passed[sel])
+    return low, up
+
+
+def wilson(passed, total, level=CONF_LEVEL):
+    """Wilson score interval as TEfficiency::Wilson, bins without entries get [0, 0]"""
+    alpha = 0.5 * (1. - level)
+    kappa = _normal_quantile(1.-alpha)
+    filled = total > 0
+    low = np.zeros(len(total))
+    up = np.zeros(len(total))
+    n = total[filled]
+    average = passed[filled] / n
+    mode = (passed[filled] + 0.5*kappa*kappa) / (n + kappa*kappa)
+    delta = kappa / (n + kappa*kappa) * np.sqrt(n*average*(1.-average) + kappa*kappa/4.)
+    low[filled] = np.maximum(mode - delta, 0.)
+    up[filled] = np.minimum(mode + delta, 1.)
+    return low, up
+
+
+def _normal_quantile(p):
+    # bisection on the normal cumulative distribution, only needed once per interval computation
+    lo, hi = -40., 40.
+    for i in range(200):
+        mid = 0.5 * (lo + hi)
+        if 0.5 * (1. + erf(mid / sqrt(2.))) < p:
+            lo = mid
+        else:
+            hi = mid
+    return 0.5 * (lo + hi)
+
+
+def _beta_quantile(q, a, b):
+    # Newton iterations on the regularized incomplete beta function for all bins at once,
+    # starting from the normal approximation and falling back to bisection outside the bracket
+    lbeta = _lbeta(a, b)
+    lo = np.zeros(len(a))
+    hi = np.ones(len(a))
+    mean = a / (a+b)
+    sigma = np.sqrt(a*b / ((a+b)*(a+b)*(a+b+1.)))
+    x = np.clip(mean + _normal_quantile(q)*sigma, 1e-12, 1.-1e-12)
+    for i in range(100):
+        f = _betainc(a, b, x, lbeta) - q
+        lo = np.where(f < 0., x, lo)
+        hi = np.where(f < 0., hi, x)
+        with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+            pdf = np.exp((a-1.)*np.log(x) + (b-1.)*np.log1p(-x) - lbeta)
+            newton = x - f/pdf
+        x_new = np.where((newton >= lo) & (newton <= hi), newton, 0.5*(lo+hi))
+        converged = np.all(np.abs(x_new-x) <= 1e-12*x)
+        x = x_new
+        if converged:
+            break
+    return x
+
+
+def _lbeta(a, b):
+    # log of the beta function, for large arguments with Stirling's series, as the difference
+    # of the log gamma functions loses the precision needed for the bounds at large total counts
+    p = np.minimum(a, b)
+    q = np.maximum(a, b)
+    result = np.empty(len(p))
+    small = q < 10.
+    result[small] = _lgamma(p[small]) + _lgamma(q[small]) - _lgamma(p[small]+q[small])
+    one_large = ~small & (p < 10.)
+    p1 = p[one_large]
+    q1 = q[one_large]
+    result[one_large] = _lgamma(p1) - (q1-0.5)*np.log1p(p1/q1) - p1*np.log(p1+q1) + p1 + _stirling_correction(q1) - _stirling_correction(p1+q1)
+    both_large = ~small & ~one_large
+    p2 = p[both_large]
+    q2 = q[both_large]
+    frac = p2/(p2+q2)
+    result[both_large] = (0.5*np.log(2.*np.pi) - 0.5*np.log(p2+q2) + (p2-0.5)*np.log(frac) + (q2-0.5)*np.log1p(-frac)
+                          + _stirling_correction(p2) + _stirling_correction(q2) - _stirling_correction(p2+q2))
+    return result
+
+
+def _stirling_correction(x):
+    # lgamma(x) - ((x-0.5)*log(x) - x + 0.5*log(2*pi)), accurate to 1e-12 for x >= 10
+    x2 = x*x
+    return (1./12. - (1./360. - (1./1260. - 1./(1680.*x2))/x2)/x2)/x
+
+
+def _betainc(a, b, x, lbeta):
+    # regularized incomplete beta function I_x(a, b) with the continued fraction expansion
+    result = np.zeros(len(x))
+    result[x >= 1.] = 1.
+    inside = (x > 0.) & (x < 1.)
+    a = a[inside]
+    b = b[inside]
+    x = x[inside]
+    front = np.exp(a*np.log(x) + b*np.log1p(-x) - lbeta[inside])
+    # the continued fraction converges quickly for x < (a+1)/(a+b+2), use the symmetry relation otherwise
+    direct = x < (a+1.) / (a+b+2.)
+    value = np.empty(len(x))
+    value[direct] = front[direct] * _betacf(a[direct], b[direct], x[direct]) / a[direct]
+    sym = ~direct
+    value[sym] = 1. - front[sym] * _betacf(b[sym], a[sym], 1.-x[sym]) / b[sym]
+    result[inside] = value
+    return result
+
+
+def _betacf(a, b, x, eps=1e-14, tiny=1e-300):
+    # modified Lentz evaluation of the continued fraction for the incomplete beta function
+    if len(x) == 0:
+        return np.zeros(0)
+    qab = a + b
+    qap = a + 1.
+    qam = a - 1.
+    c = np.ones(len(x))
+    d = 1. - qab*x/qap
+    d = 1. / np.where(np.abs(d) < tiny, tiny, d)
+    h = d.copy()
+    # the number of terms needed grows with the square root of a and b
+    for m in range(1, 100 + int(10*np.sqrt(qab.max()))):
+        m2 = 2*m
+        aa = m*(b-m)*x / ((qam+m2)*(a+m2))
+        d = 1. + aa*d
+        d = 1. / np.where(np.abs(d) < tiny, tiny, d)
+        c = 1. + aa/c
+        c = np.where(np.abs(c) < tiny, tiny, c)
+        h *= d*c
+        aa = -(a+m)*(qab+m)*x / ((a+m2)*(qap+m2))
+        d = 1. + aa*d
+        d = 1. / np.where(np.abs(d) < tiny, tiny, d)
+        c = 1. + aa/c
+        c = np.where(np.abs(c) < tiny, tiny, c)
+        delta = d*c
+        h *= delta
+        if np.all(np.abs(delta-1.) < eps):
+            break
+    return h
@@ -0,0 +1,547 @@
+import ROOT as root
+import bisect
+import cPickle as pickle
+import json
+import multiprocessing
+import os
+import Queue
+import signal
+import sys
+import traceback
+from timeit import default_timer
+from L1Analysis import L1Ana, L1Ntuple
+from analysis_tools.plotting import HistManager, HistManager2d, HistHandle, HistHandle2d
+from analysis_tools.profiling import StageProfiler
+from analysis_tools.sampling import ClusterSample
+from analysis_tools.selections import MuonSelections, Matcher, DistanceTable
+
+# methods timed per stage with the --profile option, None for all public methods of the class
+PROFILED_METHODS = [('selection', MuonSelections, None),
+                    ('matching', Matcher, None),
+                    ('matching', DistanceTable, None),
+                    ('filling', HistManager, ['fill', 'fill_many', 'fill_category']),
+                    ('filling', HistManager2d, ['fill', 'fill_many']),
+                    ('filling', HistHandle, None),
+                    ('filling', HistHandle2d, None),
+                   ]
+
+
+class Analyzer(object):
+    """
+    Base class for the analyses run by the EventLoop
+    book() is called before the first event, process(event) for every event
+    that passes the run and lumi section selection and save(outfile) with the
+    output file opened for the analyzer at the end
+    """
+    def __init__(self, outname):
+        super(Analyzer, self).__init__()
+        self.outname = outname
+        self.event_kept = False
+
+    def book(self):
+        pass
+
+    def process(self, event):
+        raise NotImplementedError
+
+    def save(self, outfile):
+        pass
+
+    def keep_event(self):
+        """Mark the event being processed for the entry list written with --write-entry-list"""
+        self.event_kept = True
+
+    def save_snapshot(self, outfile):
+        """Write the histograms filled so far while the loop is still running, by default the same as save()"""
+        self.save(outfile)
+
+    def managers(self):
+        """Histogram managers of the analyzer by attribute name"""
+        return dict((name, value) for name, value in self.__dict__.items() if isinstance(value, (HistManager, HistManager2d)))
+
+    def get_state(self):
+        """Picklable state for a checkpoint, by default the contents of the histogram managers"""
+        return {'managers':dict((name, m.serialize()) for name, m in self.managers().items())}
+
+    def set_state(self, state):
+        """Add the contents from get_state() to the histograms, the states of several workers are added one after the other"""
+        managers = self.managers()
+        for name, data in state['managers'].items():
+            m = managers[name]
+            m.merge(type(m).deserialize(data, backend=m.backend))
+
+
+class EventLoop(object):
+    """
+    Loop over the events of the L1Ntuple input given with the command line options
+    Takes care of the run and lumi section selection, the progress output and
+    the output files and passes the selected events to the analyzers
+    The event rate and the time spent reading the input are reported with the progress output.
+    With the --profile option the time spent in the selection, matching and histogram filling
+    is measured as well and all timings are written to a json file at the end.
+    With the --checkpoint option the histograms and the position in the input are
+    written every --checkpoint-every events or --checkpoint-minutes minutes and when
+    the job is interrupted, and --resume continues from the last checkpoint.
+    With --snapshot-minutes the histograms filled so far are written to a snapshot
+    file next to every output file, which can be plotted while the job is running.
+    With --workers the events are processed by several processes, see _loop_parallel().
+    With --sample-fraction only a stratified random sample of the clusters of the input is
+    processed and the number of selected events in the full input is estimated, see ClusterSample.
+    With --write-entry-list the events marked by any analyzer with keep_event() are written
+    to an entry list, and --entry-list processes only the events of such a list.
+    """
+    def __init__(self, opts, analyzers=None, log_interval=1000, report_interval=60.):
+        super(EventLoop, self).__init__()
+        self.opts = opts
+        self.analyzers = list(analyzers) if analyzers else []
+        self.log_interval = log_interval
+        self.report_interval = report_interval
+        self.analysed_evt_ctr = 0
+        self.profile_fname = getattr(opts, 'profile', None)
+        self.checkpoint_fname = getattr(opts, 'checkpoint', None)
+        self.checkpoint_every = getattr(opts, 'checkpoint_every', 0)
+        self.checkpoint_minutes = getattr(opts, 'checkpoint_minutes', 0.)
+        self.resume = getattr(opts, 'resume', False)
+        self.snapshot_minutes = getattr(opts, 'snapshot_minutes', 0.)
+        self.sample_fraction = getattr(opts, 'sample_fraction', 0.)
+        self.sample_seed = getattr(opts, 'sample_seed', 1)
+        self.sample = None
+        self.entry_list_fname = getattr(opts, 'entry_list', None)
+        self.entry_list = None
+        if self.entry_list_fname:
+            with open(self.entry_list_fname) as entry_list_file:
+                self.entry_list = json.load(entry_list_file)
+            L1Ana.log.info("Processing only the {n} events of entry list {f}.".format(n=sum(len(entries) for entries in self.entry_list.values()), f=self.entry_list_fname))
+            if self.sample_fraction > 0:
+                L1Ana.log.warning("--sample-fraction is ignored with an entry list.")
+                self.sample_fraction = 0.
+        self.entry_list_out = getattr(opts, 'write_entry_list', None)
+        self.kept_entries = {} if self.entry_list_out else None
+        if getattr(opts, 'prefetch', 0) > 0 and not getattr(opts, 'flist', None):
+            L1Ana.log.warning("--prefetch is ignored without a file list (-l).")
+        self.workers = getattr(opts, 'workers', 1)
+        self.task_size = getattr(opts, 'task_size', 10000)
+        self.profiler = StageProfiler()
+        for stage in ['booking', 'io', 'selection', 'matching', 'filling', 'checkpoint', 'snapshot', 'output']:
+            self.profiler.add_stage(stage)
+
+        # good lumi sections from json file and list of runs to run on
+        self.good_ls = None
+        json_fname = getattr(opts, 'json', None)
+        if json_fname:
+            with open(json_fname) as json_file:
+                self.good_ls = json.load(json_file)
+        self.runs_list = []
+        if getattr(opts, 'runs', None):
+            self.runs_list = [int(r) for r in opts.runs.split(",")]
+            L1Ana.log.info("Processing only runs:")
+            print self.runs_list
+
+    def add_analyzer(self, analyzer):
+        self.analyzers.append(analyzer)
+
+    def open_ntuple(self):
+        ntuple = L1Ntuple(self.opts.nevents, prefetch=getattr(self.opts, 'prefetch', 0), entry_list=self.entry_list)
+        if self.opts.flist:
+            ntuple.open_with_file_list(self.opts.flist)
+        if self.opts.fname:
+            ntuple.open_with_file(self.opts.fname)
+        return ntuple
+
+    def entries(self, ntuple, first=None):
+        """
+        The entries to process from first on, by default from --start-event
+        With --sample-fraction the sample is drawn at the first call and only its entries are returned,
+        with --entry-list only the entries of the list
+        """
+        if first is None:
+            first = self.opts.start_event
+        end_evt = self.opts.start_event+ntuple.nevents
+        if self.entry_list is not None:
+            return [i for i in ntuple.listed_entries() if first <= i < end_evt]
+        if self.sample_fraction <= 0:
+            return xrange(first, end_evt)
+        if self.sample is None:
+            self.sample = ClusterSample(ntuple.clusters(self.opts.start_event, end_evt), self.sample_fraction, self.sample_seed)
+            L1Ana.log.info("Sampling {n} of {N} entries in {c} clusters from {s} strata with seed {seed}.".format(n=self.sample.sampled_entries, N=self.sample.total_entries, c=len(self.sample.sampled), s=len(self.sample.strata), seed=self.sample_seed))
+        entries = self.sample.entries()
+        return entries[bisect.bisect_left(entries, first):]
+
+    def keep(self, ntuple, i):
+        """Add entry i to the entry list if an analyzer has kept the event"""
+        kept = False
+        for analyzer in self.analyzers:
+            kept = kept or analyzer.event_kept
+            analyzer.event_kept = False
+        if kept:
+            fname, entry = ntuple.file_entry(i)
+            self.kept_entries.setdefault(fname, []).append(entry)
+
+    def select(self, event):
+        """True if the event is in the selected runs and lumi sections"""
+        runnr = event.event.run
+        # if given, only process selected runs
+        if len(self.runs_list) > 0 and not runnr in self.runs_list:
+            return False
+        # apply json file if loaded
+        if self.good_ls:
+            ls = event.event.lumi
+            if str(runnr) in self.good_ls:
+                for ls_list in self.good_ls[str(runnr)]:
+                    if ls >= ls_list[0] and ls <= ls_list[1]:
+                        return True
+            return False
+        return True
+
+    def run(self, save=True):
+        """Book, process all selected events and save the output of every analyzer"""
+        profiler = self.profiler
+        if self.profile_fname:
+            for stage, cls, methods in PROFILED_METHODS:
+                profiler.instrument(stage, cls, methods)
+        start_time = default_timer()
+        start_cpu = os.times()
+
+        with profiler.stage('booking'):
+            for analyzer in self.analyzers:
+                analyzer.book()
+
+        if self.workers > 1:
+            n_processed, loop_time, interrupted = self._loop_parallel()
+        else:
+            n_processed, loop_time, interrupted = self._loop()
+
+        L1Ana.log.info("Analysis of {nAna} events in selected runs/LS finished.".format(nAna=self.analysed_evt_ctr))
+        if loop_time > 0:
+            L1Ana.log.info("Processed {n} events in {t:.1f} s, {rate:.1f} events/s".format(n=n_processed, t=loop_time, rate=n_processed/loop_time))
+        if self.sample:
+            estimate, uncertainty = self.sample.estimate()
+            L1Ana.log.info("Sampled {n} of {N} events, weight {w:.2f} per analysed event. Estimated events in selected runs/LS in the full input: {e:.0f} +- {u:.0f}".format(n=self.sample.sampled_entries, N=self.sample.total_entries, w=self.sample.weight(), e=estimate, u=uncertainty))
+
+        if save:
+            with profiler.stage('output'):
+                self.save()
+                if self.kept_entries is not None:
+                    self.write_entry_list(self.entry_list_out)
+            if self.checkpoint_fname and not interrupted and os.path.exists(self.checkpoint_fname):
+                # the output is complete, a resubmitted job must not skip the input
+                os.remove(self.checkpoint_fname)
+            if not interrupted:
+                # the complete output replaces the snapshots
+                for analyzer in self.analyzers:
+                    if os.path.exists(self.snapshot_fname(analyzer)):
+                        os.remove(self.snapshot_fname(analyzer))
+
+        total_time = default_timer() - start_time
+        if self.profile_fname:
+            L1Ana.log.info("Time per stage: {r}".format(r=profiler.report(total_time)))
+            profiler.restore()
+            end_cpu = os.times()
+            # including the time of the worker processes
+            cpu_time = sum(end_cpu[:4]) - sum(start_cpu[:4])
+            self.write_profile(self.profile_fname, n_processed, loop_time, total_time, cpu_time)
+
+    def _loop(self):
+        """Process the events in this process, returns the number of events, the time and if the loop was interrupted"""
+        profiler = self.profiler
+        start_time = default_timer()
+        ntuple = self.open_ntuple()
+        start_evt = self.opts.start_event
+        entries = self.entries(ntuple)
+        if self.resume:
+            start_evt = self.load_checkpoint(start_evt)
+            entries = self.entries(ntuple, start_evt)
+        if self.checkpoint_fname:
+            # stop after the current event on SIGTERM, which a batch job gets before it is killed, and on Ctrl-C
+            # so that the checkpoint does not contain a partially processed event
+            self._stop_requested = False
+            default_handlers = dict((signum, signal.signal(signum, self._request_stop)) for signum in [signal.SIGTERM, signal.SIGINT])
+        i = start_evt
+        next_evt = start_evt
+        interrupted = False
+        n_processed = 0
+        loop_start = default_timer()
+        last_report = loop_start
+        last_checkpoint = loop_start
+        last_snapshot = loop_start
+        try:
+            for i in entries:
+                with profiler.stage('io'):
+                    event = ntuple[i]
+                n_processed += 1
+                # by the number of processed events, as with a sample or an entry list the entry numbers have gaps
+                if n_processed % self.log_interval == 0:
+                    now = default_timer()
+                    L1Ana.log.info("Processing event: {n}, {nProc} events processed. Analysed events from selected runs/LS until now: {nAna}. {rate:.1f} events/s".format(n=i+1, nProc=n_processed, nAna=self.analysed_evt_ctr, rate=n_processed/(now-loop_start)))
+                    if self.profile_fname and now - last_report >= self.report_interval:
+                        L1Ana.log.info("Time per stage: {r}".format(r=profiler.report(now-start_time)))
+                        last_report = now
+
+                if self.select(event):
+                    for analyzer in self.analyzers:
+                        analyzer.process(event)
+                    self.analysed_evt_ctr += 1
+                    if self.sample:
+                        self.sample.count(i)
+                    if self.kept_entries is not None:
+                        self.keep(ntuple, i)
+                next_evt = i+1
+
+                if self.checkpoint_fname:
+                    if self._stop_requested:
+                        L1Ana.log.info("Analysis interrupted after {n} events".format(n=i))
+                        interrupted = True
+                        with profiler.stage('checkpoint'):
+                            self.write_checkpoint(next_evt)
+                        break
+                    if (self.checkpoint_every > 0 and n_processed % self.checkpoint_every == 0) or \
+                       (self.checkpoint_minutes > 0 and default_timer() - last_checkpoint >= 60.*self.checkpoint_minutes):
+                        with profiler.stage('checkpoint'):
+                            self.write_checkpoint(next_evt)
+                        last_checkpoint = default_timer()
+
+                if self.snapshot_minutes > 0 and default_timer() - last_snapshot >= 60.*self.snapshot_minutes:
+                    with profiler.stage('snapshot'):
+                        self.write_snapshot(next_evt)
+                    last_snapshot = default_timer()
+        except KeyboardInterrupt:
+            L1Ana.log.info("Analysis interrupted after {n} events".format(n=i))
+            interrupted = True
+        finally:
+            ntuple.close()
+            if self.checkpoint_fname:
+                for signum, handler in default_handlers.items():
+                    signal.signal(signum, handler)
+        return n_processed, default_timer() - loop_start, interrupted
+
+    def _loop_parallel(self):
+        """
+        Process the events with --workers processes that take ranges of --task-size events in turn
+        from a shared task counter, so that workers on faster files process more ranges.
+        The histograms filled by the workers are merged into the analyzers of this process.
+        """
+        if self.checkpoint_fname or self.resume:
+            L1Ana.log.warning("Checkpoints are not written with several workers.")
+        if self.snapshot_minutes > 0:
+            L1Ana.log.warning("Snapshots are not written with several workers.")
+        L1Ana.log.info("Processing with {w} workers and {n} events per task.".format(w=self.workers, n=self.task_size))
+        if self.sample_fraction > 0:
+            # drawn once here, the workers process the entries of the same sample
+            ntuple = self.open_ntuple()
+            self.entries(ntuple)
+            ntuple.close()
+        loop_start = default_timer()
+        next_task = multiprocessing.Value('l', 0)
+        results = multiprocessing.Queue()
+        # the workers are forked with the booked analyzers and stop themselves on Ctrl-C
+        default_sigint = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        workers = [multiprocessing.Process(target=self._work, args=(w, next_task, results)) for w in range(self.workers)]
+        try:
+            for worker in workers:
+                worker.start()
+            worker_results = {}
+            while len(worker_results) < len(workers):
+                try:
+                    w, result = results.get(timeout=1.)
+                    worker_results[w] = result
+                except Queue.Empty:
+                    for w, worker in enumerate(workers):
+                        if not w in worker_results and worker.exitcode is not None:
+                            raise RuntimeError("Worker {w} exited with code {c} without sending its histograms.".format(w=w, c=worker.exitcode))
+            for worker in workers:
+                worker.join()
+        finally:
+            signal.signal(signal.SIGINT, default_sigint)
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+
+        n_processed = 0
+        interrupted = False
+        for w in sorted(worker_results):
+            result = worker_results[w]
+            if 'error' in result:
+                L1Ana.log.error("Worker {w} failed:\n{e}".format(w=w, e=result['error']))
+                raise RuntimeError("Worker {w} failed".format(w=w))
+            for analyzer, state in zip(self.analyzers, result['states']):
+                analyzer.set_state(state)
+            n_processed += result['processed_events']
+            self.analysed_evt_ctr += result['analysed_events']
+            if self.sample:
+                self.sample.add_counts(result['sample_counts'])
+            if self.kept_entries is not None:
+                for fname, entries in result['kept_entries'].items():
+                    self.kept_entries.setdefault(fname, []).extend(entries)
+            interrupted = interrupted or result['interrupted']
+            for stage, seconds in result['seconds'].items():
+                self.profiler.add_stage(stage)
+                self.profiler.seconds[stage] += seconds
+                self.profiler.calls[stage] += result['calls'][stage]
+        return n_processed, default_timer() - loop_start, interrupted
+
+    def _work(self, w, next_task, results):
+        """Worker process of _loop_parallel(), sends the analyzer states to results"""
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        # only the time and the events of this worker are sent back
+        profiler = self.profiler
+        profiler.reset()
+        self.analysed_evt_ctr = 0
+        i = 0
+        n_processed = 0
+        n_tasks = 0
+        interrupted = False
+        try:
+            ntuple = self.open_ntuple()
+            entries = self.entries(ntuple)
+            work_start = default_timer()
+            try:
+                while True:
+                    with next_task.get_lock():
+                        task = next_task.value
+                        next_task.value += 1
+                    first = task*self.task_size
+                    if first >= len(entries):
+                        break
+                    for k in xrange(first, min(first+self.task_size, len(entries))):
+                        i = entries[k]
+                        with profiler.stage('io'):
+                            event = ntuple[i]
+                        n_processed += 1
+                        if self.select(event):
+                            for analyzer in self.analyzers:
+                                analyzer.process(event)
+                            self.analysed_evt_ctr += 1
+                            if self.sample:
+                                self.sample.count(i)
+                            if self.kept_entries is not None:
+                                self.keep(ntuple, i)
+                    n_tasks += 1
+            except KeyboardInterrupt:
+                L1Ana.log.info("Worker {w} interrupted at event {n}".format(w=w, n=i))
+                interrupted = True
+            finally:
+                ntuple.close()
+            work_time = default_timer() - work_start
+            L1Ana.log.info("Worker {w} processed {n} events in {t} tasks, {rate:.1f} events/s".format(w=w, n=n_processed, t=n_tasks, rate=n_processed/work_time if work_time > 0 else 0.))
+            results.put((w, {'states':[analyzer.get_state() for analyzer in self.analyzers],
+                             'processed_events':n_processed,
+                             'analysed_events':self.analysed_evt_ctr,
+                             'sample_counts':self.sample.counts if self.sample else None,
+                             'kept_entries':self.kept_entries,
+                             'interrupted':interrupted,
+                             'seconds':dict(profiler.seconds),
+                             'calls':dict(profiler.calls)}))
+        except Exception:
+            results.put((w, {'error':traceback.format_exc()}))
+
+    def write_entry_list(self, fname):
+        """Write the kept events as json with the sorted entry numbers per file name"""
+        with open(fname, 'w') as entry_list_file:
+            json.dump(dict((f, sorted(entries)) for f, entries in self.kept_entries.items()), entry_list_file)
+        L1Ana.log.info("Entry list with {n} events written to {f}".format(n=sum(len(entries) for entries in self.kept_entries.values()), f=fname))
+
+    def write_profile(self, fname, n_processed, loop_time, total_time, cpu_time):
+        """Write the event rate and the time per stage as json"""
+        profile = {'command':' '.join(sys.argv),
+                   'analyzers':[{'type':type(analyzer).__name__, 'outname':analyzer.outname} for analyzer in self.analyzers],
+                   'processed_events':n_processed,
+                   'analysed_events':self.analysed_evt_ctr,
+                   'loop_time':loop_time,
+                   'total_time':total_time,
+                   'cpu_time':cpu_time,
+                   'events_per_second':n_processed/loop_time if loop_time > 0 else 0.,
+                   'stages':self.profiler.stages(total_time),
+                  }
+        with open(fname, 'w') as profile_file:
+            json.dump(profile, profile_file, indent=2)
+        L1Ana.log.info("Profile written to {f}".format(f=fname))
+
+    def _request_stop(self, signum, frame):
+        if self._stop_requested:
+            # second request, stop immediately and keep the last checkpoint
+            raise KeyboardInterrupt()
+        L1Ana.log.info("Stopping after the current event.")
+        self._stop_requested = True
+
+    def _inputs(self):
+        """The input and selection options that a checkpoint is only valid for"""
+        return {'fname':self.opts.fname, 'flist':self.opts.flist, 'nevents':self.opts.nevents, 'start_event':self.opts.start_event,
+                'json':getattr(self.opts, 'json', None), 'runs':getattr(self.opts, 'runs', None),
+                'sample_fraction':self.sample_fraction, 'sample_seed':self.sample_seed, 'entry_list':self.entry_list_fname,
+                'analyzers':[(type(analyzer).__name__, analyzer.outname) for analyzer in self.analyzers]}
+
+    def write_checkpoint(self, next_evt):
+        """
+        Write the state of all analyzers and the next event to process to the checkpoint file
+        The file is written under a temporary name first and then renamed, so an existing
+        checkpoint is only replaced by a complete one
+        """
+        checkpoint = {'inputs':self._inputs(),
+                      'next_event':next_evt,
+                      'analysed_events':self.analysed_evt_ctr,
+                      'sample_counts':self.sample.counts if self.sample else None,
+                      'kept_entries':self.kept_entries,
+                      'analyzers':[analyzer.get_state() for analyzer in self.analyzers]}
+        tmp_fname = self.checkpoint_fname+'.tmp'
+        with open(tmp_fname, 'wb') as f:
+            pickle.dump(checkpoint, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_fname, self.checkpoint_fname)
+        L1Ana.log.info("Checkpoint written to {f} before event {n}.".format(f=self.checkpoint_fname, n=next_evt))
+
+    def load_checkpoint(self, start_evt):
+        """Restore the analyzers from the checkpoint file and return the event to continue with"""
+        if not self.checkpoint_fname or not os.path.exists(self.checkpoint_fname):
+            L1Ana.log.warning("No checkpoint to resume from. Starting from event {n}.".format(n=start_evt))
+            return start_evt
+        with open(self.checkpoint_fname, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if checkpoint['inputs'] != self._inputs():
+            L1Ana.log.error("Checkpoint {f} was written for different inputs or analyses: {i}".format(f=self.checkpoint_fname, i=checkpoint['inputs']))
+            raise ValueError("Checkpoint does not match the job")
+        for analyzer, state in zip(self.analyzers, checkpoint['analyzers']):
+            analyzer.set_state(state)
+        self.analysed_evt_ctr = checkpoint['analysed_events']
+        if self.sample:
+            self.sample.counts = checkpoint['sample_counts']
+        if self.kept_entries is not None and checkpoint['kept_entries'] is not None:
+            self.kept_entries = checkpoint['kept_entries']
+        L1Ana.log.info("Resuming from checkpoint {f} at event {n} with {nAna} analysed events.".format(f=self.checkpoint_fname, n=checkpoint['next_event'], nAna=self.analysed_evt_ctr))
+        return checkpoint['next_event']
+
+    @staticmethod
+    def snapshot_fname(analyzer):
+        """The snapshot file written next to the output file of the analyzer"""
+        base, ext = os.path.splitext(analyzer.outname)
+        return base+'.snapshot'+(ext if ext else '.root')
+
+    def write_snapshot(self, next_evt):
+        """
+        Write the histograms filled so far by every analyzer to its snapshot file
+        Like the checkpoint the file is written under a temporary name and then renamed,
+        so that a plotting script never reads a partially written snapshot
+        """
+        start = default_timer()
+        for analyzer in self.analyzers:
+            fname = self.snapshot_fname(analyzer)
+            tmp_fname = fname+'.tmp'
+            output = root.TFile(tmp_fname, 'recreate')
+            output.cd()
+            analyzer.save_snapshot(output)
+            output.Close()
+            os.rename(tmp_fname, fname)
+        L1Ana.log.info("Snapshot of {nAna} analysed events before event {n} written in {t:.1f} s.".format(nAna=self.analysed_evt_ctr, n=next_evt, t=default_timer()-start))
+
+    def save(self):
+        """Write the output of every analyzer to its own root file"""
+        for analyzer in self.analyzers:
+            output = root.TFile(analyzer.outname, 'recreate')
+            output.cd()
+            analyzer.save(output)
+            if self.sample:
+                # the histograms hold the sampled events, the plotting scripts scale them to the full input
+                output.cd()
+                for name, value in self.sample.parameters():
+                    root.TParameter('double')(name, value).Write()
+            output.Close()
@@ -0,0 +1,639 @@
+import ROOT as root
+import numpy as np
+from array import array
+
+
+class Axis(object):
+    """Binning of one histogram axis with the same bin finding as TAxis"""
+    def __init__(self, nbins, xmin, xmax, edges=None, title=''):
+        super(Axis, self).__init__()
+        self.nbins = nbins
+        self.xmin = float(xmin)
+        self.xmax = float(xmax)
+        self.edges = edges
+        self.title = title
+
+    @staticmethod
+    def from_binning(binning):
+        """
+        Create an axis from a binning list as used by the HistManager:
+        [nbins, xmin, xmax, title(, unit)] or [-1, edge0, edge1, ..., title(, unit)]
+        """
+        have_unit = type(binning[-2]) is str
+        if have_unit:
+            bins = binning[:-2]
+            if binning[-1] is None:
+                title = binning[-2]
+            else:
+                title = "{title} ({unit})".format(title=binning[-2], unit=binning[-1])
+        else:
+            bins = binning[:-1]
+            title = binning[-1]
+        # variable binning when nBins == -1
+        if bins[0] < 0:
+            edges = np.array(bins[1:], dtype='d')
+            return Axis(len(edges)-1, edges[0], edges[-1], edges=edges, title=title)
+        return Axis(bins[0], bins[1], bins[2], title=title)
+
+    @staticmethod
+    def from_root(taxis):
+        """Create an axis with the binning and title of a TAxis"""
+        xbins = taxis.GetXbins()
+        if xbins.GetSize() > 0:
+            edges = np.array([xbins.At(i) for i in range(xbins.GetSize())], dtype='d')
+            return Axis(taxis.GetNbins(), edges[0], edges[-1], edges=edges, title=taxis.GetTitle())
+        return Axis(taxis.GetNbins(), taxis.GetXmin(), taxis.GetXmax(), title=taxis.GetTitle())
+
+    def find_bins(self, values):
+        """Bin numbers including underflow (0) and overflow (nbins+1) for an array of values"""
+        values = np.asarray(values, dtype='d')
+        bins = np.empty(len(values), dtype=np.intp)
+        # NaN ends up in the overflow bin like in TAxis::FindFixBin
+        with np.errstate(invalid='ignore'):
+            below = values < self.xmin
+            above = ~(values < self.xmax)
+        inside = ~(below | above)
+        if self.edges is None:
+            bins[inside] = 1 + np.floor(self.nbins*(values[inside]-self.xmin)/(self.xmax-self.xmin)).astype(np.intp)
+        else:
+            bins[inside] = np.searchsorted(self.edges, values[inside], side='right')
+        bins[below] = 0
+        bins[above] = self.nbins+1
+        return bins
+
+    def bin_edges(self):
+        """Low edges of all bins and the up edge of the last bin, computed as in TAxis"""
+        if self.edges is not None:
+            return self.edges
+        return self.xmin + np.arange(self.nbins+1) * ((self.xmax-self.xmin)/self.nbins)
+
+    def rebinned(self, ngroup):
+        """Axis after merging ngroup bins as in TH1::Rebin, remaining bins go to the overflow"""
+        nbins = self.nbins // ngroup
+        edges = self.bin_edges()[:nbins*ngroup+1:ngroup]
+        if self.edges is None:
+            return Axis(nbins, edges[0], edges[-1], title=self.title)
+        return Axis(nbins, edges[0], edges[-1], edges=edges, title=self.title)
+
+    def root_args(self):
+        """Axis arguments for the ROOT histogram constructors"""
+        if self.edges is None:
+            return [self.nbins, self.xmin, self.xmax]
+        return [self.nbins, array('d', self.edges)]
+
+
+class NumpyHist1D(object):
+    """
+    1D histogram or profile that keeps its bin contents in NumPy arrays
+    and is converted to a TH1D or TProfile with to_root()
+    """
+    def __init__(self, name, axis, ytitle='', profile=False, weighted=True):
+        super(NumpyHist1D, self).__init__()
+        self.name = name
+        self.axis = axis
+        self.ytitle = ytitle
+        self.profile = profile
+        # unweighted histograms keep integer counts and no sum of squared weights
+        # until a weight != 1 is filled, see set_weighted()
+        self.weighted = weighted or profile
+        nbins = axis.nbins+2
+        # sum of weights and sum of squared weights per bin (for profiles sum of w*y and w*y^2)
+        if self.weighted:
+            self.sumw = np.zeros(nbins)
+            self.sumw2 = np.zeros(nbins)
+        else:
+            self.sumw = np.zeros(nbins, dtype=np.int64)
+            self.sumw2 = None
+        if profile:
+            # sum of weights and sum of squared weights per bin
+            self.binentries = np.zeros(nbins)
+            self.binsumw2 = np.zeros(nbins)
+        self.entries = 0
+        # tsumw, tsumw2, tsumwx, tsumwx2 (, tsumwy, tsumwy2 for profiles) as in TH1::GetStats
+        self.stats = np.zeros(6 if profile else 4)
+
+    @staticmethod
+    def from_root(h):
+        """Create a NumpyHist1D with the contents of a TH1D or TProfile"""
+        profile = h.InheritsFrom('TProfile')
+        nh = NumpyHist1D(h.GetName(), Axis.from_root(h.GetXaxis()), h.GetYaxis().GetTitle(), profile=profile)
+        _contents_from_root(nh, h)
+        return nh
+
+    def __iadd__(self, other):
+        """Add the contents of a NumpyHist1D with the same binning"""
+        _add_contents(self, other)
+        return self
+
+    def set_weighted(self):
+        """Switch from integer counts to sums of weights and squared weights"""
+        _set_weighted(self)
+
+    def fill(self, val, weight=1.):
+        self.fill_many([val], [weight])
+
+    def fill_many(self, values, weights=None):
+        """Fill arrays of values. In case of a profile weights are the y values"""
+        nvals = len(values)
+        if nvals == 0:
+            return
+        x = np.asarray(values, dtype='d')
+        if weights is None:
+            w = np.ones(nvals)
+        else:
+            w = np.asarray(weights, dtype='d')
+        bins = self.axis.find_bins(x)
+        nbins = self.axis.nbins+2
+        self.entries += nvals
+        inside = (bins > 0) & (bins <= self.axis.nbins)
+        if self.profile:
+            y = w
+            self.sumw += np.bincount(bins, weights=y, minlength=nbins)
+            self.sumw2 += np.bincount(bins, weights=y*y, minlength=nbins)
+            self.binentries += np.bincount(bins, minlength=nbins)
+            self.binsumw2 += np.bincount(bins, minlength=nbins)
+            x = x[inside]
+            y = y[inside]
+            self.stats += [len(x), len(x), x.sum(), (x*x).sum(), y.sum(), (y*y).sum()]
+        else:
+            if not self.weighted and weights is not None and np.any(w != 1.):
+                self.set_weighted()
+            if self.weighted:
+                self.sumw += np.bincount(bins, weights=w, minlength=nbins)
+                self.sumw2 += np.bincount(bins, weights=w*w, minlength=nbins)
+            else:
+                self.sumw += np.bincount(bins, minlength=nbins)
+            x = x[inside]
+            w = w[inside]
+            self.stats += [w.sum(), (w*w).sum(), (w*x).sum(), (w*x*x).sum()]
+
+    def to_root(self):
+        """Create the equivalent ROOT histogram"""
+        if self.profile:
+            h = root.TProfile(self.name, "", *self.axis.root_args())
+        else:
+            h = root.TH1D(self.name, "", *self.axis.root_args())
+        h.SetDirectory(0)
+        h.Sumw2()
+        h.GetXaxis().SetTitle(self.axis.title)
+        h.GetYaxis().SetTitle(self.ytitle)
+        # the errors of unweighted histograms are the counts
+        sumw2 = self.sumw2 if self.weighted else self.sumw
+        h_sumw2 = h.GetSumw2()
+        for b in np.flatnonzero(sumw2):
+            h.SetBinContent(int(b), float(self.sumw[b]))
+            h_sumw2.SetAt(float(sumw2[b]), int(b))
+        if self.profile:
+            binsumw2 = h.GetBinSumw2()
+            for b in np.flatnonzero(self.binentries):
+                h.SetBinEntries(int(b), self.binentries[b])
+                binsumw2.SetAt(self.binsumw2[b], int(b))
+        h.PutStats(array('d', self.stats))
+        h.SetEntries(self.entries)
+        return h
+
+
+class NumpyHist2D(object):
+    """
+    2D histogram or profile that keeps its bin contents in NumPy arrays
+    and is converted to a TH2D or TProfile2D with to_root()
+    """
+    def __init__(self, name, xaxis, yaxis, profile=False, weighted=True):
+        super(NumpyHist2D, self).__init__()
+        self.name = name
+        self.xaxis = xaxis
+        self.yaxis = yaxis
+        self.profile = profile
+        # unweighted histograms keep integer counts and no sum of squared weights
+        # until a weight != 1 is filled, see set_weighted()
+        self.weighted = weighted or profile
+        # global bin numbering as in TH2: binx + (nbinsx+2) * biny
+        nbins = (xaxis.nbins+2) * (yaxis.nbins+2)
+        if self.weighted:
+            self.sumw = np.zeros(nbins)
+            self.sumw2 = np.zeros(nbins)
+        else:
+            self.sumw = np.zeros(nbins, dtype=np.int64)
+            self.sumw2 = None
+        if profile:
+            self.binentries = np.zeros(nbins)
+            self.binsumw2 = np.zeros(nbins)
+        self.entries = 0
+        # tsumw, tsumw2, tsumwx, tsumwx2, tsumwy, tsumwy2, tsumwxy (, tsumwz, tsumwz2 for profiles) as in TH2::GetStats
+        self.stats = np.zeros(9 if profile else 7)
+
+    @staticmethod
+    def from_root(h):
+        """Create a NumpyHist2D with the contents of a TH2D or TProfile2D"""
+        profile = h.InheritsFrom('TProfile2D')
+        nh = NumpyHist2D(h.GetName(), Axis.from_root(h.GetXaxis()), Axis.from_root(h.GetYaxis()), profile=profile)
+        _contents_from_root(nh, h)
+        return nh
+
+    def __iadd__(self, other):
+        """Add the contents of a NumpyHist2D with the same binning"""
+        _add_contents(self, other)
+        return self
+
+    def set_weighted(self):
+        """Switch from integer counts to sums of weights and squared weights"""
+        _set_weighted(self)
+
+    def fill(self, valx, valy, weight=1.):
+        self.fill_many([valx], [valy], [weight])
+
+    def fill_many(self, xs, ys, weights=None):
+        """Fill arrays of value pairs. In case of a profile weights are the z values"""
+        nvals = len(xs)
+        if nvals == 0:
+            return
+        x = np.asarray(xs, dtype='d')
+        y = np.asarray(ys, dtype='d')
+        if weights is None:
+            w = np.ones(nvals)
+        else:
+            w = np.asarray(weights, dtype='d')
+        binsx = self.xaxis.find_bins(x)
+        binsy = self.yaxis.find_bins(y)
+        bins = binsx + (self.xaxis.nbins+2) * binsy
+        nbins = len(self.sumw)
+        self.entries += nvals
+        inside = (binsx > 0) & (binsx <= self.xaxis.nbins) & (binsy > 0) & (binsy <= self.yaxis.nbins)
+        if self.profile:
+            z = w
+            self.sumw += np.bincount(bins, weights=z, minlength=nbins)
+            self.sumw2 += np.bincount(bins, weights=z*z, minlength=nbins)
+            self.binentries += np.bincount(bins, minlength=nbins)
+            self.binsumw2 += np.bincount(bins, minlength=nbins)
+            x = x[inside]
+            y = y[inside]
+            z = z[inside]
+            self.stats += [len(x), len(x), x.sum(), (x*x).sum(), y.sum(), (y*y).sum(), (x*y).sum(), z.sum(), (z*z).sum()]
+        else:
+            if not self.weighted and weights is not None and np.any(w != 1.):
+                self.set_weighted()
+            if self.weighted:
+                self.sumw += np.bincount(bins, weights=w, minlength=nbins)
+                self.sumw2 += np.bincount(bins, weights=w*w, minlength=nbins)
+            else:
+                self.sumw += np.bincount(bins, minlength=nbins)
+            x = x[inside]
+            y = y[inside]
+            w = w[inside]
+            self.stats += [w.sum(), (w*w).sum(), (w*x).sum(), (w*x*x).sum(), (w*y).sum(), (w*y*y).sum(), (w*x*y).sum()]
+
+    def to_root(self):
+        """Create the equivalent ROOT histogram"""
+        args = self.xaxis.root_args() + self.yaxis.root_args()
+        if self.profile:
+            h = root.TProfile2D(self.name, "", *args)
+        else:
+            h = root.TH2D(self.name, "", *args)
+        h.SetDirectory(0)
+        h.Sumw2()
+        h.GetXaxis().SetTitle(self.xaxis.title)
+        h.GetYaxis().SetTitle(self.yaxis.title)
+        # the errors of unweighted histograms are the counts
+        sumw2 = self.sumw2 if self.weighted else self.sumw
+        h_sumw2 = h.GetSumw2()
+        for b in np.flatnonzero(sumw2):
+            h.SetBinContent(int(b), float(self.sumw[b]))
+            h_sumw2.SetAt(float(sumw2[b]), int(b))
+        if self.profile:
+            binsumw2 = h.GetBinSumw2()
+            for b in np.flatnonzero(self.binentries):
+                h.SetBinEntries(int(b), self.binentries[b])
+                binsumw2.SetAt(self.binsumw2[b], int(b))
+        h.PutStats(array('d', self.stats))
+        h.SetEntries(self.entries)
+        return h
+
+
+class SparseHist1D(object):
+    """
+    1D histogram that stores only the filled bins, for axes with many bins of which
+    few are filled like run numbers. to_root() creates a TH1D with the full binning.
+    """
+    def __init__(self, name, axis, ytitle=''):
+        super(SparseHist1D, self).__init__()
+        self.name = name
+        self.axis = axis
+        self.ytitle = ytitle
+        self.profile = False
+        # bin number -> [sum of weights, sum of squared weights]
+        self.bins = {}
+        self.entries = 0
+        # tsumw, tsumw2, tsumwx, tsumwx2 as in TH1::GetStats
+        self.stats = np.zeros(4)
+
+    @staticmethod
+    def from_root(h):
+        """Create a SparseHist1D with the contents of a TH1D"""
+        nh = SparseHist1D(h.GetName(), Axis.from_root(h.GetXaxis()), h.GetYaxis().GetTitle())
+        sumw2 = h.GetSumw2()
+        for b in range(h.GetSize()):
+            if h.At(b) != 0.:
+                nh.bins[b] = [h.At(b), sumw2.At(b) if sumw2.GetSize() > 0 else h.At(b)]
+        stats = array('d', [0.]*4)
+        h.GetStats(stats)
+        nh.stats[:] = stats
+        nh.entries = int(h.GetEntries())
+        return nh
+
+    def __iadd__(self, other):
+        """Add the contents of a SparseHist1D with the same binning"""
+        if self.axis.nbins != other.axis.nbins:
+            raise ValueError("Cannot add histograms with different binning: {a}, {b}".format(a=self.name, b=other.name))
+        for b, (sumw, sumw2) in other.bins.items():
+            row = self.bins.setdefault(b, [0., 0.])
+            row[0] += sumw
+            row[1] += sumw2
+        self.stats += other.stats
+        self.entries += other.entries
+        return self
+
+    def fill(self, val, weight=1.):
+        self.fill_many([val], [weight])
+
+    def fill_many(self, values, weights=None):
+        nvals = len(values)
+        if nvals == 0:
+            return
+        x = np.asarray(values, dtype='d')
+        if weights is None:
+            w = np.ones(nvals)
+        else:
+            w = np.asarray(weights, dtype='d')
+        bins = self.axis.find_bins(x)
+        filled, idcs = np.unique(bins, return_inverse=True)
+        sumw = np.bincount(idcs, weights=w)
+        sumw2 = np.bincount(idcs, weights=w*w)
+        for b, sw, sw2 in zip(filled, sumw, sumw2):
+            row = self.bins.setdefault(int(b), [0., 0.])
+            row[0] += float(sw)
+            row[1] += float(sw2)
+        self.entries += nvals
+        inside = (bins > 0) & (bins <= self.axis.nbins)
+        x = x[inside]
+        w = w[inside]
+        self.stats += [w.sum(), (w*w).sum(), (w*x).sum(), (w*x*x).sum()]
+
+    def to_root(self):
+        """Create the equivalent ROOT histogram"""
+        h = root.TH1D(self.name, "", *self.axis.root_args())
+        h.SetDirectory(0)
+        h.Sumw2()
+        h.GetXaxis().SetTitle(self.axis.title)
+        h.GetYaxis().SetTitle(self.ytitle)
+        sumw2 = h.GetSumw2()
+        for b, (sw, sw2) in self.bins.items():
+            h.SetBinContent(b, sw)
+            sumw2.SetAt(sw2, b)
+        h.PutStats(array('d', self.stats))
+        h.SetEntries(self.entries)
+        return h
+
+
+def rebin_contents(contents, ngroup):
+    """Merge ngroup bins of an array of contents including underflow and overflow as in TH1::Rebin"""
+    nbins = (len(contents)-2) // ngroup
+    rebinned = np.empty(nbins+2, dtype=contents.dtype)
+    rebinned[0] = contents[0]
+    rebinned[1:nbins+1] = contents[1:nbins*ngroup+1].reshape(nbins, ngroup).sum(axis=1)
+    # bins that do not fill a complete group end up in the overflow
+    rebinned[nbins+1] = contents[nbins*ngroup+1:].sum()
+    return rebinned
+
+
+def _contents_from_root(nh, h):
+    """Copy bin contents, errors and statistics of a ROOT histogram into a numpy histogram"""
+    ncells = len(nh.sumw)
+    sumw2 = h.GetSumw2()
+    have_sumw2 = sumw2.GetSize() > 0
+    for b in range(ncells):
+        # raw bin content, for profiles the sum of w*y and not the mean
+        nh.sumw[b] = h.At(b)
+        nh.sumw2[b] = sumw2.At(b) if have_sumw2 else h.At(b)
+    if nh.profile:
+        binsumw2 = h.GetBinSumw2()
+        for b in range(ncells):
+            nh.binentries[b] = h.GetBinEntries(b)
+            nh.binsumw2[b] = binsumw2.At(b) if binsumw2.GetSize() > 0 else h.GetBinEntries(b)
+    stats = array('d', [0.]*len(nh.stats))
+    h.GetStats(stats)
+    nh.stats[:] = stats
+    nh.entries = int(h.GetEntries())
+
+
+def _set_weighted(nh):
+    if not nh.weighted:
+        nh.sumw = nh.sumw.astype('d')
+        nh.sumw2 = nh.sumw.copy()
+        nh.weighted = True
+
+
+def _add_contents(nh, other):
+    if nh.sumw.shape != other.sumw.shape or nh.profile != other.profile:
+        raise ValueError("Cannot add histograms with different binning: {a}, {b}".format(a=nh.name, b=other.name))
+    if other.weighted:
+        _set_weighted(nh)
+    nh.sumw += other.sumw
+    if nh.weighted:
+        nh.sumw2 += other.sumw2 if other.weighted else other.sumw
+    if nh.profile:
+        nh.binentries += other.binentries
+        nh.binsumw2 += other.binsumw2
+    nh.stats += other.stats
+    nh.entries += other.entries
+
+
+class CategoryAxis(object):
+    """Named axis of discrete categories, e.g. eta ranges or quality cuts"""
+    def __init__(self, name, labels):
+        super(CategoryAxis, self).__init__()
+        self.name = name
+        self.labels = list(labels)
+        self._indices = dict((label, i) for i, label in enumerate(self.labels))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def index(self, label):
+        return self._indices[label]
+
+
+class NumpyCategoryHist(object):
+    """
+    Family of 1D histograms with the same binning that differ only by their categories.
+    The bin contents are kept in one array of shape (n_categories, nbins+2) where the
+    category index is the flattened index over all category axes.
+    With sparse=True the rows are only allocated for filled categories.
+    Unweighted families keep integer counts and no sum of squared weights until a weight != 1 is filled.
+    """
+    def __init__(self, name, cat_axes, axis, sparse=False, weighted=True):
+        super(NumpyCategoryHist, self).__init__()
+        self.name = name
+        self.cat_axes = cat_axes
+        self.axis = axis
+        self.sparse = sparse
+        self.weighted = weighted
+        self.shape = tuple(len(cat_axis) for cat_axis in cat_axes)
+        ncats = int(np.prod(self.shape))
+        nbins = axis.nbins+2
+        if sparse:
+            # flat category index -> [sumw, sumw2 or None, stats, entries]
+            self.rows = {}
+        else:
+            if weighted:
+                self.sumw = np.zeros((ncats, nbins))
+                self.sumw2 = np.zeros((ncats, nbins))
+            else:
+                self.sumw = np.zeros((ncats, nbins), dtype=np.int64)
+                self.sumw2 = None
+            self.stats = np.zeros((ncats, 4))
+            self.entries = np.zeros(ncats, dtype=np.int64)
+
+    def axis_index(self, name):
+        """Position of the category axis with this name"""
+        for i, cat_axis in enumerate(self.cat_axes):
+            if cat_axis.name == name:
+                return i
+        raise KeyError(name)
+
+    def flat_index(self, cat_idcs):
+        """Flattened category index for a tuple with one index (or index array) per category axis"""
+        return np.ravel_multi_index(cat_idcs, self.shape)
+
+    def fill(self, cat_idx, val, weight=1.):
+        self.fill_many([cat_idx], [val], [weight])
+
+    def fill_many(self, cat_idcs, values, weights=None):
+        """
+        Fill values into the categories given by cat_idcs, a sequence of
+        index tuples with one index per category axis, in one indexed update
+        """
+        nvals = len(values)
+        if nvals == 0:
+            return
+        cats = self.flat_index(np.asarray(cat_idcs, dtype=np.intp).T)
+        x = np.asarray(values, dtype='d')
+        if weights is None:
+            w = np.ones(nvals)
+        else:
+            w = np.asarray(weights, dtype='d')
+        if not self.weighted and weights is not None and np.any(w != 1.):
+            self.set_weighted()
+        bins = self.axis.find_bins(x)
+        inside = (bins > 0) & (bins <= self.axis.nbins)
+        xin = x[inside]
+        win = w[inside]
+        stats = np.column_stack([win, win*win, win*xin, win*xin*xin])
+        if self.sparse:
+            for cat in np.unique(cats):
+                sel = cats == cat
+                row = self._row(cat)
+                nbins = self.axis.nbins+2
+                if self.weighted:
+                    row[0] += np.bincount(bins[sel], weights=w[sel], minlength=nbins)
+                    row[1] += np.bincount(bins[sel], weights=w[sel]*w[sel], minlength=nbins)
+                else:
+                    row[0] += np.bincount(bins[sel], minlength=nbins)
+                row[2] += stats[sel[inside]].sum(axis=0)
+                row[3] += int(sel.sum())
+        else:
+            if self.weighted:
+                np.add.at(self.sumw, (cats, bins), w)
+                np.add.at(self.sumw2, (cats, bins), w*w)
+            else:
+                np.add.at(self.sumw, (cats, bins), 1)
+            np.add.at(self.stats, cats[inside], stats)
+            self.entries += np.bincount(cats, minlength=len(self.entries))
+
+    def set_weighted(self):
+        """Switch from integer counts to sums of weights and squared weights"""
+        if self.weighted:
+            return
+        if self.sparse:
+            for row in self.rows.values():
+                row[0] = row[0].astype('d')
+                row[1] = row[0].copy()
+        else:
+            self.sumw = self.sumw.astype('d')
+            self.sumw2 = self.sumw.copy()
+        self.weighted = True
+
+    def __iadd__(self, other):
+        """Add the contents of a NumpyCategoryHist with the same category axes and binning"""
+        if self.shape != other.shape or self.axis.nbins != other.axis.nbins:
+            raise ValueError("Cannot add histogram families with different categories or binning: {a}, {b}".format(a=self.name, b=other.name))
+        if other.weighted:
+            self.set_weighted()
+        if other.sparse:
+            rows = other.rows.items()
+        else:
+            rows = [(cat, [other.sumw[cat], other.sumw2[cat] if other.weighted else None, other.stats[cat], int(other.entries[cat])]) for cat in np.flatnonzero(other.entries)]
+        if self.sparse:
+            for cat, (sumw, sumw2, stats, entries) in rows:
+                row = self._row(cat)
+                row[0] += sumw
+                if self.weighted:
+                    # the squared weights of unweighted contents are the counts
+                    row[1] += sumw2 if other.weighted else sumw
+                row[2] += stats
+                row[3] += entries
+        elif other.sparse:
+            for cat, (sumw, sumw2, stats, entries) in rows:
+                self.sumw[cat] += sumw
+                if self.weighted:
+                    self.sumw2[cat] += sumw2 if other.weighted else sumw
+                self.stats[cat] += stats
+                self.entries[cat] += entries
+        else:
+            self.sumw += other.sumw
+            if self.weighted:
+                self.sumw2 += other.sumw2 if other.weighted else other.sumw
+            self.stats += other.stats
+            self.entries += other.entries
+        return self
+
+    def _row(self, cat):
+        row = self.rows.get(cat)
+        if row is None:
+            nbins = self.axis.nbins+2
+            if self.weighted:
+                row = [np.zeros(nbins), np.zeros(nbins), np.zeros(4), 0]
+            else:
+                row = [np.zeros(nbins, dtype=np.int64), None, np.zeros(4), 0]
+            self.rows[cat] = row
+        return row
+
+    def is_filled(self, cat_idx):
+        cat = self.flat_index(cat_idx)
+        if self.sparse:
+            return cat in self.rows
+        return self.entries[cat] > 0
+
+    def project(self, cat_idx, name, axis=None, ytitle=''):
+        """
+        NumpyHist1D with the content of one category
+        axis can be given to use a different axis title than the one of the family
+        """
+        if axis is None:
+            axis = self.axis
+        h = NumpyHist1D(name, axis, ytitle, weighted=self.weighted)
+        cat = self.flat_index(cat_idx)
+        if self.sparse:
+            if cat in self.rows:
+                sumw, sumw2, stats, entries = self.rows[cat]
+                h.sumw[:] = sumw
+                if self.weighted:
+                    h.sumw2[:] = sumw2
+                h.stats[:] = stats
+                h.entries = entries
+        else:
+            h.sumw[:] = self.sumw[cat]
+            if self.weighted:
+                h.sumw2[:] = self.sumw2[cat]
+            h.stats[:] = self.stats[cat]
+            h.entries = int(self.entries[cat])
+        return h
@@ -1,78 +1,386 @@
 import ROOT as root
+import os
+import copy
+import numpy as np
+import zlib
+import tempfile
+import cPickle as pickle
+from collections import OrderedDict
 from array import array
-from math import sqrt
+from fnmatch import fnmatch
+from analysis_tools.histograms import Axis, CategoryAxis, NumpyHist1D, NumpyHist2D, NumpyCategoryHist, SparseHist1D, rebin_contents
+from analysis_tools.efficiency import CONF_LEVEL, compute_efficiencies
+from analysis_tools.sampling import read_sample
 
 
 class HistManager(object):
     """Class that manages and holds histograms"""
-    def __init__(self, varnames=[], binning_dict={}, profile_dict={}, ytitle="# Muons", prefix="", filename=None, subdir=None):
+    def __init__(self, varnames=[], binning_dict={}, profile_dict={}, ytitle="# Muons", prefix="", filename=None, subdir=None, buffer_size=1000, backend='root', lazy=False, write_empty=True, sparse_dict={}, storage='auto', preload=None, max_buffered=100000):
         super(HistManager, self).__init__()
-        self.varnames = varnames
-        self.binnings = binning_dict
-        self.profiles = profile_dict
+        self.varnames = list(varnames)
+        self.binnings = dict(binning_dict)
+        self.profiles = dict(profile_dict)
+        # histograms with many bins of which only few are filled, e.g. run numbers, are kept as SparseHist1D
+        self.sparse = dict(sparse_dict)
+        self.ytitle = ytitle
         self.prefix = prefix
+        self.buffer_size = buffer_size
+        # all buffers are flushed when they hold max_buffered values together, so that many
+        # rarely filled histograms cannot accumulate large buffers
+        self.max_buffered = max_buffered
+        self._n_buffered = 0
+        # 'root' keeps ROOT histograms, 'numpy' keeps NumpyHist1D objects that are converted in get()
+        self.backend = backend
+        # with lazy booking only the binning is kept until the first fill of a histogram,
+        # when reading from a file only the histogram names until the first get()
+        self.lazy = lazy
+        # write() skips histograms that were never filled when False
+        self.write_empty = write_empty
+        # 'auto' keeps histograms without sum of squared weights until a weight != 1 is filled
+        # and adds the errors on export, 'weighted' books them with Sumw2 from the start
+        self.storage = storage
         root.TGaxis().SetMaxDigits(3)
 
         self.hists = {}
+        # values and weights of scalar fill() calls not yet filled into the histograms, as arrays of doubles
+        self._buffers = {}
+        # lists of HistHandle objects per category key, see book_handles()
+        self.handles = {}
+        # NumpyCategoryHist families and their buffers, see book_category_hist()
+        self.categories = {}
+        self._category_buffers = {}
+        # varname -> (family, category index tuple) for histograms stored in a family
+        self._category_of = {}
 
         self._stackcache = {}
         self._effcache = {}
         self._ratiocache = {}
         self._thresholdcache = {}
 
+        # input file and names of the histograms in it that are not read yet, see load()
+        self._filename = filename
+        self._subdir = subdir
+        self._unloaded = set()
+        # weight, estimated selected events and uncertainty if the input file is from a sampled run,
+        # the histograms hold the sampled events, counts are scaled to the full input with the weight by the caller
+        self.sample = None
+        self.sample_weight = 1.
+
         if filename is None:
             for vname in varnames:
-                have_unit = type(self.binnings[vname][-2]) is str
-                # variable binning when nBins == -1
-                if self.binnings[vname][0] < 0:
-                    if vname in self.profiles and self.profiles[vname] == True:
-                        if have_unit:
-                            self.hists[vname] = root.TProfile(prefix+vname, "", len(self.binnings[vname])-4, array('d', self.binnings[vname][1:-2]))
-                        else:
-                            self.hists[vname] = root.TProfile(prefix+vname, "", len(self.binnings[vname])-3, array('d', self.binnings[vname][1:-1]))
-                    else:
-                        if have_unit:
-                            self.hists[vname] = root.TH1D(prefix+vname, "", len(self.binnings[vname])-4, array('d', self.binnings[vname][1:-2]))
-                        else:
-                            self.hists[vname] = root.TH1D(prefix+vname, "", len(self.binnings[vname])-3, array('d', self.binnings[vname][1:-1]))
-                # fixed binning
+                if not lazy:
+                    self.hists[vname] = self._book(vname)
+                self._buffers[vname] = (array('d'), array('d'))
+        else:
+            self.backend = 'root'
+            self.varnames, self.sample = _read_index(filename, subdir, 'TH1')
+            if self.sample:
+                self.sample_weight = self.sample[0]
+            for hName in self.varnames:
+                self._buffers[hName] = (array('d'), array('d'))
+            self._unloaded = set(self.varnames)
+            if not lazy:
+                self.load()
+            elif preload:
+                self.load(preload)
+
+    def _book(self, vname):
+        if self.get_sparse(vname):
+            return SparseHist1D(self.prefix+vname, Axis.from_binning(self.binnings[vname]), self.ytitle)
+        if self.backend == 'numpy':
+            return NumpyHist1D(self.prefix+vname, Axis.from_binning(self.binnings[vname]), self.ytitle, profile=self.get_profile(vname), weighted=(self.storage == 'weighted'))
+        have_unit = type(self.binnings[vname][-2]) is str
+        # variable binning when nBins == -1
+        if self.binnings[vname][0] < 0:
+            if vname in self.profiles and self.profiles[vname] == True:
+                if have_unit:
+                    h = root.TProfile(self.prefix+vname, "", len(self.binnings[vname])-4, array('d', self.binnings[vname][1:-2]))
                 else:
-                    if vname in self.profiles and self.profiles[vname] == True:
-                        self.hists[vname] = root.TProfile(prefix+vname, "", self.binnings[vname][0], self.binnings[vname][1], self.binnings[vname][2])
-                    else:
-                        self.hists[vname] = root.TH1D(prefix+vname, "", self.binnings[vname][0], self.binnings[vname][1], self.binnings[vname][2])
-                self.hists[vname].Sumw2()
-                if not have_unit:
-                    xtitle = self.binnings[vname][-1]
-                elif self.binnings[vname][-1] is None:
-                    xtitle = self.binnings[vname][-2]
+                    h = root.TProfile(self.prefix+vname, "", len(self.binnings[vname])-3, array('d', self.binnings[vname][1:-1]))
+            else:
+                if have_unit:
+                    h = root.TH1D(self.prefix+vname, "", len(self.binnings[vname])-4, array('d', self.binnings[vname][1:-2]))
                 else:
-                    xtitle = "{title} ({unit})".format(title=self.binnings[vname][-2], unit=self.binnings[vname][-1])
-
-                self.hists[vname].GetXaxis().SetTitle(xtitle)
-                self.hists[vname].GetYaxis().SetTitle(ytitle)
+                    h = root.TH1D(self.prefix+vname, "", len(self.binnings[vname])-3, array('d', self.binnings[vname][1:-1]))
+        # fixed binning
         else:
-            self.varnames = []
-            input = root.TFile(filename)
-            if subdir:
-                directory = input.GetDirectory(subdir)
+            if vname in self.profiles and self.profiles[vname] == True:
+                h = root.TProfile(self.prefix+vname, "", self.binnings[vname][0], self.binnings[vname][1], self.binnings[vname][2])
             else:
-                directory = input.GetDirectory('')
-            keyList = directory.GetListOfKeys()
-            for key in keyList:
-                hName = key.GetName()
-                if not directory.Get(hName).InheritsFrom('TH1'):
-                    continue
-                self.varnames.append(hName)
-                self.hists[hName] = directory.Get(hName)
-                self.hists[hName].SetDirectory(0)
-            input.Close()
+                h = root.TH1D(self.prefix+vname, "", self.binnings[vname][0], self.binnings[vname][1], self.binnings[vname][2])
+        # ROOT adds the sum of squared weights by itself when a weight != 1 is filled
+        if self.storage == 'weighted' or self.get_profile(vname):
+            h.Sumw2()
+        if not have_unit:
+            xtitle = self.binnings[vname][-1]
+        elif self.binnings[vname][-1] is None:
+            xtitle = self.binnings[vname][-2]
+        else:
+            xtitle = "{title} ({unit})".format(title=self.binnings[vname][-2], unit=self.binnings[vname][-1])
+        h.GetXaxis().SetTitle(xtitle)
+        h.GetYaxis().SetTitle(self.ytitle)
+        return h
 
     def fill(self, varname, val, weight=1.):
-        self.hists[varname].Fill(val, weight) # In case of TProfile weight is the y value)
+        """
+        Buffer one value and fill the buffer in bulk once it holds buffer_size values
+        In case of TProfile weight is the y value
+        """
+        values, weights = self._buffers[varname]
+        values.append(val)
+        weights.append(weight)
+        self._n_buffered += 1
+        if len(values) >= self.buffer_size:
+            self._flush(varname)
+        elif self._n_buffered >= self.max_buffered:
+            self.flush()
+
+    def fill_many(self, varname, values, weights=None):
+        """
+        Fill a sequence of values with one call
+        In case of TProfile weights are the y values
+        """
+        if len(values) > 0:
+            self._fill_n(self._get_hist(varname), values, weights)
+
+    def get_handle(self, varname):
+        """
+        Handle to fill the histogram varname without looking it up by name for each fill
+        For a varname that is not managed here the handle ignores all fills
+        """
+        if varname not in self._buffers:
+            return NullHistHandle()
+        return HistHandle(self, varname)
+
+    def book_handles(self, handle_names):
+        """
+        Resolve handles for a dictionary {key: [varname, ...]}
+        The handle lists are then accessible with self.handles[key]
+        """
+        for key, vnames in handle_names.items():
+            self.handles[key] = [self.get_handle(vname) for vname in vnames]
+
+    def book_category_hist(self, family, cat_axes, varname_dict, sparse=False):
+        """
+        Store a family of histograms with identical binning in one NumpyCategoryHist.
+        cat_axes is a list of (axis name, category labels) and varname_dict maps the category
+        index tuples to the histogram names, e.g. {(iEta, iThr, qual): varname}.
+        The binnings of the varnames must be in binning_dict. The histograms are filled
+        with fill_category() and projected out in get() and write() under their varnames.
+        """
+        axes = [CategoryAxis(name, labels) for name, labels in cat_axes]
+        vnames = sorted(varname_dict.values())
+        h = NumpyCategoryHist(self.prefix+family, axes, Axis.from_binning(self.binnings[vnames[0]]), sparse=sparse, weighted=(self.storage == 'weighted'))
+        self.categories[family] = h
+        self._category_buffers[family] = ([], array('d'), array('d'))
+        for cat_idx, vname in varname_dict.items():
+            self._category_of[vname] = (family, cat_idx)
+            # no separate histogram for family members
+            self.hists.pop(vname, None)
+            self._buffers.pop(vname, None)
+            if vname not in self.varnames:
+                self.varnames.append(vname)
+
+    def fill_category(self, family, cat_idx, val, weight=1.):
+        """Buffer one value for the category index tuple cat_idx of a histogram family"""
+        cat_idcs, values, weights = self._category_buffers[family]
+        cat_idcs.append(cat_idx)
+        values.append(val)
+        weights.append(weight)
+        self._n_buffered += 1
+        if len(values) >= self.buffer_size:
+            self._flush_category(family)
+        elif self._n_buffered >= self.max_buffered:
+            self.flush()
+
+    def _flush_category(self, family):
+        cat_idcs, values, weights = self._category_buffers[family]
+        if len(values) > 0:
+            self.categories[family].fill_many(cat_idcs, values, weights)
+            self._n_buffered -= len(values)
+            del cat_idcs[:]
+            del values[:]
+            del weights[:]
+
+    def flush(self):
+        """Fill all buffered values into the histograms"""
+        for varname in self._buffers:
+            self._flush(varname)
+        for family in self._category_buffers:
+            self._flush_category(family)
+        self._n_buffered = 0
+
+    def _flush(self, varname):
+        values, weights = self._buffers[varname]
+        if len(values) > 0:
+            self._fill_n(self._get_hist(varname), values, weights)
+            self._n_buffered -= len(values)
+            # empty in place so that references to the buffers stay valid
+            del values[:]
+            del weights[:]
+
+    def _fill_n(self, h, values, weights):
+        n = len(values)
+        if n == 0:
+            return
+        if not isinstance(h, root.TH1):
+            h.fill_many(values, weights)
+            return
+        if weights is None:
+            weights = [1.]*n
+        if h.InheritsFrom('TProfile'):
+            h.FillN(n, array('d', values), array('d', weights), array('d', [1.]*n))
+        else:
+            h.FillN(n, array('d', values), array('d', weights))
+
+    def _get_hist(self, varname):
+        """Histogram object for varname, booked or read from the input file now if that was deferred"""
+        h = self.hists.get(varname)
+        if h is None:
+            if varname in self._unloaded:
+                self._load([varname])
+                return self.hists[varname]
+            h = self._book(varname)
+            self.hists[varname] = h
+        return h
+
+    def load(self, patterns=None):
+        """
+        Read the histograms that were not read from the input file yet,
+        all of them or only those with names matching one of the shell-style patterns
+        """
+        self._load([vname for vname in self.varnames if vname in self._unloaded and (patterns is None or any(fnmatch(vname, p) for p in patterns))])
+
+    def _load(self, varnames):
+        """Read the histograms varnames, the input file is only open while they are read"""
+        if varnames:
+            self.hists.update(_read_hists(self._filename, self._subdir, varnames))
+            self._unloaded.difference_update(varnames)
+
+    def _hist(self, varname):
+        if varname in self._category_of:
+            family, cat_idx = self._category_of[varname]
+            self._flush_category(family)
+            axis = Axis.from_binning(self.binnings[varname])
+            return self.categories[family].project(cat_idx, self.prefix+varname, axis, self.ytitle).to_root()
+        self._flush(varname)
+        h = self._get_hist(varname)
+        if isinstance(h, root.TH1):
+            return _with_errors(h)
+        return h.to_root()
+
+    def is_booked(self, varname):
+        """False if booking of varname is deferred and it has not been filled yet"""
+        if varname in self._category_of:
+            family, cat_idx = self._category_of[varname]
+            self._flush_category(family)
+            return self.categories[family].is_filled(cat_idx)
+        return varname in self.hists or varname in self._unloaded or len(self._buffers[varname][0]) > 0
+
+    def write(self):
+        """Write the histograms to the current directory, skipping never filled ones unless write_empty is set"""
+        for varname in self.varnames:
+            if self.write_empty or self.is_booked(varname):
+                self._hist(varname).Write()
+
+    def merge(self, other):
+        """
+        Add the contents of another HistManager
+        Histograms only present in other are added to this manager
+        """
+        self.flush()
+        other.flush()
+        self.load()
+        other.load()
+        for vname in other.varnames:
+            if vname in other._category_of or vname not in other.hists:
+                continue
+            h = other.hists[vname]
+            if vname not in self._buffers and vname not in self._category_of:
+                self.varnames.append(vname)
+                self._buffers[vname] = (array('d'), array('d'))
+                if vname in other.binnings:
+                    self.binnings[vname] = other.binnings[vname]
+                if vname in other.profiles:
+                    self.profiles[vname] = other.profiles[vname]
+                if vname in other.sparse:
+                    self.sparse[vname] = other.sparse[vname]
+            mine = self.hists.get(vname)
+            if mine is None:
+                if isinstance(h, root.TH1):
+                    self.hists[vname] = h.Clone()
+                    self.hists[vname].SetDirectory(0)
+                else:
+                    self.hists[vname] = copy.deepcopy(h)
+            elif isinstance(mine, root.TH1):
+                mine.Add(h if isinstance(h, root.TH1) else h.to_root())
+            elif type(h) is type(mine):
+                mine += h
+            else:
+                # different storage, e.g. a ROOT histogram added to a numpy one
+                mine += type(mine).from_root(h if isinstance(h, root.TH1) else h.to_root())
+        for family, h in other.categories.items():
+            if family in self.categories:
+                self.categories[family] += h
+                continue
+            self.categories[family] = copy.deepcopy(h)
+            self._category_buffers[family] = ([], array('d'), array('d'))
+        for vname, (family, cat_idx) in other._category_of.items():
+            if vname not in self._category_of:
+                self._category_of[vname] = (family, cat_idx)
+                self.binnings[vname] = other.binnings[vname]
+                if vname not in self.varnames:
+                    self.varnames.append(vname)
+        self._stackcache = {}
+        self._effcache = {}
+        self._ratiocache = {}
+        self._thresholdcache = {}
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def serialize(self):
+        """
+        Compact binary representation of the histogram names, binnings and contents
+        to ship between processes or to store partial results, see deserialize()
+        """
+        self.flush()
+        self.load()
+        hists = {}
+        for vname, h in self.hists.items():
+            hists[vname] = NumpyHist1D.from_root(h) if isinstance(h, root.TH1) else h
+        state = {'varnames':self.varnames, 'binnings':self.binnings, 'profiles':self.profiles, 'sparse':self.sparse, 'ytitle':self.ytitle, 'prefix':self.prefix,
+                 'storage':self.storage, 'hists':hists, 'categories':self.categories, 'category_of':self._category_of}
+        return zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def deserialize(data, backend='numpy'):
+        """Create a HistManager from the output of serialize()"""
+        state = pickle.loads(zlib.decompress(data))
+        hm = HistManager(state['varnames'], state['binnings'], state['profiles'], state['ytitle'], state['prefix'], backend=backend, lazy=True, sparse_dict=state['sparse'], storage=state.get('storage', 'auto'))
+        for vname, h in state['hists'].items():
+            hm.hists[vname] = h if backend == 'numpy' or isinstance(h, SparseHist1D) else h.to_root()
+        hm.categories = state['categories']
+        hm._category_of = state['category_of']
+        for family in hm.categories:
+            hm._category_buffers[family] = ([], array('d'), array('d'))
+        for vname in hm._category_of:
+            hm._buffers.pop(vname, None)
+        return hm
+
+    def save_partial(self, filename):
+        """Write the serialized histograms to a file, see load_partial()"""
+        with open(filename, 'wb') as f:
+            f.write(self.serialize())
+
+    @staticmethod
+    def load_partial(filename, backend='numpy'):
+        with open(filename, 'rb') as f:
+            return HistManager.deserialize(f.read(), backend=backend)
 
     def get(self, varname, addunderflow=False, addoverflow=False, rebin=1):
-        h = self.hists[varname]
+        h = self._hist(varname)
         if addunderflow:
             err = root.Double(0)
             integral = h.IntegralAndError(0, 1, err)
@@ -113,39 +421,54 @@ class HistManager(object):
         else:
             return False
 
+    def get_sparse(self, varname):
+        if varname in self.sparse:
+            return self.sparse[varname]
+        else:
+            return False
+
     def get_threshold_hist(self, varname, rebin=1):
-        if varname in self._thresholdcache.keys():
-            return self._thresholdcache[varname]
+        return self.get_threshold_hists([varname], rebin)[0]
 
-        h_thr = self.hists[varname].Clone()
-        h = self.hists[varname]
-        if rebin > 1:
-            h.Rebin(rebin)
-        bins = range(h_thr.GetNbinsX()+2)
-        bins.reverse()
-        bmax = h_thr.GetNbinsX()
-        binsum = 0
-        binerr2 = 0
-        for ib in bins:
-            binsum += h.GetBinContent(ib)
-            binerr2 += h.GetBinError(ib)**2
-            if ib > 0 and ib < bmax:
-                h_thr.SetBinContent(ib, binsum)
-                h_thr.SetBinError(ib, sqrt(binerr2))
-        h_thr.GetYaxis().SetTitle("Integrated "+h_thr.GetYaxis().GetTitle())
-        self._thresholdcache[varname] = h_thr
-        return h_thr
+    def get_threshold_hists(self, varnames, rebin=1):
+        """
+        Integrated histograms for a list of varnames
+        Histograms with the same number of bins are integrated together with reverse cumulative sums
+        """
+        groups = OrderedDict()
+        pending = set()
+        for vname in varnames:
+            if (vname, rebin) in self._thresholdcache or vname in pending:
+                continue
+            pending.add(vname)
+            h_thr = self._hist(vname).Clone()
+            if rebin > 1:
+                h_thr.Rebin(rebin)
+            groups.setdefault(h_thr.GetNbinsX(), OrderedDict())[vname] = h_thr
+        for bmax, h_thrs in groups.items():
+            nhs = [NumpyHist1D.from_root(h_thr) for h_thr in h_thrs.values()]
+            sumw = np.array([nh.sumw for nh in nhs])
+            sumw2 = np.array([nh.sumw2 for nh in nhs])
+            # integrate from the overflow bin down, the underflow and the last bin keep their contents
+            binsum = np.cumsum(sumw[:, ::-1], axis=1)[:, ::-1]
+            binerr2 = np.cumsum(sumw2[:, ::-1], axis=1)[:, ::-1]
+            sumw[:, 1:bmax] = binsum[:, 1:bmax]
+            sumw2[:, 1:bmax] = binerr2[:, 1:bmax]
+            for i, (vname, h_thr) in enumerate(h_thrs.items()):
+                h_thr.SetContent(array('d', sumw[i]))
+                h_thr.SetError(array('d', np.sqrt(sumw2[i])))
+                h_thr.GetYaxis().SetTitle("Integrated "+h_thr.GetYaxis().GetTitle())
+                self._thresholdcache[(vname, rebin)] = h_thr
+        return [self._thresholdcache[(vname, rebin)] for vname in varnames]
 
     def get_threshold_stack(self, varnames):
         keyname = "thr_".join(varnames)
         if keyname in self._stackcache.keys():
             return self._stackcache[keyname]
         stack = root.THStack()
-        hs = []
-        for vname in varnames:
-            h = self.get_threshold_hist(vname)
+        hs = self.get_threshold_hists(varnames)
+        for h in hs:
             stack.Add(h)
-            hs.append(h)
         self._stackcache[keyname] = [hs, stack]
         return [hs, stack]
 
@@ -154,8 +477,8 @@ class HistManager(object):
         if name in self._ratiocache.keys():
             return self._ratiocache[name]
 
-        h_denom = self.hists[varname_denom]
-        h_ratio = self.hists[varname_nom].Clone()
+        h_denom = self._hist(varname_denom)
+        h_ratio = self._hist(varname_nom).Clone()
         if addunderflow:
             err = root.Double(0)
             integral = h_denom.IntegralAndError(0, 1, err)
@@ -201,8 +524,8 @@ class HistManager(object):
         if name in self._effcache.keys():
             return self._effcache[name]
 
-        h_denom = self.hists[varname_denom].Clone()
-        h_nom = self.hists[varname_nom].Clone()
+        h_denom = self._hist(varname_denom).Clone()
+        h_nom = self._hist(varname_nom).Clone()
 
         if rebin > 1:
             h_denom.Rebin(rebin)
@@ -244,8 +567,8 @@ class HistManager(object):
         if name in self._effcache.keys():
             return self._effcache[name]
 
-        h_denom = self.hists[varname_denom].Clone()
-        h_nom = self.hists[varname_nom].Clone()
+        h_denom = self._hist(varname_denom).Clone()
+        h_nom = self._hist(varname_nom).Clone()
 
         if rebin > 1:
             h_denom.Rebin(rebin)
@@ -292,100 +615,373 @@ class HistManager(object):
             self._effcache[name] = eff
         return eff
 
+    def get_efficiencies(self, varname_pairs, addunderflow=False, addoverflow=False, integrateToFromLeft=None, integrateToFromRight=None, rebin=1, removeProbeBinsNEntriesBelow=0, statistic='clopper_pearson', level=CONF_LEVEL):
+        """
+        Efficiencies for a list of (numerator, denominator) varname pairs with the intervals of all bins computed at once
+        The options are applied like in get_efficiency() and get_efficiency_int(), returns a list of Efficiency objects
+        """
+        options = (addunderflow, addoverflow, integrateToFromLeft, integrateToFromRight, rebin, removeProbeBinsNEntriesBelow, statistic, level)
+        todo = []
+        pending = set()
+        for varname_nom, varname_denom in varname_pairs:
+            key = (varname_nom, varname_denom) + options
+            if key in self._effcache or key in pending:
+                continue
+            pending.add(key)
+            nh_denom = self._numpy_hist(varname_denom)
+            axis = nh_denom.axis
+            denom = nh_denom.sumw.astype('d')
+            nom = self._numpy_hist(varname_nom).sumw.astype('d')
+            if rebin > 1:
+                denom = rebin_contents(denom, rebin)
+                nom = rebin_contents(nom, rebin)
+                axis = axis.rebinned(rebin)
+            nbins = axis.nbins
+            for conts in [denom, nom]:
+                if addunderflow:
+                    conts[1] += conts[0]
+                if addoverflow:
+                    conts[nbins] += conts[nbins+1]
+                if integrateToFromLeft != None:
+                    lCutBin = axis.find_bins([integrateToFromLeft])[0]
+                    conts[1:lCutBin+1] = conts[:lCutBin+1].sum()
+                if integrateToFromRight != None:
+                    # include the bin just below the axis cut if it falls on a bin edge
+                    rCutBin = axis.find_bins([integrateToFromRight])[0]
+                    if rCutBin > 0 and axis.bin_edges()[rCutBin-1] == integrateToFromRight:
+                        rCutBin -= 1
+                    conts[rCutBin:nbins] = conts[rCutBin:].sum()
+            if removeProbeBinsNEntriesBelow > 0:
+                remove = np.zeros(nbins+2, dtype=bool)
+                remove[1:nbins] = denom[1:nbins] < removeProbeBinsNEntriesBelow
+                nom[remove] = 0.
+                denom[remove] = 0.
+            todo.append((key, axis, nom, denom))
+        if len(todo) > 0:
+            names = ["{nom}_o_{denom}".format(nom=key[0], denom=key[1]) for key, axis, nom, denom in todo]
+            effs = compute_efficiencies(names, [axis for key, axis, nom, denom in todo], [nom for key, axis, nom, denom in todo], [denom for key, axis, nom, denom in todo], statistic, level)
+            for (key, axis, nom, denom), eff in zip(todo, effs):
+                self._effcache[key] = eff
+        return [self._effcache[(varname_nom, varname_denom) + options] for varname_nom, varname_denom in varname_pairs]
+
+    def _numpy_hist(self, varname):
+        """NumpyHist1D with the contents of varname, converted only if it is not kept as one"""
+        if varname not in self._category_of:
+            self._flush(varname)
+            h = self._get_hist(varname)
+            if isinstance(h, NumpyHist1D):
+                return h
+        return NumpyHist1D.from_root(self._hist(varname))
+
 
 class HistManager2d(object):
     """Class that manages and holds 2D histograms"""
-    def __init__(self, varnames=[], binning_dict={}, profile_dict={}, ytitle="# Muons", prefix="", filename=None, subdir=None):
+    def __init__(self, varnames=[], binning_dict={}, profile_dict={}, ytitle="# Muons", prefix="", filename=None, subdir=None, buffer_size=1000, backend='root', lazy=False, write_empty=True, storage='auto', preload=None, max_buffered=100000):
         super(HistManager2d, self).__init__()
-        self.varnames = varnames
-        self.binnings = binning_dict
-        self.profiles = profile_dict
+        self.varnames = list(varnames)
+        self.binnings = dict(binning_dict)
+        self.profiles = dict(profile_dict)
         self.prefix = prefix
+        self.buffer_size = buffer_size
+        # all buffers are flushed when they hold max_buffered values together, so that many
+        # rarely filled histograms cannot accumulate large buffers
+        self.max_buffered = max_buffered
+        self._n_buffered = 0
+        # 'root' keeps ROOT histograms, 'numpy' keeps NumpyHist2D objects that are converted in get()
+        self.backend = backend
+        # with lazy booking only the binning is kept until the first fill of a histogram,
+        # when reading from a file only the histogram names until the first get()
+        self.lazy = lazy
+        # write() skips histograms that were never filled when False
+        self.write_empty = write_empty
+        # 'auto' keeps histograms without sum of squared weights until a weight != 1 is filled
+        # and adds the errors on export, 'weighted' books them with Sumw2 from the start
+        self.storage = storage
         root.TGaxis().SetMaxDigits(3)
 
         self.hists = {}
+        # x values, y values and weights of scalar fill() calls not yet filled into the histograms, as arrays of doubles
+        self._buffers = {}
+        # lists of HistHandle2d objects per category key, see book_handles()
+        self.handles = {}
 
         self._stackcache = {}
         self._effcache = {}
         self._ratiocache = {}
         self._thresholdcache = {}
 
+        # input file and names of the histograms in it that are not read yet, see load()
+        self._filename = filename
+        self._subdir = subdir
+        self._unloaded = set()
+        # weight, estimated selected events and uncertainty if the input file is from a sampled run,
+        # the histograms hold the sampled events, counts are scaled to the full input with the weight by the caller
+        self.sample = None
+        self.sample_weight = 1.
+
         if filename is None:
             for vname in varnames:
-                binning_x = self.binnings[vname][0]
-                binning_y = self.binnings[vname][1]
-                have_unit_x = type(binning_x[-2]) is str
-                have_unit_y = type(binning_y[-2]) is str
-                if have_unit_x:
-                    nbinsx = len(binning_x)-4
-                    binsx = array('d', binning_x[1:-2])
-                else:
-                    nbinsx = len(binning_x)-3
-                    binsx = array('d', binning_x[1:-1])
-                if have_unit_y:
-                    nbinsy = len(binning_y)-4
-                    binsy = array('d', binning_y[1:-2])
-                else:
-                    nbinsy = len(binning_y)-3
-                    binsy = array('d', binning_y[1:-1])
-                # variable binning when nBins == -1
-                if binning_x[0] < 0 and binning_y[0] < 0:
-                    if vname in self.profiles and self.profiles[vname] == True:
-                        self.hists[vname] = root.TProfile2D(prefix+vname, "", nbinsx, binsx, nbinsy, binsy)
-                    else:
-                        self.hists[vname] = root.TH2D(prefix+vname, "", nbinsx, binsx, nbinsy, binsy)
-                elif binning_x[0] < 0: # fixed binning on y axis
-                    if vname in self.profiles and self.profiles[vname] == True:
-                        self.hists[vname] = root.TProfile2D(prefix+vname, "", nbinsx, binsx, binning_y[0], binning_y[1], binning_y[2])
-                    else:
-                        self.hists[vname] = root.TH2D(prefix+vname, "", nbinsx, binsx, binning_y[0], binning_y[1], binning_y[2])
-                elif binning_y[0] < 0: # fixed binning on x axis
-                    if vname in self.profiles and self.profiles[vname] == True:
-                        self.hists[vname] = root.TProfile2D(prefix+vname, "", binning_x[0], binning_x[1], binning_x[2], nbinsy, binsy)
-                    else:
-                        self.hists[vname] = root.TH2D(prefix+vname, "", binning_x[0], binning_x[1], binning_x[2], nbinsy, binsy)
-                else: # fixed binning
-                    if vname in self.profiles and self.profiles[vname] == True:
-                        self.hists[vname] = root.TProfile2D(prefix+vname, "", binning_x[0], binning_x[1], binning_x[2], binning_y[0], binning_y[1], binning_y[2])
-                    else:
-                        self.hists[vname] = root.TH2D(prefix+vname, "", binning_x[0], binning_x[1], binning_x[2], binning_y[0], binning_y[1], binning_y[2])
-                self.hists[vname].Sumw2()
-
-                if not have_unit_x:
-                    xtitle = binning_x[-1]
-                elif binning_x[-1] is None:
-                    xtitle = binning_x[-2]
-                else:
-                    xtitle = "{title} ({unit})".format(title=binning_x[-2], unit=binning_x[-1])
+                if not lazy:
+                    self.hists[vname] = self._book(vname)
+                self._buffers[vname] = (array('d'), array('d'), array('d'))
+        else:
+            self.backend = 'root'
+            self.varnames, self.sample = _read_index(filename, subdir, 'TH2')
+            if self.sample:
+                self.sample_weight = self.sample[0]
+            for hName in self.varnames:
+                self._buffers[hName] = (array('d'), array('d'), array('d'))
+            self._unloaded = set(self.varnames)
+            if not lazy:
+                self.load()
+            elif preload:
+                self.load(preload)
 
-                if not have_unit_y:
-                    ytitle = binning_y[-1]
-                elif binning_y[-1] is None:
-                    ytitle = binning_y[-2]
-                else:
-                    ytitle = "{title} ({unit})".format(title=binning_y[-2], unit=binning_y[-1])
+    def _book(self, vname):
+        if self.backend == 'numpy':
+            return NumpyHist2D(self.prefix+vname, Axis.from_binning(self.binnings[vname][0]), Axis.from_binning(self.binnings[vname][1]), profile=self.get_profile(vname), weighted=(self.storage == 'weighted'))
+        binning_x = self.binnings[vname][0]
+        binning_y = self.binnings[vname][1]
+        have_unit_x = type(binning_x[-2]) is str
+        have_unit_y = type(binning_y[-2]) is str
+        if have_unit_x:
+            nbinsx = len(binning_x)-4
+            binsx = array('d', binning_x[1:-2])
+        else:
+            nbinsx = len(binning_x)-3
+            binsx = array('d', binning_x[1:-1])
+        if have_unit_y:
+            nbinsy = len(binning_y)-4
+            binsy = array('d', binning_y[1:-2])
+        else:
+            nbinsy = len(binning_y)-3
+            binsy = array('d', binning_y[1:-1])
+        # variable binning when nBins == -1
+        if binning_x[0] < 0 and binning_y[0] < 0:
+            if vname in self.profiles and self.profiles[vname] == True:
+                h = root.TProfile2D(self.prefix+vname, "", nbinsx, binsx, nbinsy, binsy)
+            else:
+                h = root.TH2D(self.prefix+vname, "", nbinsx, binsx, nbinsy, binsy)
+        elif binning_x[0] < 0: # fixed binning on y axis
+            if vname in self.profiles and self.profiles[vname] == True:
+                h = root.TProfile2D(self.prefix+vname, "", nbinsx, binsx, binning_y[0], binning_y[1], binning_y[2])
+            else:
+                h = root.TH2D(self.prefix+vname, "", nbinsx, binsx, binning_y[0], binning_y[1], binning_y[2])
+        elif binning_y[0] < 0: # fixed binning on x axis
+            if vname in self.profiles and self.profiles[vname] == True:
+                h = root.TProfile2D(self.prefix+vname, "", binning_x[0], binning_x[1], binning_x[2], nbinsy, binsy)
+            else:
+                h = root.TH2D(self.prefix+vname, "", binning_x[0], binning_x[1], binning_x[2], nbinsy, binsy)
+        else: # fixed binning
+            if vname in self.profiles and self.profiles[vname] == True:
+                h = root.TProfile2D(self.prefix+vname, "", binning_x[0], binning_x[1], binning_x[2], binning_y[0], binning_y[1], binning_y[2])
+            else:
+                h = root.TH2D(self.prefix+vname, "", binning_x[0], binning_x[1], binning_x[2], binning_y[0], binning_y[1], binning_y[2])
+        # ROOT adds the sum of squared weights by itself when a weight != 1 is filled
+        if self.storage == 'weighted' or self.get_profile(vname):
+            h.Sumw2()
 
-                self.hists[vname].GetXaxis().SetTitle(xtitle)
-                self.hists[vname].GetYaxis().SetTitle(ytitle)
+        if not have_unit_x:
+            xtitle = binning_x[-1]
+        elif binning_x[-1] is None:
+            xtitle = binning_x[-2]
         else:
-            self.varnames = []
-            input = root.TFile(filename)
-            directory = input.GetDirectory(subdir)
-            keyList = directory.GetListOfKeys()
-            for key in keyList:
-                hName = key.GetName()
-                if not directory.Get(hName).InheritsFrom('TH2'):
-                    continue
-                self.varnames.append(hName)
-                self.hists[hName] = directory.Get(hName)
-                self.hists[hName].SetDirectory(0)
-            input.Close()
+            xtitle = "{title} ({unit})".format(title=binning_x[-2], unit=binning_x[-1])
+
+        if not have_unit_y:
+            ytitle = binning_y[-1]
+        elif binning_y[-1] is None:
+            ytitle = binning_y[-2]
+        else:
+            ytitle = "{title} ({unit})".format(title=binning_y[-2], unit=binning_y[-1])
+
+        h.GetXaxis().SetTitle(xtitle)
+        h.GetYaxis().SetTitle(ytitle)
+        return h
 
     def fill(self, varname, valx, valy, weight=1.):
-            self.hists[varname].Fill(valx, valy, weight) # In case of TProfile2d weight is the z value
+        """
+        Buffer one value pair and fill the buffer in bulk once it holds buffer_size pairs
+        In case of TProfile2D weight is the z value
+        """
+        xs, ys, weights = self._buffers[varname]
+        xs.append(valx)
+        ys.append(valy)
+        weights.append(weight)
+        self._n_buffered += 1
+        if len(xs) >= self.buffer_size:
+            self._flush(varname)
+        elif self._n_buffered >= self.max_buffered:
+            self.flush()
+
+    def fill_many(self, varname, xs, ys, weights=None):
+        """
+        Fill sequences of x and y values with one call
+        In case of TProfile2D weights are the z values
+        """
+        if len(xs) > 0:
+            self._fill_n(self._get_hist(varname), xs, ys, weights)
+
+    def get_handle(self, varname):
+        """
+        Handle to fill the histogram varname without looking it up by name for each fill
+        For a varname that is not managed here the handle ignores all fills
+        """
+        if varname not in self._buffers:
+            return NullHistHandle()
+        return HistHandle2d(self, varname)
+
+    def book_handles(self, handle_names):
+        """
+        Resolve handles for a dictionary {key: [varname, ...]}
+        The handle lists are then accessible with self.handles[key]
+        """
+        for key, vnames in handle_names.items():
+            self.handles[key] = [self.get_handle(vname) for vname in vnames]
+
+    def flush(self):
+        """Fill all buffered values into the histograms"""
+        for varname in self._buffers:
+            self._flush(varname)
+        self._n_buffered = 0
+
+    def _flush(self, varname):
+        xs, ys, weights = self._buffers[varname]
+        if len(xs) > 0:
+            self._fill_n(self._get_hist(varname), xs, ys, weights)
+            self._n_buffered -= len(xs)
+            del xs[:]
+            del ys[:]
+            del weights[:]
+
+    def _fill_n(self, h, xs, ys, weights):
+        n = len(xs)
+        if n == 0:
+            return
+        if self.backend == 'numpy':
+            h.fill_many(xs, ys, weights)
+            return
+        if weights is None:
+            weights = [1.]*n
+        if h.InheritsFrom('TProfile2D'):
+            # no FillN with z values for TProfile2D
+            for valx, valy, valz in zip(xs, ys, weights):
+                h.Fill(valx, valy, valz)
+        else:
+            h.FillN(n, array('d', xs), array('d', ys), array('d', weights))
+
+    def _get_hist(self, varname):
+        """Histogram object for varname, booked or read from the input file now if that was deferred"""
+        h = self.hists.get(varname)
+        if h is None:
+            if varname in self._unloaded:
+                self._load([varname])
+                return self.hists[varname]
+            h = self._book(varname)
+            self.hists[varname] = h
+        return h
+
+    def load(self, patterns=None):
+        """
+        Read the histograms that were not read from the input file yet,
+        all of them or only those with names matching one of the shell-style patterns
+        """
+        self._load([vname for vname in self.varnames if vname in self._unloaded and (patterns is None or any(fnmatch(vname, p) for p in patterns))])
+
+    def _load(self, varnames):
+        """Read the histograms varnames, the input file is only open while they are read"""
+        if varnames:
+            self.hists.update(_read_hists(self._filename, self._subdir, varnames))
+            self._unloaded.difference_update(varnames)
 
     def get(self, varname):
-        return self.hists[varname]
+        self._flush(varname)
+        h = self._get_hist(varname)
+        if self.backend == 'numpy':
+            return h.to_root()
+        return _with_errors(h)
+
+    def is_booked(self, varname):
+        """False if booking of varname is deferred and it has not been filled yet"""
+        return varname in self.hists or varname in self._unloaded or len(self._buffers[varname][0]) > 0
+
+    def write(self):
+        """Write the histograms to the current directory, skipping never filled ones unless write_empty is set"""
+        for varname in self.varnames:
+            if self.write_empty or self.is_booked(varname):
+                self.get(varname).Write()
+
+    def merge(self, other):
+        """
+        Add the contents of another HistManager2d
+        Histograms only present in other are added to this manager
+        """
+        self.flush()
+        other.flush()
+        self.load()
+        other.load()
+        for vname in other.varnames:
+            if vname not in other.hists:
+                continue
+            h = other.hists[vname]
+            if self.backend == 'numpy' and other.backend != 'numpy':
+                h = NumpyHist2D.from_root(h)
+            elif self.backend != 'numpy' and other.backend == 'numpy':
+                h = h.to_root()
+            if vname not in self._buffers:
+                self.varnames.append(vname)
+                self._buffers[vname] = (array('d'), array('d'), array('d'))
+                if vname in other.binnings:
+                    self.binnings[vname] = other.binnings[vname]
+                if vname in other.profiles:
+                    self.profiles[vname] = other.profiles[vname]
+            if vname in self.hists:
+                if self.backend == 'numpy':
+                    self.hists[vname] += h
+                else:
+                    self.hists[vname].Add(h)
+            elif self.backend == 'numpy':
+                self.hists[vname] = copy.deepcopy(h)
+            else:
+                self.hists[vname] = h.Clone()
+                self.hists[vname].SetDirectory(0)
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def serialize(self):
+        """
+        Compact binary representation of the histogram names, binnings and contents
+        to ship between processes or to store partial results, see deserialize()
+        """
+        self.flush()
+        self.load()
+        if self.backend == 'numpy':
+            hists = self.hists
+        else:
+            hists = dict((vname, NumpyHist2D.from_root(h)) for vname, h in self.hists.items())
+        state = {'varnames':self.varnames, 'binnings':self.binnings, 'profiles':self.profiles, 'prefix':self.prefix, 'storage':self.storage, 'hists':hists}
+        return zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def deserialize(data, backend='numpy'):
+        """Create a HistManager2d from the output of serialize()"""
+        state = pickle.loads(zlib.decompress(data))
+        hm = HistManager2d(state['varnames'], state['binnings'], state['profiles'], prefix=state['prefix'], backend=backend, lazy=True, storage=state.get('storage', 'auto'))
+        for vname, h in state['hists'].items():
+            hm.hists[vname] = h if backend == 'numpy' else h.to_root()
+        return hm
+
+    def save_partial(self, filename):
+        """Write the serialized histograms to a file, see load_partial()"""
+        with open(filename, 'wb') as f:
+            f.write(self.serialize())
+
+    @staticmethod
+    def load_partial(filename, backend='numpy'):
+        with open(filename, 'rb') as f:
+            return HistManager2d.deserialize(f.read(), backend=backend)
 
     def get_varnames(self):
         return self.varnames
@@ -400,13 +996,230 @@ class HistManager2d(object):
             return False
 
 
+def _with_errors(h):
+    """
+    h or, for a histogram stored without sum of squared weights, a detached copy with the errors
+    The stored histogram keeps filling without the sum of squared weights after the export.
+    """
+    if h.GetSumw2N() > 0:
+        return h
+    h = h.Clone()
+    h.SetDirectory(0)
+    h.Sumw2()
+    return h
+
+
+def _read_index(filename, subdir, base_class):
+    """
+    Names of the histograms inheriting from base_class in subdir of filename and the sample
+    parameters of the file, see read_sample(). The file is closed again.
+    """
+    infile = root.TFile(filename)
+    try:
+        return _hist_names(infile.GetDirectory(subdir if subdir else ''), base_class), read_sample(infile)
+    finally:
+        infile.Close()
+
+
+def _read_hists(filename, subdir, varnames):
+    """Read the histograms varnames from subdir of filename, detached from the file that is closed again"""
+    infile = root.TFile(filename)
+    try:
+        directory = infile.GetDirectory(subdir if subdir else '')
+        hists = {}
+        for varname in varnames:
+            h = directory.Get(varname)
+            h.SetDirectory(0)
+            hists[varname] = h
+        return hists
+    finally:
+        infile.Close()
+
+
+def _hist_names(directory, base_class):
+    """Names of the objects inheriting from base_class in a directory, read from the keys only"""
+    names = []
+    seen = set()
+    inherits = {}
+    for key in directory.GetListOfKeys():
+        hName = key.GetName()
+        cName = key.GetClassName()
+        if cName not in inherits:
+            inherits[cName] = root.TClass.GetClass(cName).InheritsFrom(base_class)
+        # keys of older cycles of an object come after the latest one
+        if inherits[cName] and hName not in seen:
+            seen.add(hName)
+            names.append(hName)
+    return names
+
+
+class HistHandle(object):
+    """Pre-resolved fill access to one histogram of a HistManager"""
+    __slots__ = ('hm', 'varname', 'values', 'weights')
+
+    def __init__(self, hm, varname):
+        self.hm = hm
+        self.varname = varname
+        # the manager empties its buffers in place so these references stay valid
+        self.values, self.weights = hm._buffers[varname]
+
+    def fill(self, val, weight=1.):
+        self.values.append(val)
+        self.weights.append(weight)
+        hm = self.hm
+        hm._n_buffered += 1
+        if len(self.values) >= hm.buffer_size:
+            hm._flush(self.varname)
+        elif hm._n_buffered >= hm.max_buffered:
+            hm.flush()
+
+    def fill_many(self, values, weights=None):
+        self.hm.fill_many(self.varname, values, weights)
+
+
+class HistHandle2d(object):
+    """Pre-resolved fill access to one histogram of a HistManager2d"""
+    __slots__ = ('hm', 'varname', 'xs', 'ys', 'weights')
+
+    def __init__(self, hm, varname):
+        self.hm = hm
+        self.varname = varname
+        self.xs, self.ys, self.weights = hm._buffers[varname]
+
+    def fill(self, valx, valy, weight=1.):
+        self.xs.append(valx)
+        self.ys.append(valy)
+        self.weights.append(weight)
+        hm = self.hm
+        hm._n_buffered += 1
+        if len(self.xs) >= hm.buffer_size:
+            hm._flush(self.varname)
+        elif hm._n_buffered >= hm.max_buffered:
+            hm.flush()
+
+    def fill_many(self, xs, ys, weights=None):
+        self.hm.fill_many(self.varname, xs, ys, weights)
+
+
+class NullHistHandle(object):
+    """Handle for a histogram that is not booked, e.g. in a reduced histogram set"""
+    __slots__ = ()
+
+    def fill(self, *args):
+        pass
+
+    def fill_many(self, *args):
+        pass
+
+
+class RunHistStore(object):
+    """
+    Holds a tuple of histogram managers per run and keeps at most max_resident runs in memory.
+    When the limit is exceeded the least recently filled run is spilled to files in spill_dir
+    with save_partial() and merged back when the run is read with items(). Spill files are never
+    rewritten, a run that is spilled again gets new files, so checkpoints can refer to them.
+    book_func(runnr) books the managers for a new run. max_resident=0 means no limit.
+    """
+    def __init__(self, book_func, max_resident=0, spill_dir=None):
+        super(RunHistStore, self).__init__()
+        self.book_func = book_func
+        self.max_resident = max_resident
+        self.spill_dir = spill_dir
+        self._own_spill_dir = False
+        self._resident = OrderedDict()
+        # runnr -> one list of file names per spill, with one file per manager
+        self._spilled = {}
+        # temporary spill directories of other stores whose files were taken over with set_state()
+        self._adopted_dirs = set()
+
+    def __contains__(self, runnr):
+        return runnr in self._resident or runnr in self._spilled
+
+    def __getitem__(self, runnr):
+        """Managers to fill for runnr, booked if the run is not resident"""
+        managers = self._resident.pop(runnr, None)
+        if managers is None:
+            managers = self.book_func(runnr)
+        self._resident[runnr] = managers
+        while self.max_resident > 0 and len(self._resident) > self.max_resident:
+            self._spill(*self._resident.popitem(last=False))
+        return managers
+
+    def runs(self):
+        return sorted(set(self._resident.keys()) | set(self._spilled.keys()))
+
+    def items(self):
+        """
+        (runnr, managers) for all runs, loaded one run at a time
+        For a spilled run the managers are a new sum of the resident and the spilled contents.
+        """
+        for runnr in self.runs():
+            managers = self._resident.get(runnr)
+            if runnr in self._spilled:
+                merged = self.book_func(runnr)
+                if managers is not None:
+                    for m, resident in zip(merged, managers):
+                        m.merge(resident)
+                for fnames in self._spilled[runnr]:
+                    for m, fname in zip(merged, fnames):
+                        m.merge(m.load_partial(fname, backend=m.backend))
+                managers = merged
+            yield runnr, managers
+
+    def get_state(self):
+        """
+        Picklable state for a checkpoint with the contents of the resident runs
+        and only the names of the spill files of the others
+        """
+        return {'resident':dict((runnr, [m.serialize() for m in managers]) for runnr, managers in self._resident.items()),
+                'spilled':dict((runnr, [list(fnames) for fnames in spills]) for runnr, spills in self._spilled.items()),
+                'spill_dir':self.spill_dir if self._own_spill_dir else None}
+
+    def set_state(self, state):
+        """Add the contents from get_state(), the spill files are taken over and removed with cleanup()"""
+        for runnr, run_data in sorted(state['resident'].items()):
+            for m, data in zip(self[runnr], run_data):
+                m.merge(type(m).deserialize(data, backend=m.backend))
+        for runnr, spills in state['spilled'].items():
+            self._spilled.setdefault(runnr, []).extend(spills)
+        if state['spill_dir'] is not None and state['spill_dir'] != self.spill_dir:
+            self._adopted_dirs.add(state['spill_dir'])
+
+    def cleanup(self):
+        """Remove all spill files and the temporary spill directories"""
+        for spills in self._spilled.values():
+            for fnames in spills:
+                for fname in fnames:
+                    if os.path.exists(fname):
+                        os.remove(fname)
+        self._spilled = {}
+        tmp_dirs = self._adopted_dirs | (set([self.spill_dir]) if self._own_spill_dir else set())
+        for directory in tmp_dirs:
+            if os.path.isdir(directory) and len(os.listdir(directory)) == 0:
+                os.rmdir(directory)
+        self._adopted_dirs = set()
+
+    def _spill(self, runnr, managers):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='run_histos_')
+            self._own_spill_dir = True
+        fnames = []
+        for m in managers:
+            # unique names, also for several processes with the same spill directory
+            fd, fname = tempfile.mkstemp(prefix='run{r}_'.format(r=runnr), suffix='.hist', dir=self.spill_dir)
+            os.close(fd)
+            m.save_partial(fname)
+            fnames.append(fname)
+        self._spilled.setdefault(runnr, []).append(fnames)
+
+
 class L1AnalysisHistManager(HistManager):
     """Class that manages and holds histograms"""
     def __init__(self, varnames, binning_dict, prefix=""):
         super(L1AnalysisHistManager, self).__init__(varnames, binning_dict, prefix=prefix)
 
     def fill(self, varname, val):
-        self.hists[varname].Fill(val)
+        super(L1AnalysisHistManager, self).fill(varname, val)
 
 
 class VarExp(object):
@@ -0,0 +1,96 @@
+import inspect
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+
+class StageProfiler(object):
+    """
+    Wall clock time and number of calls per analysis stage
+    Methods of classes are timed with instrument(), other code with the stage() context manager.
+    Calls nested in a timed call are counted for the outer stage only.
+    """
+    def __init__(self):
+        super(StageProfiler, self).__init__()
+        self.seconds = OrderedDict()
+        self.calls = OrderedDict()
+        self._active = None
+        self._patched = []
+
+    def add_stage(self, name):
+        if name not in self.seconds:
+            self.seconds[name] = 0.
+            self.calls[name] = 0
+
+    def reset(self):
+        """Set the time and the number of calls of all stages to zero"""
+        for name in self.seconds:
+            self.seconds[name] = 0.
+            self.calls[name] = 0
+
+    @contextmanager
+    def stage(self, name):
+        self.add_stage(name)
+        if self._active is not None:
+            yield
+            return
+        self._active = name
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.seconds[name] += default_timer() - start
+            self.calls[name] += 1
+            self._active = None
+
+    def _timed(self, name, func):
+        def timed(*args, **kwargs):
+            if self._active is not None:
+                return func(*args, **kwargs)
+            self._active = name
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[name] += default_timer() - start
+                self.calls[name] += 1
+                self._active = None
+        return timed
+
+    def instrument(self, name, cls, methods=None):
+        """
+        Time the calls of methods of cls as stage name until restore() is called
+        Without methods all public functions and static methods defined in cls are timed
+        """
+        self.add_stage(name)
+        if methods is None:
+            methods = [m for m, attr in cls.__dict__.items() if not m.startswith('_') and (isinstance(attr, staticmethod) or inspect.isfunction(attr))]
+        for m in methods:
+            attr = cls.__dict__[m]
+            if isinstance(attr, staticmethod):
+                setattr(cls, m, staticmethod(self._timed(name, attr.__get__(None, cls))))
+            else:
+                setattr(cls, m, self._timed(name, attr))
+            self._patched.append((cls, m, attr))
+
+    def restore(self):
+        """Remove the timing from all instrumented methods"""
+        for cls, m, attr in reversed(self._patched):
+            setattr(cls, m, attr)
+        self._patched = []
+
+    def report(self, total):
+        """One line with the fraction of the total time spent in each stage"""
+        fractions = ['{s}: {f:.1f}%'.format(s=name, f=100.*seconds/total if total > 0 else 0.) for name, seconds in self.seconds.items()]
+        other = total - sum(self.seconds.values())
+        fractions.append('other: {f:.1f}%'.format(f=100.*other/total if total > 0 else 0.))
+        return ', '.join(fractions)
+
+    def stages(self, total):
+        """Time, number of calls and fraction of the total time per stage, the remaining time as stage other"""
+        stages = OrderedDict()
+        for name, seconds in self.seconds.items():
+            stages[name] = {'seconds':seconds, 'calls':self.calls[name], 'fraction':seconds/total if total > 0 else 0.}
+        other = total - sum(self.seconds.values())
+        stages['other'] = {'seconds':other, 'calls':0, 'fraction':other/total if total > 0 else 0.}
+        return stages
@@ -0,0 +1,107 @@
+import bisect
+import itertools
+import math
+import random
+
+# parameters written to the output of a sampled job, they add up when job outputs are merged
+SAMPLE_PARAMS = ('sample_selected', 'sample_estimate', 'sample_variance')
+
+
+class ClusterSample(object):
+    """
+    Stratified random sample of the clusters of an L1Ntuple
+    clusters is a list of (tree number, first entry, last entry + 1) as given by L1Ntuple.clusters().
+    Consecutive files are grouped into strata with at least min_per_stratum sampled clusters
+    and in every stratum the given fraction of the clusters is drawn at random. Only whole
+    clusters are read, so the I/O scales with the fraction.
+    The selected events counted per sampled cluster with count() give the estimate of the
+    number of selected events in the full input and its statistical uncertainty.
+    The histograms of the selected events are scaled to the full input with weight(), the ratio
+    of the estimate to the number of selected sampled events.
+    """
+    def __init__(self, clusters, fraction, seed=1, min_per_stratum=2):
+        super(ClusterSample, self).__init__()
+        if not 0. < fraction <= 1.:
+            raise ValueError("Sample fraction {f} not in (0, 1]".format(f=fraction))
+        self.fraction = fraction
+        self.seed = seed
+        self.total_entries = sum(last-first for tree_number, first, last in clusters)
+
+        # strata of whole files with enough clusters to estimate the variance in each
+        strata = []
+        stratum = []
+        min_clusters = int(math.ceil(min_per_stratum/fraction))
+        for tree_number, file_clusters in itertools.groupby(clusters, key=lambda c: c[0]):
+            stratum.extend(file_clusters)
+            if len(stratum) >= min_clusters:
+                strata.append(stratum)
+                stratum = []
+        if len(stratum) > 0:
+            if len(strata) > 0:
+                strata[-1].extend(stratum)
+            else:
+                strata.append(stratum)
+
+        rng = random.Random(seed)
+        # (number of clusters in the stratum, indices of its clusters in self.sampled)
+        self.strata = []
+        self.sampled = []
+        for stratum in strata:
+            n = max(1, int(round(fraction*len(stratum))))
+            idcs = range(len(self.sampled), len(self.sampled)+n)
+            self.sampled += [stratum[i][1:] for i in sorted(rng.sample(range(len(stratum)), n))]
+            self.strata.append((len(stratum), idcs))
+        self.starts = [first for first, last in self.sampled]
+        self.sampled_entries = sum(last-first for first, last in self.sampled)
+        self.counts = [0] * len(self.sampled)
+
+    def entries(self):
+        """The entries of all sampled clusters in increasing order"""
+        return [i for first, last in self.sampled for i in xrange(first, last)]
+
+    def weight(self):
+        """Estimated selected events in the full input per selected sampled event"""
+        selected = sum(self.counts)
+        return self.estimate()[0]/selected if selected > 0 else 0.
+
+    def count(self, entry):
+        """Count a selected event"""
+        self.counts[bisect.bisect_right(self.starts, entry)-1] += 1
+
+    def add_counts(self, counts):
+        """Add the counts of another process with the same sample"""
+        self.counts = [c1+c2 for c1, c2 in zip(self.counts, counts)]
+
+    def estimate(self):
+        """
+        Estimated number of selected events in the full input and its statistical uncertainty
+        from the spread of the counts between the sampled clusters of every stratum
+        """
+        total = 0.
+        variance = 0.
+        for n_clusters, idcs in self.strata:
+            counts = [self.counts[i] for i in idcs]
+            n = len(counts)
+            mean = sum(counts)/float(n)
+            total += n_clusters*mean
+            if n > 1:
+                s2 = sum((c-mean)**2 for c in counts)/(n-1.)
+                variance += n_clusters**2 * (1.-float(n)/n_clusters) * s2/n
+        return total, math.sqrt(variance)
+
+    def parameters(self):
+        """(name, value) of the sample parameters for the output file, see read_sample()"""
+        estimate, uncertainty = self.estimate()
+        return zip(SAMPLE_PARAMS, [float(sum(self.counts)), estimate, uncertainty**2])
+
+
+def read_sample(directory):
+    """
+    Weight, estimated number of selected events in the full input and its uncertainty
+    from the sample parameters in a (merged) output file, None if the input was not sampled
+    """
+    params = [directory.Get(name) for name in SAMPLE_PARAMS]
+    if not all(params):
+        return None
+    selected, estimate, variance = [p.GetVal() for p in params]
+    return (estimate/selected if selected > 0 else 0.), estimate, math.sqrt(variance)
@@ -65,6 +65,66 @@ class Matcher(object):
         return sorted(index_tuples, key=lambda idx_dr: idx_dr[2])
 
 
+class DistanceTable(object):
+    """
+    Distances in eta, phi and R between the objects of two collections, computed once per pair
+    match() returns the same list as Matcher.match_dr for a match in delta R and
+    as Matcher.match_dr with zeroed phi or eta coordinates for a match in delta eta or delta phi.
+    The table can be shared by all selections, cuts and match types in an event.
+    """
+    def __init__(self, eta_coll1, phi_coll1, eta_coll2, phi_coll2, phi_normalize=True):
+        self.eta_coll1 = eta_coll1
+        self.phi_coll1 = phi_coll1
+        self.eta_coll2 = eta_coll2
+        self.phi_coll2 = phi_coll2
+        self.phi_normalize = phi_normalize
+        self._deltas = {}
+
+    def deltas(self, i, j):
+        """dR, deta and dphi between object i of collection1 and object j of collection2"""
+        try:
+            return self._deltas[(i, j)]
+        except KeyError:
+            deta = self.eta_coll1[i] - self.eta_coll2[j]
+            phi1 = self.phi_coll1[i]
+            phi2 = self.phi_coll2[j]
+            if self.phi_normalize:
+                phi1 = Matcher.norm_phi(phi1)
+                phi2 = Matcher.norm_phi(phi2)
+            dphi = Matcher.delta_phi(phi1, phi2)
+            deltas = (math.sqrt(deta*deta + dphi*dphi), deta, dphi)
+            self._deltas[(i, j)] = deltas
+            return deltas
+
+    def match(self, delta_type='dr', cut=0.5, idcs1=None, idcs2=None):
+        """
+        Sorted list of index pairs with the distance of type delta_type ('dr', 'deta' or 'dphi') below cut
+        The tuples have the same format as the ones from Matcher.match_dr
+        """
+        index_tuples = []
+        if idcs1 is None:
+            idcs1 = range(self.eta_coll1.size())
+        if idcs2 is None:
+            idcs2 = range(self.eta_coll2.size())
+
+        for i in idcs1:
+            for j in idcs2:
+                dr, deta, dphi = self.deltas(i, j)
+                if delta_type == 'dr':
+                    if dr < cut:
+                        index_tuples.append([i, j, dr, deta, dphi])
+                elif delta_type == 'deta':
+                    if math.fabs(deta) < cut:
+                        index_tuples.append([i, j, math.fabs(deta), deta, 0.])
+                elif delta_type == 'dphi':
+                    if math.fabs(dphi) < cut:
+                        index_tuples.append([i, j, math.fabs(dphi), 0., dphi])
+                else:
+                    raise ValueError("Unknown match type: {t}".format(t=delta_type))
+
+        return sorted(index_tuples, key=lambda idx_dr: idx_dr[2])
+
+
 class MuonSelections(object):
     """Class containing functions for commonly used muon selections"""
 
@@ -1,8 +1,10 @@
 from sys import exit
 import argparse
 import logging
+import multiprocessing
 import os
 import subprocess
+import time
 
 from L1Analysis import L1Ana, L1Ntuple
 
@@ -22,6 +24,9 @@ def parse_options_and_init_log(loglevel=logging.INFO):
     parser.add_argument("-p", "--subparser", dest="subparser", default="ntuple", type=str, help="Subparser for script [default: %default]")
     parser.add_argument("--split_by_file", dest="split_by_file", action="store_true", help="File based splitting instead of event number based splitting")
     parser.add_argument("--submit", dest="submit", action="store_true", help="Submit jobs after creation")
+    parser.add_argument("--backend", dest="backend", default="lsf", choices=["lsf", "local"], help="Submit the jobs to LSF or run them on this machine and merge the outputs at the end")
+    parser.add_argument("--local-workers", dest="local_workers", default=multiprocessing.cpu_count(), type=int, help="Number of jobs to run at the same time with the local backend")
+    parser.add_argument("--retries", dest="retries", default=1, type=int, help="Number of times a failed job is started again with the local backend")
     parser.add_argument("--cmd-line-args", dest="args", type=str, default=None, help="Command line arguments for script")
 
     opts, unknown = parser.parse_known_args()
@@ -38,6 +43,49 @@ def parse_options_and_init_log(loglevel=logging.INFO):
     return opts
 
 
+def run_local(job_scripts, cwd, log_dir, workers, retries, poll=1.):
+    """
+    Run the job scripts on this machine with at most workers jobs at the same time
+    The output of every job goes to job_<i>.log in log_dir, a failed job is started
+    again up to retries times with the output of every attempt appended to its log.
+    RETURNS: the indices of the jobs that failed in all attempts
+    """
+    waiting = [(i, 0) for i in range(len(job_scripts))]
+    running = {}
+    failed = []
+    try:
+        while len(waiting) > 0 or len(running) > 0:
+            while len(waiting) > 0 and len(running) < workers:
+                i, attempt = waiting.pop(0)
+                log = open(os.path.join(log_dir, "job_{i}.log".format(i=i)), "a" if attempt > 0 else "w")
+                log.write("=== attempt {a} of {script}\n".format(a=attempt+1, script=job_scripts[i]))
+                log.flush()
+                running[i] = (subprocess.Popen(["sh", job_scripts[i]], cwd=cwd, stdout=log, stderr=subprocess.STDOUT), log, attempt)
+                L1Ana.log.info("Started job {i}{retry}".format(i=i, retry=", retry {a}".format(a=attempt) if attempt > 0 else ""))
+            time.sleep(poll)
+            for i, (process, log, attempt) in running.items():
+                returncode = process.poll()
+                if returncode is None:
+                    continue
+                log.close()
+                del running[i]
+                if returncode == 0:
+                    L1Ana.log.info("Job {i} finished".format(i=i))
+                elif attempt < retries:
+                    L1Ana.log.warning("Job {i} failed with exit code {c}, starting it again".format(i=i, c=returncode))
+                    waiting.append((i, attempt+1))
+                else:
+                    L1Ana.log.error("Job {i} failed with exit code {c}, see {log}".format(i=i, c=returncode, log=log.name))
+                    failed.append(i)
+    finally:
+        # on Ctrl-C the running jobs are stopped as well
+        for process, log, attempt in running.values():
+            if process.poll() is None:
+                process.terminate()
+            log.close()
+    return sorted(failed)
+
+
 def main():
     L1Ana.init_l1_analysis()
     print ""
@@ -69,13 +117,15 @@ def main():
         os.makedirs(opts.workdir+"/scripts")
     if opts.flist and opts.split_by_file and not os.path.exists(opts.workdir+"/filelists"):
         os.makedirs(opts.workdir+"/filelists")
+    if opts.backend == "local" and not os.path.exists(opts.workdir+"/logs"):
+        os.makedirs(opts.workdir+"/logs")
 
     start_up = "cd {cmssw_dir}/src\n".format(cmssw_dir=os.environ["CMSSW_BASE"])
     start_up += "eval `scram runtime -sh`\n"
     start_up += "cd {pwd}\n".format(pwd=os.getcwd())
 
     submission_string = ""
-    hadd_string = "hadd " + os.path.abspath(opts.outname+"/out/{oname}_comb.root".format(oname=opts.outname))+" "
+    merge_inputs = []
     # job_dir = os.path.abspath(opts.outname+"/scripts/")
 
     job_dir = os.path.abspath(opts.workdir+"/scripts/")
@@ -85,7 +135,7 @@ def main():
         with open(opts.workdir+"/scripts/job_{i}.sh".format(i=i), "w") as job_script:
             job_script.write(start_up)
             outfile = opts.workdir+"/out/{name}_{n}.root".format(name=opts.outname, n=i)
-            hadd_string += outfile + " "
+            merge_inputs.append(os.path.abspath(outfile))
             if opts.flist:
                 if opts.split_by_file:
                     flistpath = opts.workdir+"/filelists/flist_{i}.txt".format(i=i)
@@ -112,11 +162,26 @@ def main():
     with open(opts.workdir+"/submit.sh", "w") as submitfile:
         submitfile.write(submission_string)
     os.system('chmod 744 {dir}/submit.sh'.format(dir=opts.workdir))
+    # merge the job outputs in parallel with a check of every output, options like --watch are passed on
+    merge_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mergeHistos.py")
+    merge_string = "python {script} \"$@\" -o {out} {inputs}\n".format(script=merge_script, out=os.path.join(out_dir, "{oname}_comb.root".format(oname=opts.outname)), inputs=" ".join(merge_inputs))
     with open(opts.workdir+"/combine.sh", "w") as combfile:
-        combfile.write(hadd_string)
+        combfile.write(merge_string)
     os.system('chmod 744 {dir}/combine.sh'.format(dir=opts.workdir))
 
     print "Will process", n_per_job, "events per job"
+    if opts.backend == "local":
+        if not opts.submit:
+            print "run again with --submit to run the jobs on this machine"
+            return
+        job_scripts = [os.path.join(job_dir, "job_{i}.sh".format(i=i)) for i in range(opts.njobs)]
+        L1Ana.log.info("Running {n} jobs with {w} at a time, logs in {dir}".format(n=opts.njobs, w=opts.local_workers, dir=os.path.abspath(opts.workdir+"/logs")))
+        failed = run_local(job_scripts, out_dir, os.path.abspath(opts.workdir+"/logs"), opts.local_workers, opts.retries)
+        if len(failed) > 0:
+            L1Ana.log.error("Jobs {jobs} failed, the outputs are not merged. Run {comb} --skip-bad to merge the others.".format(jobs=", ".join(str(i) for i in failed), comb=opts.workdir+"/combine.sh"))
+            exit(1)
+        L1Ana.log.info("All jobs finished, merging the outputs.")
+        exit(subprocess.call(["sh", os.path.abspath(opts.workdir+"/combine.sh")]))
     if opts.submit:
         print "submitting jobs"
         os.chdir('{dir}'.format(dir=opts.workdir))
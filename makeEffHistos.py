@@ -3,12 +3,14 @@ from ToolBox import parse_options_and_init_log
 # have to do this first or ROOT masks the -h messages
 opts, parser = parse_options_and_init_log()
 
-from L1Analysis import L1Ana, L1Ntuple
+from L1Analysis import L1Ana
+from analysis_tools.eventloop import Analyzer, EventLoop
 from analysis_tools.plotting import HistManager
 from analysis_tools.selections import MuonSelections, Matcher
 import ROOT as root
+import argparse
 
-def parse_options_upgradeMuonHistos(parser):
+def parse_options_upgradeMuonHistos(parser, args=None):
     """
     Adds often used options to the OptionParser...
     """
@@ -16,7 +18,7 @@ def parse_options_upgradeMuonHistos(parser):
     sub_parser = parsers.add_parser("makeEffHistos")
     sub_parser.add_argument("-o", "--outname", dest="outname", default="./ugmt_eff_histos.root", type=str, help="A root file name where to save the histograms.")
 
-    opts, unknown = parser.parse_known_args()
+    opts, unknown = parser.parse_known_args(args)
     return opts
 
 def book_histograms(eta_ranges, ptmins_list):
@@ -232,10 +234,34 @@ def save_histos(hm, outfile):
     for varname in hm.get_varnames():
         hm.get(varname).Write()
 
-def main():
-    L1Ana.init_l1_analysis()
-    opts = parse_options_upgradeMuonHistos(parser)
-    print ""
+class EffAnalyzer(Analyzer):
+    def __init__(self, outname, eta_ranges, ptmins_list, qualities):
+        super(EffAnalyzer, self).__init__(outname)
+        self.eta_ranges = eta_ranges
+        self.ptmins_list = ptmins_list
+        self.qualities = qualities
+
+    def book(self):
+        # book the histograms
+        self.hm = book_histograms(self.eta_ranges, self.ptmins_list)
+
+    def process(self, event):
+        # now do the analysis for all pt cut combinations
+        analyse(event, self.hm, self.eta_ranges, self.ptmins_list, self.qualities)
+
+    def save(self, outfile):
+        save_histos(self.hm, outfile)
+
+
+def make_analyzer(args=None):
+    """
+    Set up the analyzer with the options from the command line,
+    or from args if it is run together with other analyses by runAnalyses.py
+    """
+    if args is None:
+        opts = parse_options_upgradeMuonHistos(parser)
+    else:
+        opts = parse_options_upgradeMuonHistos(argparse.ArgumentParser(), args)
 
     # combinations of reco_pt_min and the corresponding pt_min values
     # the first line defines which thresholds are going to be used for unmatched histograms
@@ -250,35 +276,20 @@ def main():
     eta_ranges = [[0, 2.5], [0, 0.83], [0.83, 1.24], [1.24, 2.5]]
     qualities = [12, 8] # [uGMT, GMT]
 
-    # book the histograms
-    hm = book_histograms(eta_ranges, ptmins_list)
-
-    ntuple = L1Ntuple(opts.nevents)
+    return EffAnalyzer(opts.outname, eta_ranges, ptmins_list, qualities), opts
 
-    if opts.flist:
-        ntuple.open_with_file_list(opts.flist)
-    if opts.fname:
-        ntuple.open_with_file(opts.fname)
-
-    start_evt = opts.start_event
-    end_evt = opts.start_event+ntuple.nevents
-    for i in range(start_evt, end_evt):
-        event = ntuple[i]
-        if (i+1) % 1000 == 0:
-            L1Ana.log.info("Processing event: {n}".format(n=i+1))
-        # now do the analysis for all pt cut combinations
-        analyse(event, hm, eta_ranges, ptmins_list, qualities)
+def main():
+    L1Ana.init_l1_analysis()
+    analyzer, opts = make_analyzer()
+    print ""
 
+    loop = EventLoop(opts, [analyzer])
     # save histos to root file
-    if saveHistos:
-        output = root.TFile(opts.outname, 'recreate')
-        output.cd()
-        save_histos(hm, output)
-        output.Close()
+    loop.run(save=saveHistos)
+
+only_pos_eta = False
+saveHistos = True
+best_only = False
 
 if __name__ == "__main__":
-    only_pos_eta = False
-    saveHistos = True
-    best_only = False
     main()
-
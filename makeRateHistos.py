@@ -12,6 +12,10 @@ ptScale = 0.5
 etaScale = 0.010875
 phiScale = 0.010908
 
+# muon systems of the histogram families with one histogram per quality
+muon_systems = ['gmt_muon', 'ugmt_muon', 'bmtf_ugmt_muon', 'omtf_ugmt_muon', 'emtf_ugmt_muon', 'bmtf_muon', 'omtf_muon', 'emtf_muon']
+sys_idx = dict((system, i) for i, system in enumerate(muon_systems))
+
 def parse_options_upgradeRateHistos(parser):
     """
     Adds often used options to the OptionParser...
@@ -19,11 +23,14 @@ def parse_options_upgradeRateHistos(parser):
     parsers = parser.add_subparsers()
     sub_parser = parsers.add_parser("makeRateHistos")
     sub_parser.add_argument("-o", "--outname", dest="outname", default="./ugmt_rate_histos.root", type=str, help="A root file name where to save the histograms.")
+    sub_parser.add_argument("--hist-backend", dest="histbackend", type=str, default='root', help="Histogram storage during the analysis ['root', 'numpy']. numpy histograms are converted to ROOT histograms when saved.")
+    sub_parser.add_argument("--lazy-booking", dest="lazybooking", default=False, action="store_true", help="Book histograms only when they are filled for the first time.")
+    sub_parser.add_argument("--skip-empty-histos", dest="skipempty", default=False, action="store_true", help="Do not write histograms that were never filled. Only effective with --lazy-booking.")
 
     opts, unknown = parser.parse_known_args()
     return opts
 
-def book_histograms(eta_ranges, thresholds, qualities):
+def book_histograms(eta_ranges, thresholds, qualities, backend='root', lazy=False, write_empty=True):
     varnames = []
     binnings = {}
 
@@ -285,7 +292,31 @@ def book_histograms(eta_ranges, thresholds, qualities):
             binnings['omtf_muon'+thr_str+qual_str+'_eta'] = eta_bins+['OMTF #mu ('+thr_title+', '+qualTitle+') #eta']
             binnings['emtf_muon'+thr_str+qual_str+'_eta'] = eta_bins+['EMTF #mu ('+thr_title+', '+qualTitle+') #eta']
 
-    return HistManager(list(set(varnames)), binnings)
+    # the histograms per quality are stored as families with the quality as category index
+    families = {'muon_q_phi':([('system', muon_systems), ('eta_range', range(len(eta_ranges))), ('threshold', thresholds), ('quality', range(16))], {}),
+                'muon_q_pt':([('system', muon_systems), ('eta_range', range(len(eta_ranges))), ('quality', range(16))], {}),
+                'muon_q_varBin_pt':([('system', muon_systems), ('eta_range', range(len(eta_ranges))), ('quality', range(16))], {}),
+                'muon_q_eta':([('system', muon_systems), ('threshold', thresholds), ('quality', range(16))], {})}
+    for iSys, system in enumerate(muon_systems):
+        for qual in range(16):
+            qual_str = '_q'+str(qual)
+            for iEta, eta_range in enumerate(eta_ranges):
+                eta_str = '_absEtaMin'+str(eta_range[0])+'_absEtaMax'+str(eta_range[1])
+                families['muon_q_pt'][1][(iSys, iEta, qual)] = system+eta_str+qual_str+'_pt'
+                families['muon_q_varBin_pt'][1][(iSys, iEta, qual)] = system+eta_str+qual_str+'_varBin_pt'
+                for iThr, threshold in enumerate(thresholds):
+                    families['muon_q_phi'][1][(iSys, iEta, iThr, qual)] = system+eta_str+'_ptmin'+str(threshold)+qual_str+'_phi'
+            for iThr, threshold in enumerate(thresholds):
+                families['muon_q_eta'][1][(iSys, iThr, qual)] = system+'_ptmin'+str(threshold)+qual_str+'_eta'
+    family_members = set()
+    for cat_axes, varname_dict in families.values():
+        family_members.update(varname_dict.values())
+
+    hm = HistManager(list(set(varnames) - family_members), binnings, backend=backend, lazy=lazy, write_empty=write_empty)
+    for family, (cat_axes, varname_dict) in families.items():
+        # with lazy booking only the rows of filled categories are allocated
+        hm.book_category_hist(family, cat_axes, varname_dict, sparse=lazy)
+    return hm
 
 def get_highest_pt(candColl, idcs, gmt=False, tf=False):
     ptList = []
@@ -338,7 +369,7 @@ def analyse(evt, hm, eta_ranges, thresholds, qualities):
     omtf_muon_idcs = MuonSelections.select_tf_muons(evt.upgradeOmtf, pt_min=0.5, pos_eta=pos_eta, neg_eta=neg_eta)
     emtf_muon_idcs = MuonSelections.select_tf_muons(evt.upgradeEmtf, pt_min=0.5, pos_eta=pos_eta, neg_eta=neg_eta)
 
-    for eta_range in eta_ranges:
+    for iEta, eta_range in enumerate(eta_ranges):
         eta_min = eta_range[0]
         eta_max = eta_range[1]
         eta_min_str = '_absEtaMin'+str(eta_min)
@@ -350,7 +381,7 @@ def analyse(evt, hm, eta_ranges, thresholds, qualities):
         eta_omtf_muon_idcs = MuonSelections.select_tf_muons(evt.upgradeOmtf, abs_eta_min=eta_min, abs_eta_max=eta_max, idcs=omtf_muon_idcs)
         eta_emtf_muon_idcs = MuonSelections.select_tf_muons(evt.upgradeEmtf, abs_eta_min=eta_min, abs_eta_max=eta_max, idcs=emtf_muon_idcs)
 
-        for threshold in thresholds:
+        for iThr, threshold in enumerate(thresholds):
             thr_str = '_ptmin'+str(threshold)
 
             eta_thr_gmt_muon_idcs = MuonSelections.select_gmt_muons(evt.gmt, pt_min=threshold, idcs=eta_gmt_muon_idcs)
@@ -420,31 +451,25 @@ def analyse(evt, hm, eta_ranges, thresholds, qualities):
                 hm.fill('n_omtf_muons'+eta_min_str+eta_max_str+thr_str+qMin_str, len(eta_thr_q_omtf_muon_idcs))
                 hm.fill('n_emtf_muons'+eta_min_str+eta_max_str+thr_str+qMin_str, len(eta_thr_q_emtf_muon_idcs))
 
-            for qual in range(16):
-                qual_str = '_q'+str(qual)
-
-                for i in eta_thr_gmt_muon_idcs:
-                    if evt.gmt.Qual[i] == qual:
-                        hm.fill('gmt_muon'+eta_min_str+eta_max_str+thr_str+qual_str+'_phi', Matcher.norm_phi(evt.gmt.Phi[i]))
-                for i in eta_thr_ugmt_muon_idcs:
-                    if evt.upgrade.muonQual[i] == qual:
-                        hm.fill('ugmt_muon'+eta_min_str+eta_max_str+thr_str+qual_str+'_phi', evt.upgrade.muonPhi[i])
-                        tftype = MuonSelections.getTfTypeFromTfMuonIdx(evt.upgrade.muonTfMuonIdx[i])
-                        if tftype is 0:
-                            hm.fill('bmtf_ugmt_muon'+eta_min_str+eta_max_str+thr_str+qual_str+'_phi', evt.upgrade.muonPhi[i])
-                        elif tftype is 1:
-                            hm.fill('omtf_ugmt_muon'+eta_min_str+eta_max_str+thr_str+qual_str+'_phi', evt.upgrade.muonPhi[i])
-                        elif tftype is 2:
-                            hm.fill('emtf_ugmt_muon'+eta_min_str+eta_max_str+thr_str+qual_str+'_phi', evt.upgrade.muonPhi[i])
-                for i in eta_thr_bmtf_muon_idcs:
-                    if evt.upgradeBmtf.tfMuonHwQual[i] == qual:
-                        hm.fill('bmtf_muon'+eta_min_str+eta_max_str+thr_str+qual_str+'_phi', Matcher.norm_phi(evt.upgradeBmtf.tfMuonHwPhi[i]*phiScale))
-                for i in eta_thr_omtf_muon_idcs:
-                    if evt.upgradeOmtf.tfMuonHwQual[i] == qual:
-                        hm.fill('omtf_muon'+eta_min_str+eta_max_str+thr_str+qual_str+'_phi', Matcher.norm_phi(evt.upgradeOmtf.tfMuonHwPhi[i]*phiScale))
-                for i in eta_thr_emtf_muon_idcs:
-                    if evt.upgradeEmtf.tfMuonHwQual[i] == qual:
-                        hm.fill('emtf_muon'+eta_min_str+eta_max_str+thr_str+qual_str+'_phi', Matcher.norm_phi(evt.upgradeEmtf.tfMuonHwPhi[i]*phiScale))
+            # histograms per quality with the quality as category index
+            for i in eta_thr_gmt_muon_idcs:
+                hm.fill_category('muon_q_phi', (sys_idx['gmt_muon'], iEta, iThr, evt.gmt.Qual[i]), Matcher.norm_phi(evt.gmt.Phi[i]))
+            for i in eta_thr_ugmt_muon_idcs:
+                qual = evt.upgrade.muonQual[i]
+                hm.fill_category('muon_q_phi', (sys_idx['ugmt_muon'], iEta, iThr, qual), evt.upgrade.muonPhi[i])
+                tftype = MuonSelections.getTfTypeFromTfMuonIdx(evt.upgrade.muonTfMuonIdx[i])
+                if tftype is 0:
+                    hm.fill_category('muon_q_phi', (sys_idx['bmtf_ugmt_muon'], iEta, iThr, qual), evt.upgrade.muonPhi[i])
+                elif tftype is 1:
+                    hm.fill_category('muon_q_phi', (sys_idx['omtf_ugmt_muon'], iEta, iThr, qual), evt.upgrade.muonPhi[i])
+                elif tftype is 2:
+                    hm.fill_category('muon_q_phi', (sys_idx['emtf_ugmt_muon'], iEta, iThr, qual), evt.upgrade.muonPhi[i])
+            for i in eta_thr_bmtf_muon_idcs:
+                hm.fill_category('muon_q_phi', (sys_idx['bmtf_muon'], iEta, iThr, evt.upgradeBmtf.tfMuonHwQual[i]), Matcher.norm_phi(evt.upgradeBmtf.tfMuonHwPhi[i]*phiScale))
+            for i in eta_thr_omtf_muon_idcs:
+                hm.fill_category('muon_q_phi', (sys_idx['omtf_muon'], iEta, iThr, evt.upgradeOmtf.tfMuonHwQual[i]), Matcher.norm_phi(evt.upgradeOmtf.tfMuonHwPhi[i]*phiScale))
+            for i in eta_thr_emtf_muon_idcs:
+                hm.fill_category('muon_q_phi', (sys_idx['emtf_muon'], iEta, iThr, evt.upgradeEmtf.tfMuonHwQual[i]), Matcher.norm_phi(evt.upgradeEmtf.tfMuonHwPhi[i]*phiScale))
 
         for qMin in qualities:
             qMin_str = '_qmin'+str(qMin)
@@ -513,41 +538,39 @@ def analyse(evt, hm, eta_ranges, thresholds, qualities):
                 hm.fill('emtf_highest_muon'+eta_min_str+eta_max_str+qMin_str+'_pt', highestPt)
                 hm.fill('emtf_highest_muon'+eta_min_str+eta_max_str+qMin_str+'_varBin_pt', highestPt)
 
-        for qual in range(16):
-            qual_str = '_q'+str(qual)
-
-            for i in eta_gmt_muon_idcs:
-                if evt.gmt.Qual[i] == qual:
-                    hm.fill('gmt_muon'+eta_min_str+eta_max_str+qual_str+'_pt', evt.gmt.Pt[i])
-                    hm.fill('gmt_muon'+eta_min_str+eta_max_str+qual_str+'_varBin_pt', evt.gmt.Pt[i])
-            for i in eta_ugmt_muon_idcs:
-                if evt.upgrade.muonQual[i] == qual:
-                    hm.fill('ugmt_muon'+eta_min_str+eta_max_str+qual_str+'_pt', evt.upgrade.muonEt[i])
-                    hm.fill('ugmt_muon'+eta_min_str+eta_max_str+qual_str+'_varBin_pt', evt.upgrade.muonEt[i])
-                    tftype = MuonSelections.getTfTypeFromTfMuonIdx(evt.upgrade.muonTfMuonIdx[i])
-                    if tftype is 0:
-                        hm.fill('bmtf_ugmt_muon'+eta_min_str+eta_max_str+qual_str+'_pt', evt.upgrade.muonEt[i])
-                        hm.fill('bmtf_ugmt_muon'+eta_min_str+eta_max_str+qual_str+'_varBin_pt', evt.upgrade.muonEt[i])
-                    elif tftype is 1:
-                        hm.fill('omtf_ugmt_muon'+eta_min_str+eta_max_str+qual_str+'_pt', evt.upgrade.muonEt[i])
-                        hm.fill('omtf_ugmt_muon'+eta_min_str+eta_max_str+qual_str+'_varBin_pt', evt.upgrade.muonEt[i])
-                    elif tftype is 2:
-                        hm.fill('emtf_ugmt_muon'+eta_min_str+eta_max_str+qual_str+'_pt', evt.upgrade.muonEt[i])
-                        hm.fill('emtf_ugmt_muon'+eta_min_str+eta_max_str+qual_str+'_varBin_pt', evt.upgrade.muonEt[i])
-            for i in eta_bmtf_muon_idcs:
-                if evt.upgradeBmtf.tfMuonHwQual[i] == qual:
-                    hm.fill('bmtf_muon'+eta_min_str+eta_max_str+qual_str+'_pt', evt.upgradeBmtf.tfMuonHwPt[i]*ptScale)
-                    hm.fill('bmtf_muon'+eta_min_str+eta_max_str+qual_str+'_varBin_pt', evt.upgradeBmtf.tfMuonHwPt[i]*ptScale)
-            for i in eta_omtf_muon_idcs:
-                if evt.upgradeOmtf.tfMuonHwQual[i] == qual:
-                    hm.fill('omtf_muon'+eta_min_str+eta_max_str+qual_str+'_pt', evt.upgradeOmtf.tfMuonHwPt[i]*ptScale)
-                    hm.fill('omtf_muon'+eta_min_str+eta_max_str+qual_str+'_varBin_pt', evt.upgradeOmtf.tfMuonHwPt[i]*ptScale)
-            for i in eta_emtf_muon_idcs:
-                if evt.upgradeEmtf.tfMuonHwQual[i] == qual:
-                    hm.fill('emtf_muon'+eta_min_str+eta_max_str+qual_str+'_pt', evt.upgradeEmtf.tfMuonHwPt[i]*ptScale)
-                    hm.fill('emtf_muon'+eta_min_str+eta_max_str+qual_str+'_varBin_pt', evt.upgradeEmtf.tfMuonHwPt[i]*ptScale)
-
-    for threshold in thresholds:
+        # histograms per quality with the quality as category index
+        for i in eta_gmt_muon_idcs:
+            cat_idx = (sys_idx['gmt_muon'], iEta, evt.gmt.Qual[i])
+            hm.fill_category('muon_q_pt', cat_idx, evt.gmt.Pt[i])
+            hm.fill_category('muon_q_varBin_pt', cat_idx, evt.gmt.Pt[i])
+        for i in eta_ugmt_muon_idcs:
+            qual = evt.upgrade.muonQual[i]
+            hm.fill_category('muon_q_pt', (sys_idx['ugmt_muon'], iEta, qual), evt.upgrade.muonEt[i])
+            hm.fill_category('muon_q_varBin_pt', (sys_idx['ugmt_muon'], iEta, qual), evt.upgrade.muonEt[i])
+            tftype = MuonSelections.getTfTypeFromTfMuonIdx(evt.upgrade.muonTfMuonIdx[i])
+            if tftype is 0:
+                hm.fill_category('muon_q_pt', (sys_idx['bmtf_ugmt_muon'], iEta, qual), evt.upgrade.muonEt[i])
+                hm.fill_category('muon_q_varBin_pt', (sys_idx['bmtf_ugmt_muon'], iEta, qual), evt.upgrade.muonEt[i])
+            elif tftype is 1:
+                hm.fill_category('muon_q_pt', (sys_idx['omtf_ugmt_muon'], iEta, qual), evt.upgrade.muonEt[i])
+                hm.fill_category('muon_q_varBin_pt', (sys_idx['omtf_ugmt_muon'], iEta, qual), evt.upgrade.muonEt[i])
+            elif tftype is 2:
+                hm.fill_category('muon_q_pt', (sys_idx['emtf_ugmt_muon'], iEta, qual), evt.upgrade.muonEt[i])
+                hm.fill_category('muon_q_varBin_pt', (sys_idx['emtf_ugmt_muon'], iEta, qual), evt.upgrade.muonEt[i])
+        for i in eta_bmtf_muon_idcs:
+            cat_idx = (sys_idx['bmtf_muon'], iEta, evt.upgradeBmtf.tfMuonHwQual[i])
+            hm.fill_category('muon_q_pt', cat_idx, evt.upgradeBmtf.tfMuonHwPt[i]*ptScale)
+            hm.fill_category('muon_q_varBin_pt', cat_idx, evt.upgradeBmtf.tfMuonHwPt[i]*ptScale)
+        for i in eta_omtf_muon_idcs:
+            cat_idx = (sys_idx['omtf_muon'], iEta, evt.upgradeOmtf.tfMuonHwQual[i])
+            hm.fill_category('muon_q_pt', cat_idx, evt.upgradeOmtf.tfMuonHwPt[i]*ptScale)
+            hm.fill_category('muon_q_varBin_pt', cat_idx, evt.upgradeOmtf.tfMuonHwPt[i]*ptScale)
+        for i in eta_emtf_muon_idcs:
+            cat_idx = (sys_idx['emtf_muon'], iEta, evt.upgradeEmtf.tfMuonHwQual[i])
+            hm.fill_category('muon_q_pt', cat_idx, evt.upgradeEmtf.tfMuonHwPt[i]*ptScale)
+            hm.fill_category('muon_q_varBin_pt', cat_idx, evt.upgradeEmtf.tfMuonHwPt[i]*ptScale)
+
+    for iThr, threshold in enumerate(thresholds):
         thr_str = '_ptmin'+str(threshold)
 
         thr_gmt_muon_idcs = MuonSelections.select_gmt_muons(evt.gmt, pt_min=threshold, idcs=gmt_muon_idcs)
@@ -583,39 +606,32 @@ def analyse(evt, hm, eta_ranges, thresholds, qualities):
             for i in thr_q_emtf_muon_idcs:
                 hm.fill('emtf_muon'+thr_str+qMin_str+'_eta', evt.upgradeEmtf.tfMuonHwEta[i]*etaScale)
 
-        for qual in range(16):
-            qual_str = '_q'+str(qual)
-
-            for i in thr_gmt_muon_idcs:
-                if evt.gmt.Qual[i] == qual:
-                    hm.fill('gmt_muon'+thr_str+qual_str+'_eta', evt.gmt.Eta[i])
-            for i in thr_ugmt_muon_idcs:
-                if evt.upgrade.muonQual[i] == qual:
-                    hm.fill('ugmt_muon'+thr_str+qual_str+'_eta', evt.upgrade.muonEta[i])
-                    tftype = MuonSelections.getTfTypeFromTfMuonIdx(evt.upgrade.muonTfMuonIdx[i])
-                    if tftype is 0:
-                        hm.fill('bmtf_ugmt_muon'+thr_str+qual_str+'_eta', evt.upgrade.muonEta[i])
-                    elif tftype is 1:
-                        hm.fill('omtf_ugmt_muon'+thr_str+qual_str+'_eta', evt.upgrade.muonEta[i])
-                    elif tftype is 2:
-                        hm.fill('emtf_ugmt_muon'+thr_str+qual_str+'_eta', evt.upgrade.muonEta[i])
-            for i in thr_bmtf_muon_idcs:
-                if evt.upgradeBmtf.tfMuonHwQual[i] == qual:
-                    hm.fill('bmtf_muon'+thr_str+qual_str+'_eta', evt.upgradeBmtf.tfMuonHwEta[i]*etaScale)
-            for i in thr_omtf_muon_idcs:
-                if evt.upgradeOmtf.tfMuonHwQual[i] == qual:
-                    hm.fill('omtf_muon'+thr_str+qual_str+'_eta', evt.upgradeOmtf.tfMuonHwEta[i]*etaScale)
-            for i in thr_emtf_muon_idcs:
-                if evt.upgradeEmtf.tfMuonHwQual[i] == qual:
-                    hm.fill('emtf_muon'+thr_str+qual_str+'_eta', evt.upgradeEmtf.tfMuonHwEta[i]*etaScale)
+        # histograms per quality with the quality as category index
+        for i in thr_gmt_muon_idcs:
+            hm.fill_category('muon_q_eta', (sys_idx['gmt_muon'], iThr, evt.gmt.Qual[i]), evt.gmt.Eta[i])
+        for i in thr_ugmt_muon_idcs:
+            qual = evt.upgrade.muonQual[i]
+            hm.fill_category('muon_q_eta', (sys_idx['ugmt_muon'], iThr, qual), evt.upgrade.muonEta[i])
+            tftype = MuonSelections.getTfTypeFromTfMuonIdx(evt.upgrade.muonTfMuonIdx[i])
+            if tftype is 0:
+                hm.fill_category('muon_q_eta', (sys_idx['bmtf_ugmt_muon'], iThr, qual), evt.upgrade.muonEta[i])
+            elif tftype is 1:
+                hm.fill_category('muon_q_eta', (sys_idx['omtf_ugmt_muon'], iThr, qual), evt.upgrade.muonEta[i])
+            elif tftype is 2:
+                hm.fill_category('muon_q_eta', (sys_idx['emtf_ugmt_muon'], iThr, qual), evt.upgrade.muonEta[i])
+        for i in thr_bmtf_muon_idcs:
+            hm.fill_category('muon_q_eta', (sys_idx['bmtf_muon'], iThr, evt.upgradeBmtf.tfMuonHwQual[i]), evt.upgradeBmtf.tfMuonHwEta[i]*etaScale)
+        for i in thr_omtf_muon_idcs:
+            hm.fill_category('muon_q_eta', (sys_idx['omtf_muon'], iThr, evt.upgradeOmtf.tfMuonHwQual[i]), evt.upgradeOmtf.tfMuonHwEta[i]*etaScale)
+        for i in thr_emtf_muon_idcs:
+            hm.fill_category('muon_q_eta', (sys_idx['emtf_muon'], iThr, evt.upgradeEmtf.tfMuonHwQual[i]), evt.upgradeEmtf.tfMuonHwEta[i]*etaScale)
 
 def save_histos(hm, outfile):
     '''
     save all histograms in hm to outfile
     '''
     outfile.cd()
-    for varname in hm.get_varnames():
-        hm.get(varname).Write()
+    hm.write()
 
 def main():
     L1Ana.init_l1_analysis()
@@ -629,7 +645,7 @@ def main():
     thresholds = [0, 18]
     qualities = [0, 4, 8, 12]
     # book the histograms
-    hm = book_histograms(eta_ranges, thresholds, qualities)
+    hm = book_histograms(eta_ranges, thresholds, qualities, backend=opts.histbackend, lazy=opts.lazybooking, write_empty=not opts.skipempty)
 
     ntuple = L1Ntuple(opts.nevents)
 
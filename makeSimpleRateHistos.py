@@ -3,18 +3,19 @@ from ToolBox import parse_options_and_init_log
 # have to do this first or ROOT masks the -h messages
 opts, parser = parse_options_and_init_log()
 
-from L1Analysis import L1Ana, L1Ntuple
+from L1Analysis import L1Ana
+from analysis_tools.eventloop import Analyzer, EventLoop
 from analysis_tools.plotting import HistManager
 from analysis_tools.selections import MuonSelections, Matcher
 import exceptions
-import json
 import ROOT as root
+import argparse
 
 ptScale = 0.5
 etaScale = 0.010875
 phiScale = 0.010908
 
-def parse_options_upgradeRateHistos(parser):
+def parse_options_upgradeRateHistos(parser, args=None):
     """
     Adds often used options to the OptionParser...
     """
@@ -25,7 +26,7 @@ def parse_options_upgradeRateHistos(parser):
     sub_parser.add_argument("-e", "--emul", dest="emul", action='store_true', help="Use emulated collections instead of unpacked ones.")
     sub_parser.add_argument("--use-l1-extra-coord", dest="l1extraCoord", default=False, action="store_true", help="Use L1 extrapolated eta and phi coordinates.")
 
-    opts, unknown = parser.parse_known_args()
+    opts, unknown = parser.parse_known_args(args)
     return opts
 
 def book_histograms(eta_ranges, thresholds, qualities):
@@ -573,11 +574,36 @@ def save_histos(hm, outfile):
     for varname in hm.get_varnames():
         hm.get(varname).Write()
 
-def main():
-    L1Ana.init_l1_analysis()
-    opts = parse_options_upgradeRateHistos(parser)
+class SimpleRateAnalyzer(Analyzer):
+    def __init__(self, outname, eta_ranges, thresholds, qualities, emulated=False):
+        super(SimpleRateAnalyzer, self).__init__(outname)
+        self.eta_ranges = eta_ranges
+        self.thresholds = thresholds
+        self.qualities = qualities
+        self.emulated = emulated
+
+    def book(self):
+        # book the histograms
+        self.hm = book_histograms(self.eta_ranges, self.thresholds, self.qualities)
+
+    def process(self, event):
+        analyse(event, self.hm, self.eta_ranges, self.thresholds, self.qualities, self.emulated)
+        self.hm.fill('n_evts_analysed', 0.5)
+
+    def save(self, outfile):
+        save_histos(self.hm, outfile)
+
+
+def make_analyzer(args=None):
+    """
+    Set up the analyzer with the options from the command line,
+    or from args if it is run together with other analyses by runAnalyses.py
+    """
+    if args is None:
+        opts = parse_options_upgradeRateHistos(parser)
+    else:
+        opts = parse_options_upgradeRateHistos(argparse.ArgumentParser(), args)
     emulated = opts.emul
-    print ""
 
     global useVtxExtraCoord
     useVtxExtraCoord = opts.l1extraCoord
@@ -589,63 +615,22 @@ def main():
     thresholds = [0, 3, 5, 7, 12, 18, 22]
     qualities = {'gmt':[2, 3, 4, 5], 'ugmt':[0, 4, 8, 12]}
     #qualities = {'gmt':[0, 4, 8, 12], 'ugmt':[0, 4, 8, 12]}
-    # book the histograms
-    hm = book_histograms(eta_ranges, thresholds, qualities)
-
-    ntuple = L1Ntuple(opts.nevents)
-
-    if opts.flist:
-        ntuple.open_with_file_list(opts.flist)
-    if opts.fname:
-        ntuple.open_with_file(opts.fname)
-
-    # good runs from json file
-    good_ls = None
-    if opts.json:
-        with open(opts.json) as json_file:    
-            good_ls = json.load(json_file)
-
-    start_evt = opts.start_event
-    end_evt = opts.start_event+ntuple.nevents
-    analysed_evt_ctr = 0
-    try:
-        for i in range(start_evt, end_evt):
-            event = ntuple[i]
-            if (i+1) % 1000 == 0:
-                L1Ana.log.info("Processing event: {n}. Analysed events from selected runs/LS until now: {nAna}".format(n=i+1, nAna=analysed_evt_ctr))
-
-            runnr = event.event.run
-            # apply json file if loaded
-            if good_ls:
-                analyze_this_ls = False
-                ls = event.event.lumi
-                if str(runnr) in good_ls:
-                    for ls_list in good_ls[str(runnr)]:
-                        if ls >= ls_list[0] and ls <= ls_list[1]:
-                            analyze_this_ls = True
-                            break
-                if not analyze_this_ls:
-                    continue
-
-            analyse(event, hm, eta_ranges, thresholds, qualities, emulated)
-            hm.fill('n_evts_analysed', 0.5)
-            analysed_evt_ctr += 1
-    except KeyboardInterrupt:
-        L1Ana.log.info("Analysis interrupted after {n} events".format(n=i))
-
-    L1Ana.log.info("Analysis of {nAna} events in selected runs/LS finished.".format(nAna=analysed_evt_ctr))
 
+    return SimpleRateAnalyzer(opts.outname, eta_ranges, thresholds, qualities, emulated), opts
+
+def main():
+    L1Ana.init_l1_analysis()
+    analyzer, opts = make_analyzer()
+    print ""
+
+    loop = EventLoop(opts, [analyzer])
     # save histos to root file
-    if saveHistos:
-        output = root.TFile(opts.outname, 'recreate')
-        output.cd()
-        save_histos(hm, output)
-        output.Close()
+    loop.run(save=saveHistos)
+
+pos_eta = True
+neg_eta = True
+useVtxExtraCoord = False
+saveHistos = True
 
 if __name__ == "__main__":
-    pos_eta = True
-    neg_eta = True
-    useVtxExtraCoord = False
-    saveHistos = True
     main()
-
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+import argparse
+import hashlib
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import Counter, OrderedDict
+from sys import exit
+
+import ROOT as root
+from L1Analysis import L1Ana
+from analysis_tools.sampling import SAMPLE_PARAMS
+
+"""
+Merges the histograms of batch job outputs into one file with the same directory layout.
+The inputs are checked and read by parallel worker processes, every worker adds up a
+part of the inputs and the partial results are merged pairwise in a reduction tree.
+With --watch the inputs are merged as the jobs finish, see watch().
+"""
+
+# per run directories differ between jobs, only the histograms in them have to agree
+RUN_DIR = re.compile(r'^\d+$')
+
+
+def parse_options():
+    desc = "Merge the histograms of job output files."
+    parser = argparse.ArgumentParser(description=desc, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-o", "--outname", dest="outname", type=str, required=True, help="Output file name.")
+    parser.add_argument("-j", "--workers", dest="workers", type=int, default=multiprocessing.cpu_count(), help="Number of worker processes.")
+    parser.add_argument("--skip-bad", dest="skip_bad", action="store_true", help="Merge the good inputs if some are missing, corrupt or have a different set of histograms.")
+    parser.add_argument("--union", dest="union", action="store_true", help="Do not require the same histograms in all inputs, e.g. for outputs written with --skip-empty.")
+    parser.add_argument("--watch", dest="watch", action="store_true", help="Wait for the inputs to appear and merge them as they are finished, the output always holds the inputs merged so far.")
+    parser.add_argument("--poll", dest="poll", type=float, default=5., help="Seconds between two checks for finished inputs with --watch.")
+    parser.add_argument("--timeout", dest="timeout", type=float, default=0., help="Stop waiting with --watch when no input was finished or has grown for this many minutes, 0 for no limit.")
+    parser.add_argument("--write-every", dest="write_every", type=int, default=1, help="Write the running total with --watch only after every N batches of finished inputs, as every write rewrites the whole output.")
+    parser.add_argument("inputs", nargs="+", help="Job output files.")
+
+    return parser.parse_args()
+
+
+def walk(directory, read=True, path='', objects=None):
+    """
+    All objects in directory and its sub directories by path, directories with the value None
+    With read=False only the class names are returned instead of the objects.
+    Histograms are detached from the file, so they can be used after it is closed.
+    """
+    if objects is None:
+        objects = OrderedDict()
+    for key in directory.GetListOfKeys():
+        name = path + key.GetName()
+        # only the highest cycle
+        if name in objects:
+            continue
+        cls = root.TClass.GetClass(key.GetClassName())
+        if cls and cls.InheritsFrom('TDirectory'):
+            objects[name] = None
+            walk(key.ReadObj(), read, name+'/', objects)
+        elif read:
+            obj = key.ReadObj()
+            if obj.InheritsFrom('TH1'):
+                obj.SetDirectory(0)
+            objects[name] = obj
+        else:
+            objects[name] = key.GetClassName()
+    return objects
+
+
+def check_input(fname):
+    """
+    Check that a job output can be read
+    RETURNS: (file name, problem or None, digest of the histogram set, number of objects, True if it contains trees,
+              tuple of (name, value) of the parameters that have to agree between the inputs)
+    """
+    if not '://' in fname and not os.path.exists(fname):
+        return fname, "missing", None, 0, False, ()
+    infile = root.TFile.Open(fname)
+    if not infile or infile.IsZombie():
+        return fname, "cannot be opened", None, 0, False, ()
+    if infile.TestBit(root.TFile.kRecovered):
+        infile.Close()
+        return fname, "was not closed properly", None, 0, False, ()
+    try:
+        classes = walk(infile, read=False)
+        # the sample parameters are added up, the others have to agree
+        params = tuple(sorted((name, infile.Get(name).GetVal()) for name, cls in classes.items() if cls is not None and cls.startswith('TParameter') and not os.path.basename(name) in SAMPLE_PARAMS))
+    finally:
+        infile.Close()
+    names = set()
+    for name in classes:
+        parts = name.split('/')
+        if RUN_DIR.match(parts[0]):
+            parts[0] = '<run>'
+        names.add('/'.join(parts))
+    digest = hashlib.md5('\n'.join(sorted(names))).hexdigest()
+    has_trees = any(cls is not None and root.TClass.GetClass(cls) and root.TClass.GetClass(cls).InheritsFrom('TTree') for cls in classes.values())
+    return fname, None, digest, len(names), has_trees, params
+
+
+def add_objects(total, objects, fname):
+    """
+    Add the histograms and the sample parameters in objects to those in total, other objects are taken from the first input
+    Other parameters cannot be added and have to be the same in all inputs.
+    """
+    for name, obj in objects.items():
+        if not name in total:
+            total[name] = obj
+        elif obj is not None and obj.InheritsFrom('TH1'):
+            if not total[name].Add(obj):
+                raise ValueError("Cannot add {name} from {fname}".format(name=name, fname=fname))
+        elif obj is not None and obj.InheritsFrom('TParameter<double>'):
+            if os.path.basename(name) in SAMPLE_PARAMS:
+                total[name].SetVal(total[name].GetVal() + obj.GetVal())
+            elif obj.GetVal() != total[name].GetVal():
+                raise ValueError("{name} is {v} in {fname} and {v_ref} in the inputs before".format(name=name, v=obj.GetVal(), fname=fname, v_ref=total[name].GetVal()))
+
+
+def different_params(params, reference):
+    """Descriptions of the parameters that differ from those of the reference input"""
+    reference = dict(reference)
+    return ["{name} = {v} instead of {v_ref}".format(name=name, v=v, v_ref=reference.get(name)) for name, v in params if reference.get(name) != v]
+
+
+def write_objects(objects, fname):
+    outfile = root.TFile(fname, 'recreate')
+    for name, obj in objects.items():
+        dirname, objname = os.path.split(name)
+        directory = outfile
+        for part in dirname.split('/') if dirname else []:
+            subdir = directory.GetDirectory(part)
+            directory = subdir if subdir else directory.mkdir(part)
+        if obj is None:
+            if not directory.GetDirectory(objname):
+                directory.mkdir(objname)
+        else:
+            directory.cd()
+            obj.Write(objname)
+    outfile.Close()
+
+
+def read_file(fname):
+    infile = root.TFile.Open(fname)
+    objects = walk(infile)
+    infile.Close()
+    return objects
+
+
+def merge_files(args):
+    """Read the files one after the other, add them up and write the sum to outname"""
+    fnames, outname = args
+    total = OrderedDict()
+    for fname in fnames:
+        add_objects(total, read_file(fname), fname)
+    write_objects(total, outname)
+    return outname
+
+
+def merge(fnames, outname, workers):
+    """
+    Merge the histograms of fnames into outname
+    Every worker adds up a contiguous part of the inputs, then the partial sums are merged in pairs
+    until one file is left.
+    """
+    workers = max(1, min(workers, len(fnames)))
+    tmp_dir = tempfile.mkdtemp(prefix='merge_', dir=os.path.dirname(os.path.abspath(outname)))
+    pool = multiprocessing.Pool(workers)
+    try:
+        chunk = (len(fnames)+workers-1) / workers
+        tasks = [(fnames[i:i+chunk], os.path.join(tmp_dir, 'part_0_{i}.root'.format(i=i))) for i in range(0, len(fnames), chunk)]
+        partials = pool.map(merge_files, tasks)
+        level = 1
+        while len(partials) > 1:
+            L1Ana.log.info("Merging {n} partial sums.".format(n=len(partials)))
+            tasks = [(partials[i:i+2], os.path.join(tmp_dir, 'part_{l}_{i}.root'.format(l=level, i=i))) for i in range(0, len(partials)-1, 2)]
+            merged = pool.map(merge_files, tasks)
+            if len(partials) % 2 == 1:
+                merged.append(partials[-1])
+            for fname in partials[:len(partials)-len(partials)%2]:
+                os.remove(fname)
+            partials = merged
+            level += 1
+        shutil.move(partials[0], outname)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(tmp_dir)
+
+
+def watch(fnames, outname, workers, poll, skip_bad, union, timeout=0., write_every=1):
+    """
+    Merge the inputs into a running total as they are finished, until all inputs are merged
+    An input is finished once it is a complete ROOT file and its size has not changed since the
+    previous check. After every write_every batches of finished inputs the total is written under
+    a temporary name and renamed to outname, so outname is a valid partial result at any time.
+    Every write rewrites the whole total, which for large outputs can take longer than merging
+    a batch, so write_every > 1 saves time at the cost of a less recent partial result.
+    Without skip_bad the watching stops after the batch with the first input with a different histogram set
+    or different parameters.
+    The watching also stops when no input was finished or has grown for timeout minutes, e.g. because
+    a job failed without output or an input stays incomplete. timeout=0 waits without limit.
+    RETURNS: the inputs that were not merged because they have a different histogram set or different parameters, and the unfinished inputs
+    """
+    total = OrderedDict()
+    reference = None
+    ref_params = None
+    pending = list(fnames)
+    sizes = {}
+    bad = []
+    n_merged = 0
+    n_batches = 0
+    written = True
+    stop = False
+    last_progress = time.time()
+    # an old output must not be taken for the partial result
+    if os.path.exists(outname):
+        os.remove(outname)
+    tmp_dir = tempfile.mkdtemp(prefix='merge_', dir=os.path.dirname(os.path.abspath(outname)))
+    pool = multiprocessing.Pool(max(1, min(workers, len(fnames))))
+    try:
+        while len(pending) > 0 and not stop:
+            finished = []
+            for fname, problem, digest, n, has_trees, params in pool.map(check_input, pending):
+                # missing or still being written
+                if problem:
+                    continue
+                if not '://' in fname:
+                    size = os.path.getsize(fname)
+                    if sizes.get(fname) != size:
+                        sizes[fname] = size
+                        last_progress = time.time()
+                        continue
+                if has_trees:
+                    raise ValueError("{fname} contains trees, only histograms are merged with --watch".format(fname=fname))
+                pending.remove(fname)
+                last_progress = time.time()
+                # parameters other than those of a sample are not added, they have to be the same in all inputs
+                if ref_params is None:
+                    ref_params = params
+                elif params != ref_params:
+                    L1Ana.log.error("{fname} has different parameters: {p}.".format(fname=fname, p=', '.join(different_params(params, ref_params))))
+                    bad.append(fname)
+                    stop = not skip_bad
+                    continue
+                if not union:
+                    # the first finished input is the reference for the histogram set
+                    if reference is None:
+                        reference = digest
+                    elif digest != reference:
+                        L1Ana.log.error("{fname} has a different set of histograms, {n} objects.".format(fname=fname, n=n))
+                        bad.append(fname)
+                        stop = not skip_bad
+                        continue
+                finished.append(fname)
+
+            if len(finished) > 0:
+                if len(finished) == 1:
+                    add_objects(total, read_file(finished[0]), finished[0])
+                else:
+                    batch_fname = os.path.join(tmp_dir, 'batch.root')
+                    merge(finished, batch_fname, workers)
+                    add_objects(total, read_file(batch_fname), batch_fname)
+                    os.remove(batch_fname)
+                n_merged += len(finished)
+                n_batches += 1
+                written = False
+            if timeout > 0 and len(pending) > 0 and time.time() - last_progress >= 60.*timeout:
+                L1Ana.log.error("No input finished for {t} minutes.".format(t=timeout))
+                stop = True
+            if not written and (n_batches % write_every == 0 or len(pending) == 0 or stop):
+                tmp_fname = os.path.join(tmp_dir, 'total.root')
+                write_objects(total, tmp_fname)
+                os.rename(tmp_fname, outname)
+                written = True
+                L1Ana.log.info("Merged {n} of {N} inputs into {f}.".format(n=n_merged, N=len(fnames), f=outname))
+            if len(pending) > 0 and not stop:
+                time.sleep(poll)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(tmp_dir)
+    return bad, pending
+
+
+def check_inputs(fnames, workers, union):
+    """
+    Check all inputs in parallel and report missing and corrupt ones and those with a different histogram set
+    or different parameters
+    RETURNS: the good inputs, the bad inputs and True if the inputs contain trees
+    """
+    pool = multiprocessing.Pool(max(1, min(workers, len(fnames))))
+    try:
+        results = pool.map(check_input, fnames)
+    finally:
+        pool.close()
+        pool.join()
+    bad = []
+    for fname, problem, digest, n, has_trees, params in results:
+        if problem:
+            L1Ana.log.error("{fname} {problem}.".format(fname=fname, problem=problem))
+            bad.append(fname)
+    readable = [result for result in results if result[1] is None]
+    if not union and len(readable) > 0:
+        # the histogram set of most inputs is taken as the reference
+        reference, n_ref = Counter((digest, n) for fname, problem, digest, n, has_trees, params in readable).most_common(1)[0][0]
+        for fname, problem, digest, n, has_trees, params in readable:
+            if digest != reference:
+                L1Ana.log.error("{fname} has a different set of histograms, {n} instead of {n_ref} objects.".format(fname=fname, n=n, n_ref=n_ref))
+                bad.append(fname)
+    if len(readable) > 0:
+        # parameters other than those of a sample are not added, they have to be the same in all inputs
+        ref_params = Counter(params for fname, problem, digest, n, has_trees, params in readable).most_common(1)[0][0]
+        for fname, problem, digest, n, has_trees, params in readable:
+            if params != ref_params and not fname in bad:
+                L1Ana.log.error("{fname} has different parameters: {p}.".format(fname=fname, p=', '.join(different_params(params, ref_params))))
+                bad.append(fname)
+    good = [fname for fname, problem, digest, n, has_trees, params in readable if not fname in bad]
+    return good, bad, any(result[4] for result in readable)
+
+
+def main():
+    L1Ana.init_logging("L1Analysis")
+    opts = parse_options()
+
+    if opts.watch:
+        L1Ana.log.info("Waiting for {n} input files.".format(n=len(opts.inputs)))
+        bad, unfinished = watch(opts.inputs, opts.outname, opts.workers, opts.poll, opts.skip_bad, opts.union, opts.timeout, opts.write_every)
+        if len(bad) > 0 and not opts.skip_bad:
+            L1Ana.log.error("Stopped, {f} holds the inputs merged so far. Use --skip-bad to merge the good files.".format(f=opts.outname))
+            exit(1)
+        if len(unfinished) > 0:
+            L1Ana.log.error("{n} of {N} inputs are missing or incomplete, {f} holds the inputs merged so far:\n{fnames}".format(n=len(unfinished), N=len(opts.inputs), f=opts.outname, fnames='\n'.join(unfinished)))
+            exit(1)
+        L1Ana.log.info("All inputs merged into {f}".format(f=opts.outname))
+        return
+
+    L1Ana.log.info("Checking {n} input files.".format(n=len(opts.inputs)))
+    good, bad, has_trees = check_inputs(opts.inputs, opts.workers, opts.union)
+    if len(bad) > 0:
+        L1Ana.log.error("{n} of {N} input files are missing, corrupt or different.".format(n=len(bad), N=len(opts.inputs)))
+        if not opts.skip_bad:
+            L1Ana.log.error("Nothing merged. Use --skip-bad to merge the good files.")
+            exit(1)
+    if len(good) == 0:
+        L1Ana.log.fatal("No input files to merge.")
+        exit(1)
+
+    if has_trees:
+        # only histograms are merged here
+        L1Ana.log.info("The inputs contain trees, merging {n} files with hadd.".format(n=len(good)))
+        exit(subprocess.call(['hadd', '-f', opts.outname] + good))
+
+    L1Ana.log.info("Merging {n} files with {w} workers.".format(n=len(good), w=min(opts.workers, len(good))))
+    merge(good, opts.outname, opts.workers)
+    L1Ana.log.info("Merged histograms written to {f}".format(f=opts.outname))
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,15 @@ from ToolBox import parse_options_and_init_log
 # have to do this first or ROOT masks the -h messages
 opts, parser = parse_options_and_init_log()
 
-from L1Analysis import L1Ana, L1Ntuple
+from L1Analysis import L1Ana
+from analysis_tools.eventloop import Analyzer, EventLoop
 from analysis_tools.plotting import HistManager, HistManager2d
 from analysis_tools.selections import MuonSelections, Matcher
 import exceptions
-import json
 import ROOT as root
+import argparse
 
-def parse_options_upgradeMuonHistos(parser):
+def parse_options_upgradeMuonHistos(parser, args=None):
     """
     Adds often used options to the OptionParser...
     """
@@ -20,7 +21,7 @@ def parse_options_upgradeMuonHistos(parser):
     sub_parser.add_argument("-j", "--json", dest="json", type=str, default=None, help="A json file with good lumi sections per run.")
     sub_parser.add_argument("-r", "--runs", dest="runs", type=str, default=None, help="A string of runs to check.")
 
-    opts, unknown = parser.parse_known_args()
+    opts, unknown = parser.parse_known_args(args)
     return opts
 
 def get_tftype(tf_muon_index):
@@ -88,6 +89,7 @@ def book_histograms():
     return HistManager(list(set(varnames)), binnings), HistManager2d(list(set(varnames2d)), binnings2d)
 
 def analyse(evt, hm, hm2d):
+    """Fill the data and emulator comparison histograms, returns True if data and emulator muons differ"""
     dataColl = evt.upgrade
     emulColl = evt.upgradeEmu
 
@@ -96,6 +98,8 @@ def analyse(evt, hm, hm2d):
     data_muon_idcs = MuonSelections.select_ugmt_muons(dataColl, pt_min=0.5, bx_min=bx_min, bx_max=bx_max)
     emul_muon_idcs = MuonSelections.select_ugmt_muons(emulColl, pt_min=0.5, bx_min=bx_min, bx_max=bx_max)
 
+    mismatch = len(data_muon_idcs) != len(emul_muon_idcs)
+
     hm.fill('data_muon.n', len(data_muon_idcs))
     hm.fill('emul_muon.n', len(emul_muon_idcs))
     hm2d.fill('2d_data_emul_muon.n', len(data_muon_idcs), len(emul_muon_idcs))
@@ -135,6 +139,8 @@ def analyse(evt, hm, hm2d):
             matched_muon_ctr += 1
             dataMuonsUsed.append(matched_muons[i][0])
             emulMuonsUsed.append(matched_muons[i][1])
+            if matched_muons[i][2] > 0. or dataColl.muonEt[dataMuonsUsed[-1]] != emulColl.muonEt[emulMuonsUsed[-1]] or dataColl.muonQual[dataMuonsUsed[-1]] != emulColl.muonQual[emulMuonsUsed[-1]]:
+                mismatch = True
             hm2d.fill('2d_data_emul_matched_muon.pt', dataColl.muonEt[dataMuonsUsed[-1]], emulColl.muonEt[emulMuonsUsed[-1]])
             hm2d.fill('2d_data_emul_matched_muon.eta', dataColl.muonEta[dataMuonsUsed[-1]], emulColl.muonEta[emulMuonsUsed[-1]])
             hm2d.fill('2d_data_emul_matched_muon.phi', dataColl.muonPhi[dataMuonsUsed[-1]], emulColl.muonPhi[emulMuonsUsed[-1]])
@@ -162,6 +168,7 @@ def analyse(evt, hm, hm2d):
                     print '    {ctr}:'.format(ctr=ctr)
                     print '    data: pt={pt}, eta={eta}, phi={phi}, qual={qual}, muIdx={muIdx}'.format(pt=dataColl.muonEt[dIdx], eta=dataColl.muonEta[dIdx], phi=dataColl.muonPhi[dIdx], qual=dataColl.muonQual[dIdx], muIdx=dataColl.muonTfMuonIdx[dIdx])
                     print '    emul: pt={pt}, eta={eta}, phi={phi}, qual={qual}, muIdx={muIdx}'.format(pt=emulColl.muonEt[eIdx], eta=emulColl.muonEta[eIdx], phi=emulColl.muonPhi[eIdx], qual=emulColl.muonQual[eIdx], muIdx=emulColl.muonTfMuonIdx[eIdx])
+    return mismatch
 
 
 def save_histos(hm, hm2d, outfile):
@@ -176,82 +183,60 @@ def save_histos(hm, hm2d, outfile):
         hm2d.get(varname).Write()
         
 
+class DataEmulCompAnalyzer(Analyzer):
+    def book(self):
+        # book the histograms
+        L1Ana.log.info("Booking combined run histograms.")
+        self.hm, self.hm2d = book_histograms()
+
+    def process(self, event):
+        if analyse(event, self.hm, self.hm2d):
+            # events with a data/emulator mismatch for the entry list
+            self.keep_event()
+
+    def save(self, outfile):
+        global matched_muon_ctr
+        global uncancelled_muon_ctr
+        L1Ana.log.info("Found {mm} matched muons and {ucm} uncancelled muons with dR < 0.1.".format(mm=matched_muon_ctr, ucm=uncancelled_muon_ctr))
+        save_histos(self.hm, self.hm2d, outfile)
+
+    def get_state(self):
+        state = super(DataEmulCompAnalyzer, self).get_state()
+        state['counters'] = (matched_muon_ctr, uncancelled_muon_ctr)
+        return state
+
+    def set_state(self, state):
+        global matched_muon_ctr
+        global uncancelled_muon_ctr
+        super(DataEmulCompAnalyzer, self).set_state(state)
+        matched_muon_ctr += state['counters'][0]
+        uncancelled_muon_ctr += state['counters'][1]
+
+
+def make_analyzer(args=None):
+    """
+    Set up the analyzer with the options from the command line,
+    or from args if it is run together with other analyses by runAnalyses.py
+    """
+    if args is None:
+        opts = parse_options_upgradeMuonHistos(parser)
+    else:
+        opts = parse_options_upgradeMuonHistos(argparse.ArgumentParser(), args)
+
+    return DataEmulCompAnalyzer(opts.outname), opts
+
 def main():
     L1Ana.init_l1_analysis()
-    opts = parse_options_upgradeMuonHistos(parser)
+    analyzer, opts = make_analyzer()
     print ""
 
-    # book the histograms
-    L1Ana.log.info("Booking combined run histograms.")
-    hm, hm2d = book_histograms()
-
-    ntuple = L1Ntuple(opts.nevents)
-
-    if opts.flist:
-        ntuple.open_with_file_list(opts.flist)
-    if opts.fname:
-        ntuple.open_with_file(opts.fname)
-
-    # good runs from json file
-    good_ls = None
-    if opts.json:
-        with open(opts.json) as json_file:    
-            good_ls = json.load(json_file)
-
-    # list of runs to run on
-    runs_list = []
-    if opts.runs:
-        runs_list = [int(r) for r in opts.runs.split(",")]
-        L1Ana.log.info("Processing only runs:")
-        print runs_list
-
-    start_evt = opts.start_event
-    end_evt = opts.start_event+ntuple.nevents
-    analysed_evt_ctr = 0
-    try:
-        for i in range(start_evt, end_evt):
-            event = ntuple[i]
-            if (i+1) % 1000 == 0:
-                L1Ana.log.info("Processing event: {n}. Analysed events from selected runs/LS until now: {nAna}".format(n=i+1, nAna=analysed_evt_ctr))
-
-            # if given, only process selected runs
-            runnr = event.event.run
-            if len(runs_list) > 0 and not runnr in runs_list:
-                continue
-
-            # apply json file if loaded
-            if good_ls:
-                analyze_this_ls = False
-                ls = event.event.lumi
-                if str(runnr) in good_ls:
-                    for ls_list in good_ls[str(runnr)]:
-                        if ls >= ls_list[0] and ls <= ls_list[1]:
-                            analyze_this_ls = True
-                            break
-                if not analyze_this_ls:
-                    continue
-
-            # now do the analysis
-            analyse(event, hm, hm2d)
-            analysed_evt_ctr += 1
-    except KeyboardInterrupt:
-        L1Ana.log.info("Analysis interrupted after {n} events".format(n=i))
-
-    L1Ana.log.info("Analysis of {nAna} events in selected runs/LS finished.".format(nAna=analysed_evt_ctr))
-    global matched_muon_ctr
-    global uncancelled_muon_ctr 
-    L1Ana.log.info("Found {mm} matched muons and {ucm} uncancelled muons with dR < 0.1.".format(mm=matched_muon_ctr, ucm=uncancelled_muon_ctr))
-
+    loop = EventLoop(opts, [analyzer])
     # save histos to root file
-    if saveHistos:
-        output = root.TFile(opts.outname, 'recreate')
-        output.cd()
-        save_histos(hm, hm2d, output)
-        output.Close()
+    loop.run(save=saveHistos)
+
+matched_muon_ctr = 0
+uncancelled_muon_ctr = 0
+saveHistos = True
 
 if __name__ == "__main__":
-    matched_muon_ctr = 0
-    uncancelled_muon_ctr = 0
-    saveHistos = True
     main()
-
@@ -3,14 +3,17 @@ from ToolBox import parse_options_and_init_log
 # have to do this first or ROOT masks the -h messages
 opts, parser = parse_options_and_init_log()
 
-from L1Analysis import L1Ana, L1Ntuple
-from analysis_tools.plotting import HistManager, HistManager2d
-from analysis_tools.selections import MuonSelections, Matcher
+from L1Analysis import L1Ana
+from analysis_tools.eventloop import Analyzer, EventLoop
+from analysis_tools.plotting import HistManager, HistManager2d, RunHistStore
+from analysis_tools.selections import MuonSelections, Matcher, DistanceTable
 import exceptions
-import json
 import ROOT as root
+import argparse
+import json
+from collections import OrderedDict
 
-def parse_options_upgradeMuonHistos(parser):
+def parse_options_upgradeMuonHistos(parser, args=None):
     """
     Adds often used options to the OptionParser...
     """
@@ -34,10 +37,76 @@ def parse_options_upgradeMuonHistos(parser):
     sub_parser.add_argument("--era", dest="era", type=str, default='2017pp', help="Era to select run numbers for plots.")
     sub_parser.add_argument("--pt-ranges", dest="ptranges", type=str, default='standard', help="A set of pT cuts to make plots for ['standard', 'extended'].")
     sub_parser.add_argument("--eta-ranges", dest="etaranges", type=str, default='standard', help="A set of eta ranges to make plots for ['minimal', 'standard', 'extended', 'endcap'].")
-
-    opts, unknown = parser.parse_known_args()
+    sub_parser.add_argument("--hist-backend", dest="histbackend", type=str, default='root', help="Histogram storage during the analysis ['root', 'numpy']. numpy histograms are converted to ROOT histograms when saved.")
+    sub_parser.add_argument("--lazy-booking", dest="lazybooking", default=False, action="store_true", help="Book histograms only when they are filled for the first time.")
+    sub_parser.add_argument("--skip-empty-histos", dest="skipempty", default=False, action="store_true", help="Do not write histograms that were never filled. Only effective with --lazy-booking.")
+    sub_parser.add_argument("--per-run-histos", dest="perrunhistos", default=False, action="store_true", help="Make a set of histograms for every run in addition to the combined one.")
+    sub_parser.add_argument("--per-run-reduced", dest="perrunreduced", default=False, action="store_true", help="Book only the tag, probe and delta R matched kinematic histograms per run.")
+    sub_parser.add_argument("--max-resident-runs", dest="maxresidentruns", type=int, default=0, help="Maximum number of runs with histograms in memory. Less recently filled runs are written to a spill directory and merged back at the end. 0 for no limit.")
+    sub_parser.add_argument("--spill-dir", dest="spilldir", type=str, default=None, help="Directory for the histograms of spilled runs. A temporary directory by default.")
+    sub_parser.add_argument("--variations", dest="variations", type=str, default=None, help="A json file with named sets of matching, invariant mass and coordinate settings for systematic studies. Each variation is filled in the same pass and written to its own directory.")
+
+    opts, unknown = parser.parse_known_args(args)
     return opts
 
+class Variation(object):
+    """
+    Settings of the tag and probe pair selection and of the L1 muon matching
+    The nominal settings come from the command line options, systematic variations
+    from the json file given with --variations and are filled in the same pass
+    """
+    keys = ['match_deltas', 'use_inv_mass_cut', 'inv_mass_min', 'inv_mass_max', 'use_l1_extra_coord', 'use_reco_extra_station']
+
+    def __init__(self, name, match_deltas, inv_mass_cut=False, inv_mass_min=71, inv_mass_max=111, l1_extra_coord=False, reco_extra_station=0):
+        super(Variation, self).__init__()
+        self.name = name
+        self.match_deltas = match_deltas
+        self.inv_mass_cut = inv_mass_cut
+        self.inv_mass_min = inv_mass_min
+        self.inv_mass_max = inv_mass_max
+        self.l1_extra_coord = l1_extra_coord
+        self.reco_extra_station = reco_extra_station
+
+    def varied(self, name, settings):
+        """
+        Variation with the settings in the dict changed with respect to this one
+        Without match_deltas the default matching windows for the coordinates of the variation are used
+        and an invariant mass window switches on the invariant mass cut
+        """
+        unknown = [key for key in settings if not key in Variation.keys]
+        if len(unknown) > 0:
+            raise ValueError("Unknown settings for variation {n}: {k}".format(n=name, k=', '.join(unknown)))
+        l1_extra_coord = settings.get('use_l1_extra_coord', self.l1_extra_coord)
+        reco_extra_station = settings.get('use_reco_extra_station', self.reco_extra_station)
+        if not reco_extra_station in [0, 1, 2]:
+            raise ValueError("Invalid reco muon extrapolation station for variation {n}: {s}".format(n=name, s=reco_extra_station))
+        if 'match_deltas' in settings:
+            match_deltas = dict((str(delta_type), cut) for delta_type, cut in settings['match_deltas'].items())
+            if len(set(match_deltas) - set(['dr', 'deta', 'dphi'])) > 0:
+                raise ValueError("Invalid match types for variation {n}: {t}".format(n=name, t=', '.join(match_deltas)))
+        else:
+            match_deltas = default_match_deltas(l1_extra_coord, reco_extra_station)
+        inv_mass_cut = settings.get('use_inv_mass_cut', self.inv_mass_cut or 'inv_mass_min' in settings or 'inv_mass_max' in settings)
+        return Variation(name, match_deltas, inv_mass_cut=inv_mass_cut, inv_mass_min=settings.get('inv_mass_min', self.inv_mass_min), inv_mass_max=settings.get('inv_mass_max', self.inv_mass_max),
+                         l1_extra_coord=l1_extra_coord, reco_extra_station=reco_extra_station)
+
+def default_match_deltas(l1_extra_coord=False, reco_extra_station=0):
+    match_deltas = {'dr':0.3, 'deta':0.15, 'dphi':0.25} # max deltas for matching
+    if l1_extra_coord:
+        match_deltas = {'dr':0.2, 'deta':0.15, 'dphi':0.15} # max deltas for matching with the L1 muon at the vertex
+    if reco_extra_station == 2:
+        match_deltas = {'dr':0.1, 'deta':0.1, 'dphi':0.025} # max deltas for matching with the reco muon at the 2nd muon station
+    return match_deltas
+
+def load_variations(fname, nominal):
+    """
+    Variations of the nominal settings from a json file with a dict of settings per variation name
+    e.g. {"dr_tight": {"match_deltas": {"dr": 0.1}}, "mass_wide": {"inv_mass_min": 61, "inv_mass_max": 121}}
+    """
+    with open(fname) as json_file:
+        variations_dict = json.load(json_file, object_pairs_hook=OrderedDict)
+    return [nominal.varied(str(name), settings) for name, settings in variations_dict.items()]
+
 def get_tftype(tf_muon_index):
     if tf_muon_index > 35 and tf_muon_index < 72:
         return 0 # BMTF
@@ -46,7 +115,7 @@ def get_tftype(tf_muon_index):
     else:
         return 2 # EMTF
 
-def book_histograms(eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas, emul=False, legacy=False):
+def book_histograms(eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas, emul=False, legacy=False, reduced=False):
     # define pt binning
     pt_bins = range(0, 30, 1)
     pt_bins += range(30, 50, 2)
@@ -113,12 +182,16 @@ def book_histograms(eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas
     binnings = {}
     varnames2d = []
     binnings2d = {}
+    # histogram names per fill category for the pre-resolved handles used in the event loop
+    handle_names = {}
+    handle_names2d = {}
 
     for var_bin in vars_bins:
         varnames.append(namePrefix+'tag_'+var_bin[0])
         binnings[namePrefix+'tag_'+var_bin[0]] = var_bin[1:]+[probe_x_title_vars[var_bin[0]]+'^{reco}', probe_x_title_units[var_bin[0]]]
+    handle_names[('tag',)] = [namePrefix+'tag_'+var for var in ['pt', 'eta', 'phi', 'charge']]
 
-    for eta_range in eta_ranges:
+    for iEta, eta_range in enumerate(eta_ranges):
         eta_min = eta_range[0]
         eta_max = eta_range[1]
         eta_min_str = '_absEtaMin'+str(eta_min).replace('.', 'p')
@@ -146,6 +219,9 @@ def book_histograms(eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas
                         for var_bin in probe_vars_bins:
                             varnames.append(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_'+var_bin[0])
                             binnings[namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_'+var_bin[0]] = var_bin[1:]+[probe_x_title_vars[var_bin[0]]+'^{reco}', probe_x_title_units[var_bin[0]]]
+                        handle_names[('n_probes', iEta, probe_pt_min)] = [namePrefix+'n_probes'+eta_min_str+eta_max_str+probe_ptmin_str]
+                        handle_names[('l1_muon', iEta, q, pt_min)] = [namePrefix+'l1_muon'+eta_min_str+eta_max_str+qual_min_str+ptmin_str+'_'+var_bin[0] for var_bin in vars_bins]
+                        handle_names[('probe', iEta, probe_pt_min)] = [namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_'+var_bin[0] for var_bin in probe_vars_bins]
 
                         for delta_type in match_deltas:
                             match_delta = match_deltas[delta_type]
@@ -180,6 +256,15 @@ def book_histograms(eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas
 
                             binnings[namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+delta_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_'+delta_type] = [60, 0., 0.6, delta_type]
 
+                            # handles
+                            match_key = (iEta, q, probe_pt_min, pt_min, delta_type)
+                            handle_names[('n_probe_matched_l1_muons',)+match_key] = [namePrefix+'n_probe'+probe_ptmin_str+delta_str+'_matched_l1_muons'+eta_min_str+eta_max_str+qual_min_str+ptmin_str]
+                            handle_names[('n_l1_muons_matched_to_a_probe',)+match_key] = [namePrefix+'n_l1_muons'+qual_min_str+ptmin_str+delta_str+'_matched_to_a_probe'+eta_min_str+eta_max_str+probe_ptmin_str]
+                            handle_names[('best_probe',)+match_key] = [namePrefix+'best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_'+var_bin[0] for var_bin in vars_bins]
+                            handle_names[('best_l1_muon',)+match_key] = [namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+delta_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_'+var for var in [var_bin[0] for var_bin in probe_vars_bins]+[delta_type]]
+                            handle_names[('res_best_probe',)+match_key] = [namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_'+res_var_bin[0] for res_var_bin in res_vars_bins]
+                            handle_names2d[('2d_best_probe',)+match_key] = [namePrefix+'2d_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_'+var_bin_2d[0] for var_bin_2d in x_vars_bins_2d]
+
                 # for resolution plots by probe pT range
                 for i, probe_pt_min in enumerate(res_probe_ptmins):
                     probe_ptmin_str = '_ptmin'+str(probe_pt_min).replace('.', 'p')
@@ -194,15 +279,37 @@ def book_histograms(eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas
                         for res_var_bin in res_vars_bins:
                             varnames.append(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+delta_str+'_matched_l1_muon'+qual_min_str+'_'+res_var_bin[0])
                             binnings[namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+delta_str+'_matched_l1_muon'+qual_min_str+'_'+res_var_bin[0]] = res_var_bin[1:]+[res_x_title_vars[res_var_bin[0]], res_x_title_units[res_var_bin[0]]]
-
-    return HistManager(list(set(varnames)), binnings), HistManager2d(list(set(varnames2d)), binnings2d)
-
-def analyse(evt, hms, hms2d, eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas, emul=False, pp_run=True, legacy=False):
+                        handle_names[('res_best_probe_ptrange', iEta, q, i, delta_type)] = [namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+delta_str+'_matched_l1_muon'+qual_min_str+'_'+res_var_bin[0] for res_var_bin in res_vars_bins]
+
+    # reduced set with the kinematics needed for the efficiencies with delta R matching
+    if reduced:
+        varnames = []
+        for key, vnames in handle_names.items():
+            if key[0] in ['tag', 'n_probes', 'probe'] or (key[0] in ['best_probe', 'best_l1_muon'] and key[-1] == 'dr'):
+                varnames += vnames
+        varnames2d = []
+
+    # the run number histograms have more than 10000 bins of which only a few are filled
+    sparse = dict((vname, True) for vname in varnames if vname.endswith('_run'))
+
+    hm = HistManager(list(set(varnames)), binnings, backend=histBackend, lazy=lazyBooking, write_empty=writeEmpty, sparse_dict=sparse)
+    hm2d = HistManager2d(list(set(varnames2d)), binnings2d, backend=histBackend, lazy=lazyBooking, write_empty=writeEmpty)
+    hm.book_handles(handle_names)
+    hm2d.book_handles(handle_names2d)
+    return hm, hm2d
+
+def analyse(evt, fills, eta_ranges, qual_ptmins_dict, res_probe_ptmins, emul=False, pp_run=True, legacy=False):
+    """
+    Fill the histograms for every (variation, hms, hms2d) in fills
+    The tag selection, the tag and probe pair quantities and the distances between
+    the L1 muons and the probes are computed once and shared by all variations
+    Returns True if the event has a tag muon
+    """
     recoColl = evt.recoMuon
 
     # at least 2 reco muons for tag and probe
     if recoColl.nMuons < 2:
-        return
+        return False
 
     # get tag muon indices
     if pp_run:
@@ -210,320 +317,382 @@ def analyse(evt, hms, hms2d, eta_ranges, qual_ptmins_dict, res_probe_ptmins, mat
     else:
         tag_idcs = MuonSelections.select_tag_muons(recoColl, pt_min=18., abs_eta_max=2.4, pp_run=pp_run)
     if len(tag_idcs) < 1:
-        return
+        return False
 
-    # get all probe muon indices
-    all_probe_idcs = MuonSelections.select_probe_muons(recoColl, pt_min=0., pos_eta=pos_eta, neg_eta=neg_eta, pos_charge=pos_charge, neg_charge=neg_charge, extrapolated=recoExtraStation)
-    #all_probe_idcs = MuonSelections.select_probe_muons(recoColl, pt_min=0., pt_max=15., pos_eta=pos_eta, neg_eta=neg_eta, pos_charge=pos_charge, neg_charge=neg_charge, extrapolated=recoExtraStation)
- 
     # get all ugmt l1 muons
     bx_min = 0
     bx_max = 0
     # decide which ntuples to use
-    namePrefix = prefix
-    if tftype is 0:
-        namePrefix += 'bmtf_only_'
-    elif tftype is 1:
-        namePrefix += 'omtf_only_'
-    elif tftype is 2:
-        namePrefix += 'emtf_only_'
     if emul:
         l1Coll = evt.upgradeEmu
-        namePrefix += 'emu_'
     else:
         l1Coll = evt.upgrade
 
     # use translated legacy muons
     if legacy:
         l1Coll = evt.legacyGmtEmu
-        namePrefix += 'legacy_'
-
-    l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, pt_min=0.5, bx_min=bx_min, bx_max=bx_max, pos_eta=pos_eta, neg_eta=neg_eta, useVtxExtraCoord=useVtxExtraCoord)
 
     # vertex information
     nVtx = evt.recoVertex.nVtx
     # run number
     runnr = evt.event.run
 
+    # selections and distances that depend only on the coordinates used by a variation
+    all_probe_idcs_dict = {}
+    l1_muon_idcs_dict = {}
+    distance_tables = {}
+    # tag and probe pair quantities shared by all variations
+    tag_probe_drs = {}
+    inv_masses = {}
     probeMomentumDict = {}
+    probeLV = root.TLorentzVector()
+
+    for variation, hms, hms2d in fills:
+        match_deltas = variation.match_deltas
+        useVtxExtraCoord = variation.l1_extra_coord
+        recoExtraStation = variation.reco_extra_station
+
+        # get all probe muon indices
+        if not recoExtraStation in all_probe_idcs_dict:
+            all_probe_idcs_dict[recoExtraStation] = MuonSelections.select_probe_muons(recoColl, pt_min=0., pos_eta=pos_eta, neg_eta=neg_eta, pos_charge=pos_charge, neg_charge=neg_charge, extrapolated=recoExtraStation)
+            #all_probe_idcs_dict[recoExtraStation] = MuonSelections.select_probe_muons(recoColl, pt_min=0., pt_max=15., pos_eta=pos_eta, neg_eta=neg_eta, pos_charge=pos_charge, neg_charge=neg_charge, extrapolated=recoExtraStation)
+        all_probe_idcs = all_probe_idcs_dict[recoExtraStation]
+
+        if not useVtxExtraCoord in l1_muon_idcs_dict:
+            l1_muon_idcs_dict[useVtxExtraCoord] = MuonSelections.select_ugmt_muons(l1Coll, pt_min=0.5, bx_min=bx_min, bx_max=bx_max, pos_eta=pos_eta, neg_eta=neg_eta, useVtxExtraCoord=useVtxExtraCoord)
+        l1_muon_idcs = l1_muon_idcs_dict[useVtxExtraCoord]
+
+        # minimal dR between the tag and the probe
+        tpMinDr = 0.5
+
+        # eta and phi variables to use depending on selected options
+        # match selected l1 muons to selected probes
+        if useVtxExtraCoord:
+            etas = l1Coll.muonEtaAtVtx
+            phis = l1Coll.muonPhiAtVtx
+            tpMinDr = 0.4
+        else:
+            etas = l1Coll.muonEta
+            phis = l1Coll.muonPhi
+        # select reco muon coordinates at vertex or at 1st or 2nd muon station
+        if recoExtraStation == 1:
+            probeEtas = recoColl.etaSt1
+            probePhis = recoColl.phiSt1
+        elif recoExtraStation == 2:
+            probeEtas = recoColl.etaSt2
+            probePhis = recoColl.phiSt2
+            tpMinDr = 0.2
+        else:
+            probeEtas = recoColl.eta
+            probePhis = recoColl.phi
+
+        if not (useVtxExtraCoord, recoExtraStation) in distance_tables:
+            distance_tables[(useVtxExtraCoord, recoExtraStation)] = DistanceTable(etas, phis, probeEtas, probePhis)
+        distance_table = distance_tables[(useVtxExtraCoord, recoExtraStation)]
+
+        # loop over tags
+        for tag_idx in tag_idcs:
+            # fill tag kinematic plots
+            for hm in hms:
+                hPt, hEta, hPhi, hCharge = hm.handles[('tag',)]
+                hPt.fill(recoColl.pt[tag_idx])
+                hEta.fill(recoColl.eta[tag_idx])
+                hPhi.fill(recoColl.phi[tag_idx])
+                hCharge.fill(recoColl.charge[tag_idx])
+            # remove the current tag from the list of probes
+            probe_idcs = [idx for idx in all_probe_idcs if idx != tag_idx]
+            for idx in probe_idcs:
+                if not (tag_idx, idx) in tag_probe_drs:
+                    tag_probe_drs[(tag_idx, idx)] = Matcher.delta_r(recoColl.phi[idx], recoColl.eta[idx], recoColl.phi[tag_idx], recoColl.eta[tag_idx])
+            # remove probes that are too close to the tag
+            probe_idcs = [idx for idx in probe_idcs if tag_probe_drs[(tag_idx, idx)] > tpMinDr]
+            # select tag-probe pairs with invariant mass in selected window
+            invmass_probe_idcs = []
+            for idx in probe_idcs:
+                if not idx in probeMomentumDict:
+                    probeLV.SetPtEtaPhiM(recoColl.pt[idx], recoColl.eta[idx], recoColl.phi[idx], 0.106)
+                    probeMomentumDict[idx] = probeLV.P()
+                if variation.inv_mass_cut:
+                    if not (tag_idx, idx) in inv_masses:
+                        tagLV = root.TLorentzVector()
+                        tagLV.SetPtEtaPhiM(recoColl.pt[tag_idx], recoColl.eta[tag_idx], recoColl.phi[tag_idx], 0.106)
+                        probeLV.SetPtEtaPhiM(recoColl.pt[idx], recoColl.eta[idx], recoColl.phi[idx], 0.106)
+                        inv_masses[(tag_idx, idx)] = (tagLV + probeLV).M()
+                    invMass = inv_masses[(tag_idx, idx)]
+                    if invMass < variation.inv_mass_min or invMass > variation.inv_mass_max:
+                        continue
+                invmass_probe_idcs.append(idx)
+
+            # for all defined eta ranges
+            for iEta, eta_range in enumerate(eta_ranges):
+                eta_min = eta_range[0]
+                eta_max = eta_range[1]
+
+                eta_probe_idcs = MuonSelections.select_reco_muons(recoColl, abs_eta_min=eta_min, abs_eta_max=eta_max, extrapolated=recoExtraStation, idcs=invmass_probe_idcs)
+                eta_l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, abs_eta_min=eta_min, abs_eta_max=eta_max, idcs=l1_muon_idcs, useVtxExtraCoord=useVtxExtraCoord)
+
+                # keep probe pt cuts in a list to not fill the histograms several times if two quality cuts use the same probe pt cut
+                probe_pt_mins = []
+                eta_thr_probe_idcs_dict = {}
+                # for all defined min quality ptmin_list combinations
+                for q in range(16):
+                    if q in qual_ptmins_dict:
+                        ptmins_list = qual_ptmins_dict[q]
+                        eta_q_l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, qual_min=q, idcs=eta_l1_muon_idcs, useVtxExtraCoord=useVtxExtraCoord)
+
+                        # for all defined min probe pt
+                        for ptmins in ptmins_list:
+                            probe_pt_min = ptmins[0]
+                            if not probe_pt_min in probe_pt_mins: # fill only once for each pt min value
+                                probe_pt_mins.append(probe_pt_min)
+
+                                eta_thr_probe_idcs = MuonSelections.select_reco_muons(recoColl, pt_min=probe_pt_min, idcs=eta_probe_idcs)
+                                eta_thr_probe_idcs_dict[probe_pt_min] = eta_thr_probe_idcs
+                                # fill the histograms with the probe kinematics
+                                nProbes = len(eta_thr_probe_idcs)
+                                for hm in hms:
+                                    hm.handles[('n_probes', iEta, probe_pt_min)][0].fill(nProbes)
+                                    if nProbes > 0:
+                                        hPt, hEta, hPhi, hCharge, hVtx, hRun, hP = hm.handles[('probe', iEta, probe_pt_min)]
+                                        hPt.fill_many([recoColl.pt[i] for i in eta_thr_probe_idcs])
+                                        hP.fill_many([probeMomentumDict[i] for i in eta_thr_probe_idcs])
+                                        hEta.fill_many([recoColl.eta[i] for i in eta_thr_probe_idcs])
+                                        hPhi.fill_many([recoColl.phi[i] for i in eta_thr_probe_idcs])
+                                        hCharge.fill_many([recoColl.charge[i] for i in eta_thr_probe_idcs])
+                                        hVtx.fill_many([nVtx]*nProbes)
+                                        hRun.fill_many([runnr]*nProbes)
+
+                            eta_thr_probe_idcs = eta_thr_probe_idcs_dict[probe_pt_min]
+                            # for all defined min l1 muon pt
+                            for pt_min in ptmins[1]:
+                                q_thr_l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, qual_min=q, pt_min=pt_min, idcs=l1_muon_idcs, useVtxExtraCoord=useVtxExtraCoord)
+                                eta_q_thr_l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, pt_min=pt_min, idcs=eta_q_l1_muon_idcs, useVtxExtraCoord=useVtxExtraCoord)
+                                # fill the histograms with the l1 muon kinematics
+                                for hm in hms:
+                                    hm.handles[('n_probes', iEta, probe_pt_min)][0].fill(len(eta_thr_probe_idcs))
+                                for i in eta_q_thr_l1_muon_idcs:
+                                    if tftype == -1 or tftype == get_tftype(l1Coll.muonTfMuonIdx[i]):
+                                        if useVtxExtraCoord:
+                                            eta = l1Coll.muonEtaAtVtx[i]
+                                            phi = l1Coll.muonPhiAtVtx[i]
+                                        else:
+                                            eta = l1Coll.muonEta[i]
+                                            phi = l1Coll.muonPhi[i]
 
-    # minimal dR between the tag and the probe
-    tpMinDr = 0.5
-
-    # eta and phi variables to use depending on selected options
-    zeros = [0.] * 50 # list with zeros for deta and dphi matching with the Matcher.match_dr function
-    # match selected l1 muons to selected probes
-    if useVtxExtraCoord:
-        etas = l1Coll.muonEtaAtVtx
-        phis = l1Coll.muonPhiAtVtx
-        tpMinDr = 0.4
-    else:
-        etas = l1Coll.muonEta
-        phis = l1Coll.muonPhi
-    # select reco muon coordinates at vertex or at 1st or 2nd muon station
-    if recoExtraStation == 1:
-        probeEtas = recoColl.etaSt1
-        probePhis = recoColl.phiSt1
-    elif recoExtraStation == 2:
-        probeEtas = recoColl.etaSt2
-        probePhis = recoColl.phiSt2
-        tpMinDr = 0.2
-    else:
-        probeEtas = recoColl.eta
-        probePhis = recoColl.phi
-
-    # loop over tags
-    for tag_idx in tag_idcs:
-        # fill tag kinematic plots
-        for hm in hms:
-            hm.fill(namePrefix+'tag_pt', recoColl.pt[tag_idx])
-            hm.fill(namePrefix+'tag_eta', recoColl.eta[tag_idx])
-            hm.fill(namePrefix+'tag_phi', recoColl.phi[tag_idx])
-            hm.fill(namePrefix+'tag_charge', recoColl.charge[tag_idx])
-        # remove the current tag from the list of probes
-        probe_idcs = [idx for idx in all_probe_idcs if idx != tag_idx]
-        # remove probes that are too close to the tag
-        probe_idcs = [idx for idx in probe_idcs if Matcher.delta_r(recoColl.phi[idx], recoColl.eta[idx], recoColl.phi[tag_idx], recoColl.eta[tag_idx]) > tpMinDr]
-        # select tag-probe pairs with invariant mass in selected window
-        if useInvMassCut:
-            tagLV = root.TLorentzVector()
-            tagLV.SetPtEtaPhiM(recoColl.pt[tag_idx], recoColl.eta[tag_idx], recoColl.phi[tag_idx], 0.106)
-        probeLV = root.TLorentzVector()
-        invmass_probe_idcs = []
-        for idx in probe_idcs:
-            probeLV.SetPtEtaPhiM(recoColl.pt[idx], recoColl.eta[idx], recoColl.phi[idx], 0.106)
-            probeMomentumDict[idx] = probeLV.P()
-            if useInvMassCut:
-                invMass = (tagLV + probeLV).M()
-                if invMass < invMassMin or invMass > invMassMax:
-                    continue
-            invmass_probe_idcs.append(idx)
-
-        # for all defined eta ranges
-        for eta_range in eta_ranges:
-            eta_min = eta_range[0]
-            eta_max = eta_range[1]
-            eta_min_str = '_absEtaMin'+str(eta_min).replace('.', 'p')
-            eta_max_str = '_absEtaMax'+str(eta_max).replace('.', 'p')
-
-            eta_probe_idcs = MuonSelections.select_reco_muons(recoColl, abs_eta_min=eta_min, abs_eta_max=eta_max, extrapolated=recoExtraStation, idcs=invmass_probe_idcs)
-            eta_l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, abs_eta_min=eta_min, abs_eta_max=eta_max, idcs=l1_muon_idcs, useVtxExtraCoord=useVtxExtraCoord)
-
-            # keep probe pt cuts in a list to not fill the histograms several times if two quality cuts use the same probe pt cut
-            probe_pt_mins = []
-            probe_ptmin_str_dict = {}
-            eta_thr_probe_idcs_dict = {}
-            # for all defined min quality ptmin_list combinations
-            for q in range(16):
-                if q in qual_ptmins_dict:
-                    ptmins_list = qual_ptmins_dict[q]
-                    qual_min_str = '_qualMin'+str(q)
-                    eta_q_l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, qual_min=q, idcs=eta_l1_muon_idcs, useVtxExtraCoord=useVtxExtraCoord)
-
-                    # for all defined min probe pt
-                    for ptmins in ptmins_list:
-                        if not ptmins[0] in probe_pt_mins: # fill only once for each pt min value
-                            probe_pt_mins.append(ptmins[0])
-                            probe_ptmin_str = '_ptmin'+str(ptmins[0]).replace('.', 'p')
-                            probe_ptmin_str_dict[ptmins[0]] = probe_ptmin_str
-
-                            eta_thr_probe_idcs = MuonSelections.select_reco_muons(recoColl, pt_min=probe_pt_mins[-1], idcs=eta_probe_idcs)
+                                        for hm in hms:
+                                            hPt, hEta, hPhi, hCharge, hVtx, hRun = hm.handles[('l1_muon', iEta, q, pt_min)]
+                                            hPt.fill(l1Coll.muonEt[i])
+                                            hEta.fill(eta)
+                                            hPhi.fill(phi)
+                                            hCharge.fill(l1Coll.muonChg[i])
+                                            hVtx.fill(nVtx)
+                                            hRun.fill(runnr)
+
+                                if len(q_thr_l1_muon_idcs) > 0:
+                                    # for all matching methodes (dr, deta, dphi)
+                                    for delta_type in match_deltas:
+                                        match_delta = match_deltas[delta_type]
+                                        if not delta_type in ['dr', 'deta', 'dphi']:
+                                            continue
+                                        matched_l1_muons = distance_table.match(delta_type, cut=match_delta, idcs1=q_thr_l1_muon_idcs, idcs2=eta_thr_probe_idcs) # match in delta R, delta eta or delta phi
+
+                                        match_key = (iEta, q, probe_pt_min, pt_min, delta_type)
+                                        for hm in hms:
+                                            hm.handles[('n_probe_matched_l1_muons',)+match_key][0].fill(len(matched_l1_muons))
+
+                                        # how many l1 matches did we find for each probe muon
+                                        for probe_idx in invmass_probe_idcs:
+                                            l1_muon_cntr = 0
+                                            histo_filled = False
+                                            # fill matched histograms
+                                            for i in range(len(matched_l1_muons)):
+                                                if probe_idx == matched_l1_muons[i][1]:
+                                                    l1_muon_cntr += 1
+                                                    # fill muon values only for the first (and therefore best) match to this probe muon
+                                                    if not histo_filled:
+                                                        l1_idx = matched_l1_muons[i][0]
+                                                        if tftype == -1 or tftype == get_tftype(l1Coll.muonTfMuonIdx[l1_idx]):
+                                                            eta = etas[l1_idx]
+                                                            phi = phis[l1_idx]
+                                                            for hm in hms:
+                                                                hPt, hEta, hPhi, hCharge, hVtx, hRun = hm.handles[('best_probe',)+match_key]
+                                                                hPt.fill(l1Coll.muonEt[l1_idx])
+                                                                hEta.fill(eta)
+                                                                hPhi.fill(phi)
+                                                                hCharge.fill(l1Coll.muonChg[l1_idx])
+                                                                hVtx.fill(nVtx)
+                                                                hRun.fill(runnr)
+                                                                hPt, hEta, hPhi, hCharge, hVtx, hRun, hP, hDelta = hm.handles[('best_l1_muon',)+match_key]
+                                                                hPt.fill(recoColl.pt[probe_idx])
+                                                                hP.fill(probeMomentumDict[probe_idx])
+                                                                hEta.fill(recoColl.eta[probe_idx])
+                                                                hPhi.fill(recoColl.phi[probe_idx])
+                                                                hCharge.fill(recoColl.charge[probe_idx])
+                                                                hVtx.fill(nVtx)
+                                                                hRun.fill(runnr)
+                                                                hDelta.fill(matched_l1_muons[i][2])
+                                                                hDpt, hDinvpt, hDeta, hDphi, hDcharge = hm.handles[('res_best_probe',)+match_key]
+                                                                hDpt.fill(l1Coll.muonEt[l1_idx] - recoColl.pt[probe_idx])
+                                                                hDinvpt.fill((recoColl.pt[probe_idx] - l1Coll.muonEt[l1_idx]) / l1Coll.muonEt[l1_idx])
+                                                                hDeta.fill(eta - probeEtas[probe_idx])
+                                                                hDphi.fill(phi - probePhis[probe_idx])
+                                                                hDcharge.fill(l1Coll.muonChg[l1_idx] - recoColl.charge[probe_idx])
+                                                            for hm2d in hms2d:
+                                                                hPt, hEta, hPhi, hCharge = hm2d.handles[('2d_best_probe',)+match_key]
+                                                                hPt.fill(recoColl.pt[probe_idx], l1Coll.muonEt[l1_idx])
+                                                                hEta.fill(probeEtas[probe_idx], eta)
+                                                                hPhi.fill(probePhis[probe_idx], phi)
+                                                                hCharge.fill(recoColl.charge[probe_idx], l1Coll.muonChg[l1_idx])
+                                                        histo_filled = True
+                                            for hm in hms:
+                                                hm.handles[('n_l1_muons_matched_to_a_probe',)+match_key][0].fill(l1_muon_cntr)
+
+                        # for resolution plots by pT range
+                        for j, probe_pt_min in enumerate(res_probe_ptmins):
+                            if j < len(res_probe_ptmins)-1:
+                                probe_pt_max = res_probe_ptmins[j+1]
+                            else:
+                                probe_pt_max = 1e99
+
+                            eta_thr_probe_idcs = MuonSelections.select_reco_muons(recoColl, pt_min=probe_pt_min, pt_max=probe_pt_max, idcs=eta_probe_idcs)
                             eta_thr_probe_idcs_dict[ptmins[0]] = eta_thr_probe_idcs
-                            # fill the histograms with the probe kinematics
-                            for hm in hms:
-                                hm.fill(namePrefix+'n_probes'+eta_min_str+eta_max_str+probe_ptmin_str, len(eta_thr_probe_idcs))
-                                for i in eta_thr_probe_idcs:
-                                    hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_pt', recoColl.pt[i])
-                                    hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_p', probeMomentumDict[i])
-                                    hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_eta', recoColl.eta[i])
-                                    hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_phi', recoColl.phi[i])
-                                    hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_charge', recoColl.charge[i])
-                                    hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_vtx', nVtx)
-                                    hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_run', runnr)
-
-                        probe_ptmin_str = probe_ptmin_str_dict[ptmins[0]]
-                        eta_thr_probe_idcs = eta_thr_probe_idcs_dict[ptmins[0]]
-                        # for all defined min l1 muon pt
-                        for pt_min in ptmins[1]:
-                            ptmin_str = '_ptmin'+str(pt_min).replace('.', 'p')
-
-                            q_thr_l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, qual_min=q, pt_min=pt_min, idcs=l1_muon_idcs, useVtxExtraCoord=useVtxExtraCoord)
-                            eta_q_thr_l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, pt_min=pt_min, idcs=eta_q_l1_muon_idcs, useVtxExtraCoord=useVtxExtraCoord)
-                            # fill the histograms with the l1 muon kinematics
-                            for hm in hms:
-                                hm.fill(namePrefix+'n_probes'+eta_min_str+eta_max_str+probe_ptmin_str, len(eta_thr_probe_idcs))
-                            for i in eta_q_thr_l1_muon_idcs:
-                                if tftype == -1 or tftype == get_tftype(l1Coll.muonTfMuonIdx[i]):
-                                    if useVtxExtraCoord:
-                                        eta = l1Coll.muonEtaAtVtx[i]
-                                        phi = l1Coll.muonPhiAtVtx[i]
-                                    else:
-                                        eta = l1Coll.muonEta[i]
-                                        phi = l1Coll.muonPhi[i]
-
-                                    for hm in hms:
-                                        hm.fill(namePrefix+'l1_muon'+eta_min_str+eta_max_str+qual_min_str+ptmin_str+'_pt', l1Coll.muonEt[i])
-                                        hm.fill(namePrefix+'l1_muon'+eta_min_str+eta_max_str+qual_min_str+ptmin_str+'_eta', eta)
-                                        hm.fill(namePrefix+'l1_muon'+eta_min_str+eta_max_str+qual_min_str+ptmin_str+'_phi', phi)
-                                        hm.fill(namePrefix+'l1_muon'+eta_min_str+eta_max_str+qual_min_str+ptmin_str+'_charge', l1Coll.muonChg[i])
-                                        hm.fill(namePrefix+'l1_muon'+eta_min_str+eta_max_str+qual_min_str+ptmin_str+'_vtx', nVtx)
-                                        hm.fill(namePrefix+'l1_muon'+eta_min_str+eta_max_str+qual_min_str+ptmin_str+'_run', runnr)
-
-                            if len(q_thr_l1_muon_idcs) > 0:
-                                # for all matching methodes (dr, deta, dphi)
+
+                            q_l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, qual_min=q, idcs=l1_muon_idcs, useVtxExtraCoord=useVtxExtraCoord)
+
+                            if len(q_l1_muon_idcs) > 0:
                                 for delta_type in match_deltas:
                                     match_delta = match_deltas[delta_type]
-                                    delta_str = '_'+delta_type+str(match_delta).replace('.', 'p')
-                                    if delta_type == 'dr':
-                                        matched_l1_muons = Matcher.match_dr(etas, phis, probeEtas, probePhis, cut=match_delta, idcs1=q_thr_l1_muon_idcs, idcs2=eta_thr_probe_idcs) # match in delta R
-                                    elif delta_type == 'deta':
-                                        matched_l1_muons = Matcher.match_dr(etas, zeros, probeEtas, zeros, cut=match_delta, idcs1=q_thr_l1_muon_idcs, idcs2=eta_thr_probe_idcs) # match in delta eta
-                                    elif delta_type == 'dphi':
-                                        matched_l1_muons = Matcher.match_dr(zeros, phis, zeros, probePhis, cut=match_delta, idcs1=q_thr_l1_muon_idcs, idcs2=eta_thr_probe_idcs) # match in delta phi
-                                    else:
+                                    if not delta_type in ['dr', 'deta', 'dphi']:
                                         continue
+                                    matched_l1_muons = distance_table.match(delta_type, cut=match_delta, idcs1=q_l1_muon_idcs, idcs2=eta_thr_probe_idcs) # match in delta R, delta eta or delta phi
 
-                                    for hm in hms:
-                                        hm.fill(namePrefix+'n_probe'+probe_ptmin_str+delta_str+'_matched_l1_muons'+eta_min_str+eta_max_str+qual_min_str+ptmin_str, len(matched_l1_muons))
-
+                                    res_key = ('res_best_probe_ptrange', iEta, q, j, delta_type)
                                     # how many l1 matches did we find for each probe muon
                                     for probe_idx in invmass_probe_idcs:
-                                        l1_muon_cntr = 0
                                         histo_filled = False
                                         # fill matched histograms
                                         for i in range(len(matched_l1_muons)):
                                             if probe_idx == matched_l1_muons[i][1]:
-                                                l1_muon_cntr += 1
                                                 # fill muon values only for the first (and therefore best) match to this probe muon
                                                 if not histo_filled:
-                                                    if tftype == -1 or tftype == get_tftype(l1Coll.muonTfMuonIdx[matched_l1_muons[i][0]]):
-                                                        eta = etas[matched_l1_muons[i][0]]
-                                                        phi = phis[matched_l1_muons[i][0]]
+                                                    l1_idx = matched_l1_muons[i][0]
+                                                    if tftype == -1 or tftype == get_tftype(l1Coll.muonTfMuonIdx[l1_idx]):
+                                                        eta = etas[l1_idx]
+                                                        phi = phis[l1_idx]
                                                         for hm in hms:
-                                                            hm.fill(namePrefix+'best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_pt', l1Coll.muonEt[matched_l1_muons[i][0]])
-                                                            hm.fill(namePrefix+'best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_eta', eta)
-                                                            hm.fill(namePrefix+'best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_phi', phi)
-                                                            hm.fill(namePrefix+'best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_charge', l1Coll.muonChg[matched_l1_muons[i][0]])
-                                                            hm.fill(namePrefix+'best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_vtx', nVtx)
-                                                            hm.fill(namePrefix+'best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_run', runnr)
-                                                            hm.fill(namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+delta_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_pt', recoColl.pt[probe_idx])
-                                                            hm.fill(namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+delta_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_p', probeMomentumDict[probe_idx])
-                                                            hm.fill(namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+delta_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_eta', recoColl.eta[probe_idx])
-                                                            hm.fill(namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+delta_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_phi', recoColl.phi[probe_idx])
-                                                            hm.fill(namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+delta_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_charge', recoColl.charge[probe_idx])
-                                                            hm.fill(namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+delta_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_vtx', nVtx)
-                                                            hm.fill(namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+delta_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_run', runnr)
-                                                            hm.fill(namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+delta_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'_'+delta_type, matched_l1_muons[i][2])
-                                                            hm.fill(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_dpt', l1Coll.muonEt[matched_l1_muons[i][0]] - recoColl.pt[probe_idx])
-                                                            hm.fill(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_dinvpt', (recoColl.pt[probe_idx] - l1Coll.muonEt[matched_l1_muons[i][0]]) / l1Coll.muonEt[matched_l1_muons[i][0]])
-                                                            hm.fill(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_deta', eta - probeEtas[probe_idx])
-                                                            hm.fill(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_dphi', phi - probePhis[probe_idx])
-                                                            hm.fill(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_dcharge', l1Coll.muonChg[matched_l1_muons[i][0]] - recoColl.charge[probe_idx])
-                                                        for hm2d in hms2d:
-                                                            hm2d.fill(namePrefix+'2d_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_pt', recoColl.pt[probe_idx], l1Coll.muonEt[matched_l1_muons[i][0]])
-                                                            hm2d.fill(namePrefix+'2d_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_eta', probeEtas[probe_idx], eta)
-                                                            hm2d.fill(namePrefix+'2d_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_phi', probePhis[probe_idx], phi)
-                                                            hm2d.fill(namePrefix+'2d_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+delta_str+'_matched_l1_muon'+qual_min_str+ptmin_str+'_charge', recoColl.charge[probe_idx], l1Coll.muonChg[matched_l1_muons[i][0]])
+                                                            hDpt, hDinvpt, hDeta, hDphi, hDcharge = hm.handles[res_key]
+                                                            hDpt.fill(l1Coll.muonEt[l1_idx] - recoColl.pt[probe_idx])
+                                                            hDinvpt.fill((recoColl.pt[probe_idx] - l1Coll.muonEt[l1_idx]) / l1Coll.muonEt[l1_idx])
+                                                            hDeta.fill(eta - probeEtas[probe_idx])
+                                                            hDphi.fill(phi - probePhis[probe_idx])
+                                                            hDcharge.fill(l1Coll.muonChg[l1_idx] - recoColl.charge[probe_idx])
+
                                                     histo_filled = True
-                                        for hm in hms:
-                                            hm.fill(namePrefix+'n_l1_muons'+qual_min_str+ptmin_str+delta_str+'_matched_to_a_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'', l1_muon_cntr)
-
-                    # for resolution plots by pT range
-                    for j, probe_pt_min in enumerate(res_probe_ptmins):
-                        probe_ptmin_str = '_ptmin'+str(probe_pt_min).replace('.', 'p')
-                        if j < len(res_probe_ptmins)-1:
-                            probe_pt_max = res_probe_ptmins[j+1]
-                            probe_ptmax_str = '_ptmax'+str(res_probe_ptmins[j+1]).replace('.', 'p')
-                        else:
-                            probe_pt_max = 1e99
-                            probe_ptmax_str = '_ptmax'
-
-                        eta_thr_probe_idcs = MuonSelections.select_reco_muons(recoColl, pt_min=probe_pt_min, pt_max=probe_pt_max, idcs=eta_probe_idcs)
-                        eta_thr_probe_idcs_dict[ptmins[0]] = eta_thr_probe_idcs
-
-                        ## fill the histograms with the probe kinematics
-                        #for hm in hms:
-                        #    hm.fill(namePrefix+'n_probes'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str, len(eta_thr_probe_idcs))
-                        #    for i in eta_thr_probe_idcs:
-                        #        hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+'_pt', recoColl.pt[i])
-                        #        hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+'_p', probeMomentumDict[i])
-                        #        hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+'_eta', recoColl.eta[i])
-                        #        hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+'_phi', recoColl.phi[i])
-                        #        hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+'_charge', recoColl.charge[i])
-                        #        hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+'_vtx', nVtx)
-                        #        hm.fill(namePrefix+'probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+'_run', runnr)
-
-                        q_l1_muon_idcs = MuonSelections.select_ugmt_muons(l1Coll, qual_min=q, idcs=l1_muon_idcs, useVtxExtraCoord=useVtxExtraCoord)
-
-                        if len(q_l1_muon_idcs) > 0:
-                            for delta_type in match_deltas:
-                                match_delta = match_deltas[delta_type]
-                                delta_str = '_'+delta_type+str(match_delta).replace('.', 'p')
-                                if delta_type == 'dr':
-                                    matched_l1_muons = Matcher.match_dr(etas, phis, probeEtas, probePhis, cut=match_delta, idcs1=q_l1_muon_idcs, idcs2=eta_thr_probe_idcs) # match in delta R
-                                elif delta_type == 'deta':
-                                    matched_l1_muons = Matcher.match_dr(etas, zeros, probeEtas, zeros, cut=match_delta, idcs1=q_l1_muon_idcs, idcs2=eta_thr_probe_idcs) # match in delta eta
-                                elif delta_type == 'dphi':
-                                    matched_l1_muons = Matcher.match_dr(zeros, phis, zeros, probePhis, cut=match_delta, idcs1=q_l1_muon_idcs, idcs2=eta_thr_probe_idcs) # match in delta phi
-                                else:
-                                    continue
-
-                                #for hm in hms:
-                                #    hm.fill(namePrefix+'n_probe'+probe_ptmin_str+probe_ptmax_str+delta_str+'_matched_l1_muons'+eta_min_str+eta_max_str+qual_min_str, len(matched_l1_muons))
-
-                                # how many l1 matches did we find for each probe muon
-                                for probe_idx in invmass_probe_idcs:
-                                    l1_muon_cntr = 0
-                                    histo_filled = False
-                                    # fill matched histograms
-                                    for i in range(len(matched_l1_muons)):
-                                        if probe_idx == matched_l1_muons[i][1]:
-                                            l1_muon_cntr += 1
-                                            # fill muon values only for the first (and therefore best) match to this probe muon
-                                            if not histo_filled:
-                                                if tftype == -1 or tftype == get_tftype(l1Coll.muonTfMuonIdx[matched_l1_muons[i][0]]):
-                                                    eta = etas[matched_l1_muons[i][0]]
-                                                    phi = phis[matched_l1_muons[i][0]]
-                                                    for hm in hms:
-                                                        hm.fill(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+delta_str+'_matched_l1_muon'+qual_min_str+'_dpt', l1Coll.muonEt[matched_l1_muons[i][0]] - recoColl.pt[probe_idx])
-                                                        hm.fill(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+delta_str+'_matched_l1_muon'+qual_min_str+'_dinvpt', (recoColl.pt[probe_idx] - l1Coll.muonEt[matched_l1_muons[i][0]]) / l1Coll.muonEt[matched_l1_muons[i][0]])
-                                                        hm.fill(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+delta_str+'_matched_l1_muon'+qual_min_str+'_deta', eta - probeEtas[probe_idx])
-                                                        hm.fill(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+delta_str+'_matched_l1_muon'+qual_min_str+'_dphi', phi - probePhis[probe_idx])
-                                                        hm.fill(namePrefix+'res_best_probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+delta_str+'_matched_l1_muon'+qual_min_str+'_dcharge', l1Coll.muonChg[matched_l1_muons[i][0]] - recoColl.charge[probe_idx])
-
-                                                histo_filled = True
-                                    #for hm in hms:
-                                    #    hm.fill(namePrefix+'n_l1_muons'+qual_min_str+delta_str+'_matched_to_a_probe'+eta_min_str+eta_max_str+probe_ptmin_str+probe_ptmax_str+'', l1_muon_cntr)
-
-
-def save_histos(hm, hm2d, hm_runs, hm2d_runs, outfile):
+    return True
+
+
+def save_histos(hm, hm2d, run_store, outfile, variation_hms=[]):
     '''
     save all histograms in hm to outfile
     '''
     outfile.mkdir('all_runs')
     outfile.cd('all_runs')
-    for varname in hm.get_varnames():
-        hm.get(varname).Write()
-    for varname in hm2d.get_varnames():
-        hm2d.get(varname).Write()
+    hm.write()
+    hm2d.write()
+    if len(variation_hms) > 0:
+        variations_dir = outfile.mkdir('variations')
+        for name, hm_var, hm2d_var in variation_hms:
+            variations_dir.mkdir(name)
+            variations_dir.cd(name)
+            hm_var.write()
+            hm2d_var.write()
     if perRunHistos:
-        for runnr, hm_run in hm_runs.items():
+        for runnr, (hm_run, hm2d_run) in run_store.items():
             outfile.mkdir(str(runnr))
             outfile.cd('/'+str(runnr))
-            for varname in hm_run.get_varnames():
-                hm_run.get(varname).Write()
-        for runnr, hm2d_run in hm2d_runs.items():
-            if outfile.GetDirectory(str(runnr)) == 0:
-                outfile.mkdir(str(runnr))
-            outfile.cd('/'+str(runnr))
-            for varname in hm2d_run.get_varnames():
-                hm2d_run.get(varname).Write()
+            hm_run.write()
+            hm2d_run.write()
         
 
-def main():
-    L1Ana.init_l1_analysis()
-    opts = parse_options_upgradeMuonHistos(parser)
-    print ""
+class TagAndProbeAnalyzer(Analyzer):
+    def __init__(self, outname, eta_ranges, qual_ptmins_dict, res_probe_ptmins, nominal, emul=False, legacy=False, pp_run=True, per_run_reduced=False, max_resident_runs=0, spill_dir=None, variations=[]):
+        super(TagAndProbeAnalyzer, self).__init__(outname)
+        self.eta_ranges = eta_ranges
+        self.qual_ptmins_dict = qual_ptmins_dict
+        self.res_probe_ptmins = res_probe_ptmins
+        self.nominal = nominal
+        self.variations = variations
+        self.emul = emul
+        self.legacy = legacy
+        self.pp_run = pp_run
+        self.per_run_reduced = per_run_reduced
+        self.max_resident_runs = max_resident_runs
+        self.spill_dir = spill_dir
+
+    def book(self):
+        # book the histograms
+        L1Ana.log.info("Booking combined run histograms.")
+        self.hm, self.hm2d = book_histograms(self.eta_ranges, self.qual_ptmins_dict, self.res_probe_ptmins, self.nominal.match_deltas, emul=self.emul, legacy=self.legacy)
+        self.run_store = RunHistStore(self.book_run_histograms, max_resident=self.max_resident_runs, spill_dir=self.spill_dir)
+        # the systematic variations are filled for the combined runs only
+        self.variation_hms = []
+        for variation in self.variations:
+            L1Ana.log.info("Booking histograms for variation {n}.".format(n=variation.name))
+            hm_var, hm2d_var = book_histograms(self.eta_ranges, self.qual_ptmins_dict, self.res_probe_ptmins, variation.match_deltas, emul=self.emul, legacy=self.legacy)
+            self.variation_hms.append((variation.name, hm_var, hm2d_var))
+
+    def book_run_histograms(self, runnr):
+        # histograms per run
+        L1Ana.log.info("Booking histograms for run {r}.".format(r=runnr))
+        return book_histograms(self.eta_ranges, self.qual_ptmins_dict, self.res_probe_ptmins, self.nominal.match_deltas, emul=self.emul, legacy=self.legacy, reduced=self.per_run_reduced)
+
+    def process(self, event):
+        # now do the analysis for all pt cut combinations
+        if perRunHistos:
+            # the run histograms are booked by the store if not already done
+            hm_run, hm2d_run = self.run_store[event.event.run]
+            fills = [(self.nominal, [self.hm, hm_run], [self.hm2d, hm2d_run])]
+        else:
+            fills = [(self.nominal, [self.hm], [self.hm2d])]
+        for variation, (name, hm_var, hm2d_var) in zip(self.variations, self.variation_hms):
+            fills.append((variation, [hm_var], [hm2d_var]))
+        if analyse(event, fills, self.eta_ranges, self.qual_ptmins_dict, self.res_probe_ptmins, emul=self.emul, pp_run=self.pp_run, legacy=self.legacy):
+            # events with a tag for the entry list
+            self.keep_event()
+
+    def save(self, outfile):
+        save_histos(self.hm, self.hm2d, self.run_store, outfile, self.variation_hms)
+        self.run_store.cleanup()
+
+    def save_snapshot(self, outfile):
+        # the spill files are still needed for the runs filled later
+        save_histos(self.hm, self.hm2d, self.run_store, outfile, self.variation_hms)
+
+    def get_state(self):
+        state = super(TagAndProbeAnalyzer, self).get_state()
+        state['variations'] = dict((name, (hm_var.serialize(), hm2d_var.serialize())) for name, hm_var, hm2d_var in self.variation_hms)
+        # spilled runs are not read back, the state refers to their spill files
+        state['runs'] = self.run_store.get_state()
+        return state
+
+    def set_state(self, state):
+        super(TagAndProbeAnalyzer, self).set_state(state)
+        for name, hm_var, hm2d_var in self.variation_hms:
+            data, data2d = state['variations'][name]
+            hm_var.merge(HistManager.deserialize(data, backend=hm_var.backend))
+            hm2d_var.merge(HistManager2d.deserialize(data2d, backend=hm2d_var.backend))
+        self.run_store.set_state(state['runs'])
+
+
+def make_analyzer(args=None):
+    """
+    Set up the analyzer with the options from the command line,
+    or from args if it is run together with other analyses by runAnalyses.py
+    """
+    if args is None:
+        opts = parse_options_upgradeMuonHistos(parser)
+    else:
+        opts = parse_options_upgradeMuonHistos(argparse.ArgumentParser(), args)
 
     global pos_eta
     global neg_eta
@@ -581,6 +750,17 @@ def main():
     global era
     era = opts.era
 
+    global histBackend
+    histBackend = opts.histbackend
+
+    global lazyBooking
+    lazyBooking = opts.lazybooking
+    global writeEmpty
+    writeEmpty = not opts.skipempty
+
+    global perRunHistos
+    perRunHistos = opts.perrunhistos
+
     emul = opts.emul
     legacy = opts.legacy
     pp_run = not opts.pa_run
@@ -646,103 +826,45 @@ def main():
         qual_ptmins_dict = {5:ptmins_list_q12, 3:ptmins_list_q8, 2:ptmins_list_q4}
     else:
         qual_ptmins_dict = {12:ptmins_list_q12, 8:ptmins_list_q8, 4:ptmins_list_q4}
-    match_deltas = {'dr':0.3, 'deta':0.15, 'dphi':0.25} # max deltas for matching
-    if useVtxExtraCoord:
-        match_deltas = {'dr':0.2, 'deta':0.15, 'dphi':0.15} # max deltas for matching with the L1 muon at the vertex
-    if recoExtraStation == 2:
-        match_deltas = {'dr':0.1, 'deta':0.1, 'dphi':0.025} # max deltas for matching with the reco muon at the 2nd muon station
+    match_deltas = default_match_deltas(useVtxExtraCoord, recoExtraStation)
+    nominal = Variation('nominal', match_deltas, inv_mass_cut=useInvMassCut, inv_mass_min=invMassMin, inv_mass_max=invMassMax, l1_extra_coord=useVtxExtraCoord, reco_extra_station=recoExtraStation)
+
+    variations = []
+    if opts.variations:
+        variations = load_variations(opts.variations, nominal)
+        L1Ana.log.info("Systematic variations: {v}".format(v=', '.join([variation.name for variation in variations])))
 
-    # book the histograms
-    L1Ana.log.info("Booking combined run histograms.")
-    hm, hm2d = book_histograms(eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas, emul=emul, legacy=legacy)
-    # histogram dicts per run
-    hm_runs = {}
-    hm2d_runs = {}
-
-    ntuple = L1Ntuple(opts.nevents)
-
-    if opts.flist:
-        ntuple.open_with_file_list(opts.flist)
-    if opts.fname:
-        ntuple.open_with_file(opts.fname)
-
-    # good runs from json file
-    good_ls = None
-    if opts.json:
-        with open(opts.json) as json_file:    
-            good_ls = json.load(json_file)
-
-    # list of runs to run on
-    runs_list = []
-    if opts.runs:
-        runs_list = [int(r) for r in opts.runs.split(",")]
-        L1Ana.log.info("Processing only runs:")
-        print runs_list
-
-    start_evt = opts.start_event
-    end_evt = opts.start_event+ntuple.nevents
-    analysed_evt_ctr = 0
-    try:
-        for i in range(start_evt, end_evt):
-            event = ntuple[i]
-            if (i+1) % 1000 == 0:
-                L1Ana.log.info("Processing event: {n}. Analysed events from selected runs/LS until now: {nAna}".format(n=i+1, nAna=analysed_evt_ctr))
-
-            # if given, only process selected runs
-            runnr = event.event.run
-            if len(runs_list) > 0 and not runnr in runs_list:
-                continue
-
-            # apply json file if loaded
-            if good_ls:
-                analyze_this_ls = False
-                ls = event.event.lumi
-                if str(runnr) in good_ls:
-                    for ls_list in good_ls[str(runnr)]:
-                        if ls >= ls_list[0] and ls <= ls_list[1]:
-                            analyze_this_ls = True
-                            break
-                if not analyze_this_ls:
-                    continue
-
-            # book histograms for this event's run number if not already done
-            if perRunHistos and not runnr in hm_runs:
-                L1Ana.log.info("Booking histograms for run {r}.".format(r=runnr))
-                hm_runs[runnr], hm2d_runs[runnr] = book_histograms(eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas, emul=emul, legacy=legacy)
-
-            # now do the analysis for all pt cut combinations
-            if perRunHistos:
-                analyse(event, [hm, hm_runs[runnr]], [hm2d, hm2d_runs[runnr]], eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas, emul=emul, pp_run=pp_run, legacy=legacy)
-            else:
-                analyse(event, [hm], [hm2d], eta_ranges, qual_ptmins_dict, res_probe_ptmins, match_deltas, emul=emul, pp_run=pp_run, legacy=legacy)
-            analysed_evt_ctr += 1
-    except KeyboardInterrupt:
-        L1Ana.log.info("Analysis interrupted after {n} events".format(n=i))
-
-    L1Ana.log.info("Analysis of {nAna} events in selected runs/LS finished.".format(nAna=analysed_evt_ctr))
+    analyzer = TagAndProbeAnalyzer(opts.outname, eta_ranges, qual_ptmins_dict, res_probe_ptmins, nominal, emul=emul, legacy=legacy, pp_run=pp_run,
+                                   per_run_reduced=opts.perrunreduced, max_resident_runs=opts.maxresidentruns, spill_dir=opts.spilldir, variations=variations)
+    return analyzer, opts
 
+def main():
+    L1Ana.init_l1_analysis()
+    analyzer, opts = make_analyzer()
+    print ""
+
+    loop = EventLoop(opts, [analyzer])
     # save histos to root file
-    if saveHistos:
-        output = root.TFile(opts.outname, 'recreate')
-        output.cd()
-        save_histos(hm, hm2d, hm_runs, hm2d_runs, output)
-        output.Close()
+    loop.run(save=saveHistos)
+
+pos_eta = True
+neg_eta = True
+pos_charge = True
+neg_charge = True
+useInvMassCut = False
+invMassMin = 71
+invMassMax = 111
+useVtxExtraCoord = False
+recoExtraStation = 0
+prefix = ''
+tftype = -1
+era = ''
+histBackend = 'root'
+lazyBooking = False
+writeEmpty = True
+saveHistos = True
+best_only = False
+perRunHistos = False
 
 if __name__ == "__main__":
-    pos_eta = True
-    neg_eta = True
-    pos_charge = True
-    neg_charge = True
-    useInvMassCut = False
-    invMassMin = 71
-    invMassMax = 111
-    useVtxExtraCoord = False
-    recoExtraStation = 0
-    prefix = ''
-    tftype = -1
-    era = ''
-    saveHistos = True
-    best_only = False
-    perRunHistos = False
     main()
-
@@ -135,7 +135,9 @@ def book_histograms(eta_ranges, qual_ptmins_dict, match_deltas, emul=False):
 
                         binnings[namePrefix+'best_l1_muon'+qual_min_str+ptmin_str+dr_str+'_matched_probe'+eta_min_str+eta_max_str+probe_ptmin_str+'.dr'] = [60, 0., 0.6, '#Delta R']
 
-    return HistManager(list(set(varnames)), binnings)
+    # the run number histograms have more than 10000 bins of which only a few are filled
+    sparse = dict((vname, True) for vname in varnames if vname.endswith('.run'))
+    return HistManager(list(set(varnames)), binnings, sparse_dict=sparse)
 
 def fill_matched_muons(evt, hm, matched_muons, muon_type='', eta_strs = ['', ''], ptmin_strs=['', '']):
     eta_min_str = eta_strs[0]
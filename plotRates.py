@@ -72,6 +72,9 @@ def plot_hists(hm, hDefs, xTitle=None, yTitle='# muons', threshold=False, normTo
 
     hs = []
     hStack = root.THStack()
+    if threshold:
+        # integrate all rate curves of the plot in one call
+        hm.get_threshold_hists([hDef['num'] for hDef in hDefs] + ([den] if den else []))
     # get all the histograms and set their plot style
     for hDef in hDefs:
         if threshold:
@@ -84,6 +87,9 @@ def plot_hists(hm, hDefs, xTitle=None, yTitle='# muons', threshold=False, normTo
                 h = hm.get_ratio(hDef['num'], den).Clone()
             else:
                 h = hm.get(hDef['num']).Clone()
+        # counts of a sampled input are scaled to the full input, ratios are not
+        if not den and hm.sample_weight != 1.:
+            h.Scale(hm.sample_weight)
 
         if normToBinWidth and not threshold and not den:
             for bin in range(1, h.GetNbinsX()+1):
@@ -206,10 +212,10 @@ def print_rates(hm, hName, scaleFactor=1.):
     print ''
     histos = []
     print 'System        16 GeV        20 GeV        25 GeV'
-    for name in hNames:
-        histos.append(hm.get_threshold_hist(name).Clone())
-        if scaleFactor != 1.:
-            histos[-1].Scale(scaleFactor)
+    for name, h in zip(hNames, hm.get_threshold_hists(hNames)):
+        histos.append(h.Clone())
+        if scaleFactor*hm.sample_weight != 1.:
+            histos[-1].Scale(scaleFactor*hm.sample_weight)
 
         bin16 = histos[-1].FindBin(16)
         bin20 = histos[-1].FindBin(20)
@@ -454,6 +460,8 @@ def main():
     print ""
 
     hm = HistManager(filename=opts.fname)
+    if hm.sample:
+        print 'Sampled input with weight {w:.3f}, counts are scaled to the full input. The number of events must be that of the full input.'.format(w=hm.sample_weight)
 
     # holds the canvases, histograms, etc.
     objects = []
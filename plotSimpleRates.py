@@ -247,6 +247,15 @@ def plot_hists2(hDefs, axisTitles=['', ''], threshold=False, normToBinWidth=Fals
 
     hs = []
     hStack = root.THStack()
+    if threshold:
+        # integrate all rate curves of the plot in one call per HistManager
+        thrNames = {}
+        for hDef in hDefs:
+            thrNames.setdefault(hDef['hm'], []).append(hDef['num'])
+            if hDef['den']:
+                thrNames.setdefault(hDef['denhm'] or hDef['hm'], []).append(hDef['den'])
+        for thrHm, names in thrNames.items():
+            thrHm.get_threshold_hists(names)
     # get all the histograms and set their plot style
     for hDef in hDefs:
         hm = hDef['hm']
@@ -269,6 +278,10 @@ def plot_hists2(hDefs, axisTitles=['', ''], threshold=False, normToBinWidth=Fals
             if hDenName:
                 hDen = denHm.get(hDenName)
                 h.Divide(h, hDen, 1, 1, "b")
+        # counts of a sampled input are scaled to the full input, ratios only if the inputs have different weights
+        sampleWeight = hm.sample_weight / denHm.sample_weight if hDenName else hm.sample_weight
+        if sampleWeight != 1.:
+            h.Scale(sampleWeight)
 
         if normToBinWidth and not threshold and not hDenName:
             for bin in range(1, h.GetNbinsX()+1):
@@ -389,6 +402,15 @@ def plot_hists(hDefs, xTitle=None, yTitle='# muons', threshold=False, normToBinW
 
     hs = []
     hStack = root.THStack()
+    if threshold:
+        # integrate all rate curves of the plot in one call per HistManager
+        thrNames = {}
+        for hDef in hDefs:
+            thrNames.setdefault(hDef['hm'], []).append(hDef['num'])
+            if den:
+                thrNames[hDef['hm']].append(den)
+        for thrHm, names in thrNames.items():
+            thrHm.get_threshold_hists(names)
     # get all the histograms and set their plot style
     for hDef in hDefs:
         hm = hDef['hm']
@@ -408,6 +430,9 @@ def plot_hists(hDefs, xTitle=None, yTitle='# muons', threshold=False, normToBinW
                 h = hm.get_ratio(hName, den).Clone()
             else:
                 h = hm.get(hName).Clone()
+        # counts of a sampled input are scaled to the full input, ratios are not
+        if not den and hm.sample_weight != 1.:
+            h.Scale(hm.sample_weight)
 
         if normToBinWidth and not threshold and not den:
             for bin in range(1, h.GetNbinsX()+1):
@@ -518,10 +543,10 @@ def print_rates(hm, hName, scaleFactor=1., includeLegacy=False):
     print hName
     print ''
     histos = {}
-    for name in hNames:
-        histos[name] = hm.get_threshold_hist(name).Clone()
-        if scaleFactor != 1.:
-            histos[name].Scale(scaleFactor)
+    for name, h in zip(hNames, hm.get_threshold_hists(hNames)):
+        histos[name] = h.Clone()
+        if scaleFactor*hm.sample_weight != 1.:
+            histos[name].Scale(scaleFactor*hm.sample_weight)
 
     titleStr = 'Threshold'
     for i, title in enumerate(titles):
@@ -556,12 +581,13 @@ def print_rates_comp(hm, hm2, hName, scaleFactor=1., legTxts=['', '']):
     print ''
     histos = {}
     histos2 = {}
-    for name in hNames:
-        histos[name] = hm.get_threshold_hist(name).Clone()
-        histos2[name] = hm2.get_threshold_hist(name).Clone()
-        if scaleFactor != 1.:
-            histos[name].Scale(scaleFactor)
-            histos2[name].Scale(scaleFactor)
+    for name, h, h2 in zip(hNames, hm.get_threshold_hists(hNames), hm2.get_threshold_hists(hNames)):
+        histos[name] = h.Clone()
+        histos2[name] = h2.Clone()
+        if scaleFactor*hm.sample_weight != 1.:
+            histos[name].Scale(scaleFactor*hm.sample_weight)
+        if scaleFactor*hm2.sample_weight != 1.:
+            histos2[name].Scale(scaleFactor*hm2.sample_weight)
 
     titleStr = 'Threshold'
     for i, title in enumerate(titles):
@@ -844,6 +870,10 @@ def main():
  
     nEvtsAna = hm.get('n_evts_analysed').GetBinContent(1)
     print '{n} events have been analysed.'.format(n=nEvtsAna)
+    if hm.sample:
+        # the counts are scaled to the full input, so the rates are normalised to its estimated number of events
+        nEvtsAna *= hm.sample_weight
+        print 'Sampled input with weight {w:.3f}: {e:.0f} +- {u:.0f} events estimated in the full input.'.format(w=hm.sample_weight, e=hm.sample[1], u=hm.sample[2])
 
     # calculate the scale factor for rate in Hz
     orbitFreq = 11245.6
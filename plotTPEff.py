@@ -298,30 +298,41 @@ def plot_effs(hDefs, xTitle=None, yTitle='# muons', prefix='', notes=None, autoZ
     drawOpts = 'PZ0'
     effs = []
     effGraphs = []
-    # get all the histograms and set their plot style
+    # compute the efficiencies of all curves in one call per HistManager
+    hDefsFound = []
+    effPairs = {}
     for hDef in hDefs:
         hm = hDef['hm']
         if hDef['num'] not in hm.get_varnames() or hDef['den'] not in hm.get_varnames():
             print 'Error: ' + hDef['num'] + ' or ' + hDef['den'] + ' not found.'
             continue
+        hDefsFound.append(hDef)
+        effPairs.setdefault(hm, []).append((hDef['num'], hDef['den']))
+    effDict = {}
+    for hm, pairs in effPairs.items():
         if addOverflow and xMax != None:
-            eff = hm.get_efficiency_int(hDef['num'], hDef['den'], integrateToFromRight=xMax, rebin=rebin, removeProbeBinsNEntriesBelow=0).Clone()
+            hmEffs = hm.get_efficiencies(pairs, integrateToFromRight=xMax, rebin=rebin, removeProbeBinsNEntriesBelow=0)
         else:
-            eff = hm.get_efficiency(hDef['num'], hDef['den'], addoverflow=addOverflow, rebin=rebin, removeProbeBinsNEntriesBelow=0).Clone()
-
-        eff.SetLineColor(hDef['lc'])
-        eff.SetLineStyle(hDef['ls'])
-        eff.SetLineWidth(2)
-        eff.SetMarkerColor(hDef['mc'])
-        eff.SetMarkerStyle(hDef['ms'])
-        eff.SetMarkerSize(0.75)
+            hmEffs = hm.get_efficiencies(pairs, addoverflow=addOverflow, rebin=rebin, removeProbeBinsNEntriesBelow=0)
+        for pair, eff in zip(pairs, hmEffs):
+            effDict[(hm,)+pair] = eff
+    # get all the efficiency graphs and set their plot style
+    for hDef in hDefsFound:
+        eff = effDict[(hDef['hm'], hDef['num'], hDef['den'])]
+        effGraph = eff.to_graph()
+        effGraph.SetLineColor(hDef['lc'])
+        effGraph.SetLineStyle(hDef['ls'])
+        effGraph.SetLineWidth(2)
+        effGraph.SetMarkerColor(hDef['mc'])
+        effGraph.SetMarkerStyle(hDef['ms'])
+        effGraph.SetMarkerSize(0.75)
         legStyle = 'lep'
         if hDef['fc']:
-            eff.SetFillColor(hDef['fc'])
-            eff.SetLineWidth(1)
+            effGraph.SetFillColor(hDef['fc'])
+            effGraph.SetLineWidth(1)
             legStyle = 'f'
         effs.append(eff)
-        effGraphs.append(eff.CreateGraph('A'+drawOpts))
+        effGraphs.append(effGraph)
         if hDef['legtext']:
             draw_legend = True
             legEntries.append(legend.AddEntry(effGraphs[-1], hDef['legtext'], legStyle))
@@ -340,9 +351,8 @@ def plot_effs(hDefs, xTitle=None, yTitle='# muons', prefix='', notes=None, autoZ
         return [c]
 
     # axis
-    totHist0 = effs[0].GetTotalHistogram()
-    xRangeLo = totHist0.GetXaxis().GetBinLowEdge(1)
-    xRangeHi = totHist0.GetXaxis().GetBinUpEdge(totHist0.GetNbinsX())
+    xRangeLo = effs[0].axis.bin_edges()[0]
+    xRangeHi = effs[0].axis.bin_edges()[-1]
     effGraphs[0].GetXaxis().SetLimits(xRangeLo, xRangeHi)
     axisHisto = effGraphs[0].GetHistogram()
     xAxis = axisHisto.GetXaxis()
@@ -1103,7 +1113,10 @@ def main():
     if legacy:
         prefix = 'legacy_'
 
-    hm = HistManager(filename=opts.fname, subdir=opts.runnr)
+    hm = HistManager(filename=opts.fname, subdir=opts.runnr, lazy=True)
+    if hm.sample:
+        # the binomial intervals need the unscaled counts, the efficiency does not depend on the weight
+        print 'Sampled input: the efficiencies and their intervals are computed from the sampled events.'
 
     objects = []
 
@@ -1353,7 +1366,7 @@ def main():
 
     # 2d reco vs. L1 plots
     if opts.twod:
-        hm2d = HistManager2d(filename=opts.fname, subdir=opts.runnr)
+        hm2d = HistManager2d(filename=opts.fname, subdir=opts.runnr, lazy=True)
         etaRanges2d = [reco_0to0p83, reco_0p83to1p24, reco_1p24to2p4]
         etaRange = reco_0to2p4
         # quality 8
@@ -1620,7 +1633,7 @@ def main():
             runnr2 = opts.runnr2
         else:
             runnr2 = 'all_runs'
-        hm2 = HistManager(filename=opts.fname2, subdir=runnr2)
+        hm2 = HistManager(filename=opts.fname2, subdir=runnr2, lazy=True)
         legTxt1 = opts.legtxt1
         legTxt2 = opts.legtxt2
         
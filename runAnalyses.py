@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+from ToolBox import parse_options_and_init_log
+# have to do this first or ROOT masks the -h messages
+opts, parser = parse_options_and_init_log()
+
+from L1Analysis import L1Ana
+from analysis_tools.eventloop import EventLoop
+import imp
+import shlex
+
+def parse_options_runAnalyses(parser):
+    """
+    Adds often used options to the OptionParser...
+    """
+    parsers = parser.add_subparsers()
+    sub_parser = parsers.add_parser("runAnalyses")
+    sub_parser.add_argument("-a", "--analysis", dest="analyses", type=str, action="append", default=[], help="Analysis script followed by its sub command and options, e.g. \"muonTagAndProbe.py muonTagAndProbe --emul -o tp_emul.root\". Can be given several times.")
+    sub_parser.add_argument("-j", "--json", dest="json", type=str, default=None, help="A json file with good lumi sections per run.")
+    sub_parser.add_argument("-r", "--runs", dest="runs", type=str, default=None, help="A string of runs to check.")
+
+    opts, unknown = parser.parse_known_args()
+    return opts
+
+def load_analyzers(analyses):
+    """
+    Load every analysis script as its own module, so that the global settings of
+    two instances of the same script do not interfere, and set up its analyzer
+    """
+    analyzers = []
+    for i, analysis in enumerate(analyses):
+        args = shlex.split(analysis)
+        module = imp.load_source('analysis_{i}'.format(i=i), args[0])
+        analyzer, analysis_opts = module.make_analyzer(args[1:])
+        L1Ana.log.info("Analysis {i}: {a} writing to {out}".format(i=i, a=args[0], out=analyzer.outname))
+        analyzers.append(analyzer)
+    return analyzers
+
+def main():
+    L1Ana.init_l1_analysis()
+    opts = parse_options_runAnalyses(parser)
+    if len(opts.analyses) == 0:
+        L1Ana.log.fatal("No analyses specified!")
+        return
+    analyzers = load_analyzers(opts.analyses)
+    print ""
+
+    loop = EventLoop(opts, analyzers)
+    loop.run()
+
+if __name__ == "__main__":
+    main()
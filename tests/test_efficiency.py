@@ -0,0 +1,85 @@
+import unittest
+from math import exp, lgamma, log
+
+try:
+    import ROOT as root
+except ImportError:
+    root = None
+
+if root is not None:
+    import numpy as np
+    from analysis_tools.efficiency import CONF_LEVEL, binomial_interval, clopper_pearson, wilson
+
+
+def binomial_tail(k, n, p):
+    """P(X >= k) for X binomially distributed with n trials and probability p"""
+    if k <= 0:
+        return 1.
+    return sum(exp(lgamma(n+1.) - lgamma(j+1.) - lgamma(n-j+1.) + j*log(p) + (n-j)*log(1.-p)) for j in range(k, n+1))
+
+
+@unittest.skipIf(root is None, "ROOT is not available")
+class TestClopperPearson(unittest.TestCase):
+    """Clopper-Pearson intervals against closed forms, the binomial distribution and TEfficiency"""
+
+    def setUp(self):
+        self.alpha = 0.5*(1.-CONF_LEVEL)
+
+    def interval(self, k, n):
+        low, up = clopper_pearson(np.array([k], dtype='d'), np.array([n], dtype='d'))
+        return low[0], up[0]
+
+    def test_no_passed(self):
+        for n in [1, 2, 10, 1000, 10**7]:
+            low, up = self.interval(0, n)
+            self.assertEqual(low, 0.)
+            # (1-up)^n = alpha
+            self.assertAlmostEqual(up, 1.-self.alpha**(1./n), delta=1e-9*up)
+
+    def test_all_passed(self):
+        for n in [1, 2, 10, 1000, 10**7]:
+            low, up = self.interval(n, n)
+            self.assertEqual(up, 1.)
+            # low^n = alpha
+            self.assertAlmostEqual(low, self.alpha**(1./n), delta=1e-9)
+
+    def test_binomial_tails(self):
+        # the bounds are the probabilities for which k or more, or k or fewer, passed events have probability alpha
+        for k, n in [(1, 2), (3, 10), (5, 10), (9, 10), (1, 500), (250, 500), (499, 500), (950, 1000)]:
+            low, up = self.interval(k, n)
+            self.assertAlmostEqual(binomial_tail(k, n, low), self.alpha, places=9)
+            self.assertAlmostEqual(1.-binomial_tail(k+1, n, up), self.alpha, places=9)
+
+    def test_teefficiency(self):
+        cases = [(0, 1), (1, 1), (0, 7), (3, 7), (7, 7), (17, 1000), (500, 1000), (999, 1000),
+                 (0, 10**6), (1, 10**6), (123456, 10**6), (999999, 10**6), (10**6, 10**6), (9999000, 10**7)]
+        passed = np.array([k for k, n in cases], dtype='d')
+        total = np.array([n for k, n in cases], dtype='d')
+        for level in [CONF_LEVEL, 0.95]:
+            low, up = clopper_pearson(passed, total, level)
+            for (k, n), l, u in zip(cases, low, up):
+                self.assertAlmostEqual(l, root.TEfficiency.ClopperPearson(n, k, level, False), delta=1e-9)
+                self.assertAlmostEqual(u, root.TEfficiency.ClopperPearson(n, k, level, True), delta=1e-9)
+
+    def test_empty_bins(self):
+        low, up = binomial_interval([0, 0, 2], [0, 4, 0])
+        self.assertEqual(list(low), [0., 0., 0.])
+        self.assertEqual(list(up)[::2], [0., 0.])
+        self.assertGreater(up[1], 0.)
+
+
+@unittest.skipIf(root is None, "ROOT is not available")
+class TestWilson(unittest.TestCase):
+
+    def test_teefficiency(self):
+        cases = [(0, 1), (1, 1), (0, 7), (3, 7), (7, 7), (500, 1000), (0, 10**6), (999999, 10**6), (10**7, 10**7)]
+        passed = np.array([k for k, n in cases], dtype='d')
+        total = np.array([n for k, n in cases], dtype='d')
+        low, up = wilson(passed, total)
+        for (k, n), l, u in zip(cases, low, up):
+            self.assertAlmostEqual(l, root.TEfficiency.Wilson(n, k, CONF_LEVEL, False), delta=1e-9)
+            self.assertAlmostEqual(u, root.TEfficiency.Wilson(n, k, CONF_LEVEL, True), delta=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import random
+import unittest
+from array import array
+
+try:
+    import ROOT as root
+except ImportError:
+    root = None
+
+if root is not None:
+    root.gROOT.SetBatch(True)
+    from analysis_tools.plotting import HistManager, HistManager2d
+
+
+FIXED = (7, -2.4, 2.4, '#eta')
+VARIABLE = (-1, 0., 1., 2.5, 5., 10., 25., 'p_{T}', 'GeV')
+
+
+def edge_values(binning):
+    """Values exactly on all bin edges, next to them and outside of the axis"""
+    if binning[0] < 0:
+        edges = [x for x in binning[1:] if not isinstance(x, str)]
+    else:
+        nbins, xmin, xmax = binning[:3]
+        # the edges as computed by TAxis
+        edges = [xmin + k*(xmax-xmin)/nbins for k in range(nbins+1)]
+    values = []
+    for edge in edges:
+        values += [edge, edge-1e-9, edge+1e-9]
+    return values + [edges[0]-100., edges[-1]+100., float('nan')]
+
+
+def random_values(binning, n, seed):
+    rng = random.Random(seed)
+    if binning[0] < 0:
+        xmin, xmax = binning[1], [x for x in binning[1:] if not isinstance(x, str)][-1]
+    else:
+        xmin, xmax = binning[1], binning[2]
+    width = xmax-xmin
+    return [rng.uniform(xmin-0.1*width, xmax+0.1*width) for i in range(n)]
+
+
+@unittest.skipIf(root is None, "ROOT is not available")
+class TestBackendEquivalence(unittest.TestCase):
+    """Histograms filled with the numpy backend export to the same ROOT histograms as the root backend"""
+
+    def assertSameHist(self, h_root, h_numpy):
+        self.assertEqual(h_root.GetNcells(), h_numpy.GetNcells())
+        # including underflow and overflow
+        for b in range(h_root.GetNcells()):
+            self.assertAlmostEqual(h_root.GetBinContent(b), h_numpy.GetBinContent(b), places=9, msg="content of bin {b}".format(b=b))
+            self.assertAlmostEqual(h_root.GetBinError(b), h_numpy.GetBinError(b), places=9, msg="error of bin {b}".format(b=b))
+        stats_root = array('d', [0.]*13)
+        stats_numpy = array('d', [0.]*13)
+        h_root.GetStats(stats_root)
+        h_numpy.GetStats(stats_numpy)
+        for s_root, s_numpy in zip(stats_root, stats_numpy):
+            self.assertAlmostEqual(s_root, s_numpy, places=6)
+        self.assertEqual(h_root.GetEntries(), h_numpy.GetEntries())
+
+    def fill_1d(self, binning, weighted=False, profile=False):
+        values = edge_values(binning) + random_values(binning, 500, 1)
+        rng = random.Random(2)
+        weights = [rng.uniform(0.5, 2.) if weighted or profile else 1. for val in values]
+        hists = []
+        for backend in ['root', 'numpy']:
+            hm = HistManager(['h', 'h_many'], {'h': binning, 'h_many': binning}, profile_dict={'h': profile, 'h_many': profile}, backend=backend, buffer_size=100)
+            for val, weight in zip(values, weights):
+                hm.fill('h', val, weight)
+            hm.fill_many('h_many', values, weights)
+            hists.append((hm.get('h'), hm.get('h_many')))
+        for h_root, h_numpy in zip(*hists):
+            self.assertSameHist(h_root, h_numpy)
+
+    def test_fixed_binning(self):
+        self.fill_1d(FIXED)
+
+    def test_variable_binning(self):
+        self.fill_1d(VARIABLE)
+
+    def test_weighted(self):
+        self.fill_1d(FIXED, weighted=True)
+        self.fill_1d(VARIABLE, weighted=True)
+
+    def test_profile(self):
+        self.fill_1d(VARIABLE, profile=True)
+
+    def test_2d(self):
+        binnings = [(FIXED, VARIABLE), (VARIABLE, FIXED)]
+        for binning_x, binning_y in binnings:
+            xs = edge_values(binning_x) + random_values(binning_x, 500, 3)
+            ys = list(reversed(edge_values(binning_y))) + random_values(binning_y, 500, 4)
+            n = min(len(xs), len(ys))
+            rng = random.Random(5)
+            weights = [rng.uniform(0.5, 2.) for i in range(n)]
+            hists = []
+            for backend in ['root', 'numpy']:
+                hm = HistManager2d(['h', 'h_weighted'], {'h': (binning_x, binning_y), 'h_weighted': (binning_x, binning_y)}, backend=backend, buffer_size=100)
+                for valx, valy, weight in zip(xs[:n], ys[:n], weights):
+                    hm.fill('h', valx, valy)
+                    hm.fill('h_weighted', valx, valy, weight)
+                hists.append((hm.get('h'), hm.get('h_weighted')))
+            for h_root, h_numpy in zip(*hists):
+                self.assertSameHist(h_root, h_numpy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import ROOT as root
+except ImportError:
+    root = None
+
+if root is not None:
+    root.gROOT.SetBatch(True)
+    import mergeHistos
+    from L1Analysis import L1Ana
+    from analysis_tools.sampling import SAMPLE_PARAMS, read_sample
+
+
+@unittest.skipIf(root is None, "ROOT is not available")
+class TestMergeHistos(unittest.TestCase):
+
+    def setUp(self):
+        L1Ana.init_logging("L1Analysis")
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_input(self, name, k, runs, run_hists=('n',), params=()):
+        """Job output with k entries in bin k of all_runs/n, one directory per run and the parameters (name, value)"""
+        fname = os.path.join(self.tmp_dir, name)
+        outfile = root.TFile(fname, 'recreate')
+        for dirname, hnames in [('all_runs', ['n'])] + [(str(run), run_hists) for run in runs]:
+            outfile.mkdir(dirname)
+            outfile.cd(dirname)
+            for hname in hnames:
+                h = root.TH1D(hname, "", 20, 0., 20.)
+                h.Fill(k, k)
+                h.Write()
+        outfile.cd()
+        for pname, value in params:
+            root.TParameter('double')(pname, value).Write()
+        outfile.Close()
+        return fname
+
+    def read_hist(self, fname, path):
+        infile = root.TFile(fname)
+        h = infile.Get(path)
+        h.SetDirectory(0)
+        infile.Close()
+        return h
+
+    def test_reduction_tree(self):
+        # 7 inputs with 3 workers give 3 partial sums, 5 inputs with 5 workers 5, so one partial sum waits a level
+        for n_inputs, workers in [(7, 3), (5, 5), (6, 4), (1, 2)]:
+            fnames = [self.make_input('in_{n}_{i}.root'.format(n=n_inputs, i=i), i, [100+i % 2]) for i in range(n_inputs)]
+            outname = os.path.join(self.tmp_dir, 'out_{n}.root'.format(n=n_inputs))
+            mergeHistos.merge(fnames, outname, workers)
+            h = self.read_hist(outname, 'all_runs/n')
+            for i in range(n_inputs):
+                self.assertEqual(h.GetBinContent(i+1), i)
+            self.assertEqual(h.GetEntries(), n_inputs)
+            h_run = self.read_hist(outname, '100/n')
+            self.assertEqual(h_run.GetEntries(), (n_inputs+1)//2)
+            # the partial sums are removed
+            self.assertEqual([f for f in os.listdir(self.tmp_dir) if f.startswith('merge_')], [])
+
+    def test_run_dirs_in_digest(self):
+        fname, problem, digest_a, n_a, has_trees, params = mergeHistos.check_input(self.make_input('a.root', 1, [100, 101]))
+        self.assertIsNone(problem)
+        # other runs with the same histograms
+        digest_b = mergeHistos.check_input(self.make_input('b.root', 2, [200]))[2]
+        self.assertEqual(digest_a, digest_b)
+        # a run with another histogram
+        digest_c = mergeHistos.check_input(self.make_input('c.root', 3, [100], run_hists=('n', 'pt')))[2]
+        self.assertNotEqual(digest_a, digest_c)
+        missing = mergeHistos.check_input(os.path.join(self.tmp_dir, 'missing.root'))
+        self.assertEqual(missing[1], "missing")
+
+    def test_sample_params(self):
+        # two sampled jobs with the weights 50 and 25
+        samples = [(20., 1000., 900.), (10., 250., 400.)]
+        fnames = [self.make_input('s_{i}.root'.format(i=i), i, [100], params=zip(SAMPLE_PARAMS, sample)) for i, sample in enumerate(samples)]
+        good, bad, has_trees = mergeHistos.check_inputs(fnames, 2, False)
+        self.assertEqual(good, fnames)
+        outname = os.path.join(self.tmp_dir, 'out.root')
+        mergeHistos.merge(good, outname, 2)
+        infile = root.TFile(outname)
+        self.assertEqual(read_sample(infile), (1250./30., 1250., 50.))
+        infile.Close()
+        # the same as the inputs are finished
+        watch_name = os.path.join(self.tmp_dir, 'watched.root')
+        self.assertEqual(mergeHistos.watch(fnames, watch_name, 2, 0.1, False, False), ([], []))
+        infile = root.TFile(watch_name)
+        self.assertEqual(read_sample(infile), (1250./30., 1250., 50.))
+        infile.Close()
+
+    def test_different_params(self):
+        fnames = [self.make_input('p_{i}.root'.format(i=i), i, [100], params=[('n_bunches', 2400.)]) for i in range(3)]
+        fnames.append(self.make_input('p_other.root', 3, [100], params=[('n_bunches', 1200.)]))
+        good, bad, has_trees = mergeHistos.check_inputs(fnames, 2, False)
+        self.assertEqual(good, fnames[:3])
+        self.assertEqual(bad, fnames[3:])
+        outname = os.path.join(self.tmp_dir, 'out.root')
+        mergeHistos.merge(good, outname, 2)
+        infile = root.TFile(outname)
+        self.assertEqual(infile.Get('n_bunches').GetVal(), 2400.)
+        infile.Close()
+        self.assertRaises(ValueError, mergeHistos.merge_files, (fnames, outname))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+try:
+    import ROOT as root
+except ImportError:
+    root = None
+
+if root is not None:
+    root.gROOT.SetBatch(True)
+    from analysis_tools.plotting import HistManager, HistManager2d, RunHistStore
+
+
+@unittest.skipIf(root is None, "ROOT is not available")
+class TestExportErrors(unittest.TestCase):
+    """Unweighted histograms get their errors on export without changing the stored histogram"""
+
+    def test_hist_manager(self):
+        hm = HistManager(['pt'], {'pt': (10, 0., 10., 'p_{T}')})
+        for val in [0.5, 1.5, 1.5]:
+            hm.fill('pt', val)
+        h = hm.get('pt')
+        self.assertGreater(h.GetSumw2N(), 0)
+        self.assertAlmostEqual(h.GetBinError(2), 2**0.5)
+        self.assertEqual(hm.hists['pt'].GetSumw2N(), 0)
+        hm.fill('pt', 1.5)
+        self.assertEqual(hm.get('pt').GetBinContent(2), 3.)
+        self.assertEqual(hm.hists['pt'].GetSumw2N(), 0)
+
+    def test_hist_manager_2d(self):
+        hm = HistManager2d(['eta_phi'], {'eta_phi': [(4, -2., 2., 'eta'), (4, -2., 2., 'phi')]})
+        hm.fill('eta_phi', 0.5, 0.5)
+        h = hm.get('eta_phi')
+        self.assertGreater(h.GetSumw2N(), 0)
+        self.assertEqual(h.GetBinContent(3, 3), 1.)
+        self.assertEqual(hm.hists['eta_phi'].GetSumw2N(), 0)
+
+
+@unittest.skipIf(root is None, "ROOT is not available")
+class TestFillBuffers(unittest.TestCase):
+    """Scalar fills are buffered per histogram and all buffers are flushed at max_buffered values"""
+
+    def setUp(self):
+        self.varnames = ['h{i}'.format(i=i) for i in range(10)]
+        binnings = dict((vname, (10, 0., 10., 'x')) for vname in self.varnames)
+        self.hm = HistManager(self.varnames, binnings, buffer_size=100, max_buffered=25)
+
+    def test_manager_wide_limit(self):
+        for i in range(24):
+            self.hm.fill(self.varnames[i % 10], 1.5)
+        self.assertEqual(self.hm.hists['h0'].GetBinContent(2), 0.)
+        self.hm.fill('h0', 1.5)
+        self.assertEqual(self.hm._n_buffered, 0)
+        self.assertEqual(sum(len(values) for values, weights in self.hm._buffers.values()), 0)
+        self.assertEqual(self.hm.hists['h0'].GetBinContent(2), 4.)
+        self.assertEqual(self.hm.hists['h9'].GetBinContent(2), 2.)
+
+    def test_handles(self):
+        handle = self.hm.get_handle('h3')
+        for i in range(30):
+            handle.fill(2.5)
+            self.hm.fill('h4', 2.5)
+        self.assertLess(self.hm._n_buffered, 25)
+        self.assertEqual(self.hm.get('h3').GetBinContent(3), 30.)
+        self.assertEqual(self.hm.get('h4').GetBinContent(3), 30.)
+
+
+@unittest.skipIf(root is None, "ROOT is not available")
+class TestRunHistStore(unittest.TestCase):
+    """Spilled runs stay on disk in checkpoint states and are merged back in items()"""
+
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_dir)
+
+    def book(self, runnr):
+        return (HistManager(['n'], {'n': (10, 0., 10., 'n')}, backend='numpy'),)
+
+    def fill(self, store, runs):
+        for runnr in runs:
+            store[runnr][0].fill('n', 1.5)
+
+    def contents(self, store):
+        return dict((runnr, managers[0].get('n').GetBinContent(2)) for runnr, managers in store.items())
+
+    def test_state_refers_to_spill_files(self):
+        store = RunHistStore(self.book, max_resident=1, spill_dir=self.spill_dir)
+        self.fill(store, [1, 1, 2, 1, 3, 3])
+        state = store.get_state()
+        self.assertEqual(sorted(state['resident'].keys()), [3])
+        self.assertEqual(sorted(state['spilled'].keys()), [1, 2])
+        self.assertEqual(len(state['spilled'][1]), 2)
+        # filling after the state was taken does not change the files it refers to
+        self.fill(store, [1, 2])
+
+        resumed = RunHistStore(self.book, max_resident=1, spill_dir=self.spill_dir)
+        resumed.set_state(state)
+        self.assertEqual(self.contents(resumed), {1: 3., 2: 1., 3: 2.})
+        self.assertEqual(self.contents(store), {1: 4., 2: 2., 3: 2.})
+        # items() does not change the stored contents
+        self.assertEqual(self.contents(store), {1: 4., 2: 2., 3: 2.})
+
+        store.cleanup()
+        resumed.cleanup()
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+
+@unittest.skipIf(root is None, "ROOT is not available")
+class TestCategoryHist(unittest.TestCase):
+    """Histogram families give the same histograms as one histogram per category"""
+
+    systems = ['bmtf', 'omtf', 'emtf']
+    binning = (18, -3.2, 3.2, '#phi')
+
+    def varname(self, system, qual):
+        return '{s}_muon_q{q}_phi'.format(s=system, q=qual)
+
+    def book(self, lazy=False, write_empty=True, sparse=False):
+        varnames = [self.varname(system, qual) for system in self.systems for qual in range(16)]
+        binnings = dict((vname, self.binning) for vname in varnames)
+        hm = HistManager([], binnings, lazy=lazy, write_empty=write_empty)
+        varname_dict = dict(((iSys, qual), self.varname(system, qual)) for iSys, system in enumerate(self.systems) for qual in range(16))
+        hm.book_category_hist('muon_q_phi', [('system', self.systems), ('quality', range(16))], varname_dict, sparse=sparse)
+        return hm
+
+    def muons(self, n):
+        rng = random.Random(1)
+        # only some of the qualities are filled
+        return [(rng.randrange(len(self.systems)), rng.choice([0, 4, 8, 11, 12, 15]), rng.uniform(-3.5, 3.5)) for i in range(n)]
+
+    def assertSameHist(self, h_ref, h):
+        self.assertEqual(h_ref.GetName(), h.GetName())
+        self.assertEqual(h_ref.GetXaxis().GetTitle(), h.GetXaxis().GetTitle())
+        for b in range(h_ref.GetNcells()):
+            self.assertAlmostEqual(h_ref.GetBinContent(b), h.GetBinContent(b))
+            self.assertAlmostEqual(h_ref.GetBinError(b), h.GetBinError(b))
+        self.assertEqual(h_ref.GetEntries(), h.GetEntries())
+
+    def test_projection_equals_per_quality_loops(self):
+        muons = self.muons(2000)
+        # one histogram per system and quality, filled in a loop over all qualities
+        varnames = [self.varname(system, qual) for system in self.systems for qual in range(16)]
+        hm_ref = HistManager(varnames, dict((vname, self.binning) for vname in varnames))
+        for qual in range(16):
+            for iSys, mu_qual, phi in muons:
+                if mu_qual == qual:
+                    hm_ref.fill(self.varname(self.systems[iSys], qual), phi)
+        for sparse in [False, True]:
+            hm = self.book(sparse=sparse)
+            for iSys, qual, phi in muons:
+                hm.fill_category('muon_q_phi', (iSys, qual), phi)
+            self.assertFalse(hm.categories['muon_q_phi'].weighted)
+            for vname in varnames:
+                self.assertSameHist(hm_ref.get(vname), hm.get(vname))
+
+    def test_weighted_fill(self):
+        hm = self.book(sparse=True)
+        hm.fill_category('muon_q_phi', (0, 3), 0.1)
+        hm.fill_category('muon_q_phi', (0, 3), 0.1, 2.)
+        h = hm.get(self.varname('bmtf', 3))
+        self.assertTrue(hm.categories['muon_q_phi'].weighted)
+        b = h.FindBin(0.1)
+        self.assertEqual(h.GetBinContent(b), 3.)
+        self.assertAlmostEqual(h.GetBinError(b), 5**0.5)
+
+    def test_skip_empty(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for write_empty in [True, False]:
+                hm = self.book(lazy=True, write_empty=write_empty, sparse=True)
+                hm.fill_category('muon_q_phi', (1, 12), 0.5)
+                hm.fill_category('muon_q_phi', (2, 0), 3.5)
+                outfile = root.TFile(os.path.join(tmp_dir, 'out.root'), 'recreate')
+                hm.write()
+                names = set(key.GetName() for key in outfile.GetListOfKeys())
+                outfile.Close()
+                if write_empty:
+                    self.assertEqual(len(names), len(self.systems)*16)
+                else:
+                    self.assertEqual(names, set([self.varname('omtf', 12), self.varname('emtf', 0)]))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+@unittest.skipIf(root is None, "ROOT is not available")
+class TestLazyLoad(unittest.TestCase):
+    """The input file is only open while histograms are read from it"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp_dir, 'in.root')
+        outfile = root.TFile(self.fname, 'recreate')
+        outfile.mkdir('all_runs')
+        outfile.cd('all_runs')
+        for i, name in enumerate(['pt', 'eta', 'phi']):
+            h = root.TH1D(name, "", 10, 0., 10.)
+            h.Fill(i)
+            h.Write()
+        h2 = root.TH2D('pt_eta', "", 10, 0., 10., 10, 0., 10.)
+        h2.Fill(1., 2.)
+        h2.Write()
+        outfile.Close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertClosed(self):
+        self.assertFalse(any(f.GetName() == self.fname for f in root.gROOT.GetListOfFiles()))
+
+    def test_hist_manager(self):
+        hm = HistManager(filename=self.fname, subdir='all_runs', lazy=True, preload=['pt', 'phi'])
+        self.assertClosed()
+        self.assertEqual(sorted(hm.hists), ['phi', 'pt'])
+        self.assertEqual(hm.get('eta').GetBinContent(2), 1.)
+        self.assertClosed()
+        hm.load()
+        self.assertEqual(sorted(hm.hists), ['eta', 'phi', 'pt', 'pt_eta'])
+        self.assertEqual(hm.get('phi').GetBinContent(3), 1.)
+        self.assertClosed()
+
+    def test_hist_manager_2d(self):
+        hm2d = HistManager2d(filename=self.fname, subdir='all_runs', lazy=True)
+        self.assertClosed()
+        self.assertEqual(hm2d.get('pt_eta').GetBinContent(2, 3), 1.)
+        self.assertClosed()
+        self.assertIsNone(hm2d.sample)
+
+    def test_sample(self):
+        hm = HistManager(filename=self.fname, subdir='all_runs', lazy=True)
+        self.assertIsNone(hm.sample)
+        self.assertEqual(hm.sample_weight, 1.)
+        outfile = root.TFile(self.fname, 'update')
+        for name, value in [('sample_selected', 40.), ('sample_estimate', 2000.), ('sample_variance', 10000.)]:
+            root.TParameter('double')(name, value).Write()
+        outfile.Close()
+        hm = HistManager(filename=self.fname, subdir='all_runs', lazy=True)
+        self.assertEqual(hm.sample, (50., 2000., 100.))
+        self.assertEqual(hm.sample_weight, 50.)
+
+
+if __name__ == '__main__':
+    unittest.main()
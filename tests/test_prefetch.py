@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    import ROOT as root
+except ImportError:
+    root = None
+
+if root is not None:
+    from L1Analysis import FilePrefetcher, L1Ana
+
+
+@unittest.skipIf(root is None, "ROOT is not available")
+class TestFilePrefetcher(unittest.TestCase):
+    """Local files are prepared in the background while the current file is processed"""
+
+    # seconds to prepare and to process one file
+    latency = 0.2
+
+    def setUp(self):
+        L1Ana.init_logging()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fnames = []
+        for k in range(4):
+            fname = os.path.join(self.tmp_dir, 'ntuple_{k}.root'.format(k=k))
+            with open(fname, 'wb') as f:
+                f.write('root' + '\0'*(3*1024*1024))
+            self.fnames.append(fname)
+        self.prepared = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def slow_warm(self, fname):
+        time.sleep(self.latency)
+        self.prepared[fname] = time.time()
+
+    def test_next_file_ready(self):
+        prefetcher = FilePrefetcher(self.fnames, depth=1, warm_func=self.slow_warm)
+        start = time.time()
+        for k in range(len(self.fnames)):
+            if k > 0:
+                # prepared while file k-1 was processed
+                self.assertIn(self.fnames[k], self.prepared)
+            prefetcher.advance(k)
+            time.sleep(1.5*self.latency)
+        # the preparation did not add to the processing time
+        self.assertLess(time.time()-start, len(self.fnames)*2*self.latency)
+        prefetcher.stop()
+        self.assertFalse(prefetcher._thread.is_alive())
+
+    def test_depth(self):
+        prefetcher = FilePrefetcher(self.fnames, depth=2, warm_func=self.slow_warm)
+        prefetcher.advance(0)
+        prefetcher.advance(0)
+        prefetcher.stop()
+        # each file is prepared once and stop() waits for the scheduled ones
+        self.assertEqual(sorted(self.prepared.keys()), self.fnames[1:3])
+
+    def test_warm_local_file(self):
+        bad_fname = os.path.join(self.tmp_dir, 'not_root.root')
+        with open(bad_fname, 'wb') as f:
+            f.write('text')
+        fnames = self.fnames[:2] + [bad_fname, os.path.join(self.tmp_dir, 'missing.root')]
+        prefetcher = FilePrefetcher(fnames, depth=3, warm_bytes=1024*1024)
+        # missing and broken files are reported without stopping the thread
+        prefetcher.advance(0)
+        prefetcher.stop()
+        self.assertFalse(prefetcher._thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
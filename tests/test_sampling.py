@@ -0,0 +1,150 @@
+import math
+import random
+import unittest
+
+from analysis_tools.sampling import SAMPLE_PARAMS, ClusterSample, read_sample
+
+
+def make_clusters(n_files, clusters_per_file, cluster_size=100):
+    """(tree number, first entry, last entry + 1) as given by L1Ntuple.clusters()"""
+    clusters = []
+    for tree_number in range(n_files):
+        for k in range(clusters_per_file):
+            first = (tree_number*clusters_per_file + k) * cluster_size
+            clusters.append((tree_number, first, first+cluster_size))
+    return clusters
+
+
+class TestClusterSample(unittest.TestCase):
+
+    def test_fraction(self):
+        clusters = make_clusters(2, 5)
+        for fraction in [0., -0.1, 1.5]:
+            self.assertRaises(ValueError, ClusterSample, clusters, fraction)
+
+    def test_strata(self):
+        # at least 2/0.2 = 10 clusters, i.e. two whole files per stratum
+        sample = ClusterSample(make_clusters(10, 5), 0.2, seed=3)
+        self.assertEqual([n_clusters for n_clusters, idcs in sample.strata], [10]*5)
+        self.assertEqual([len(idcs) for n_clusters, idcs in sample.strata], [2]*5)
+        # the sampled clusters of every stratum are from its files
+        for h, (n_clusters, idcs) in enumerate(sample.strata):
+            for i in idcs:
+                first, last = sample.sampled[i]
+                self.assertTrue(h*1000 <= first < (h+1)*1000)
+        # the remaining files are added to the last stratum
+        sample = ClusterSample(make_clusters(11, 5), 0.2)
+        self.assertEqual([n_clusters for n_clusters, idcs in sample.strata], [10]*4 + [15])
+        self.assertEqual(len(sample.strata[-1][1]), 3)
+        # fewer clusters than needed for one stratum
+        sample = ClusterSample(make_clusters(1, 3), 0.1)
+        self.assertEqual([(n_clusters, len(idcs)) for n_clusters, idcs in sample.strata], [(3, 1)])
+
+    def test_entries_and_weight(self):
+        clusters = make_clusters(4, 10, cluster_size=50)
+        # a short last cluster
+        clusters[-1] = (3, clusters[-1][1], clusters[-1][1]+20)
+        sample = ClusterSample(clusters, 0.25, seed=7)
+        entries = sample.entries()
+        self.assertEqual(entries, sorted(entries))
+        self.assertEqual(len(entries), sample.sampled_entries)
+        self.assertEqual(sample.total_entries, 39*50+20)
+        # the same seed gives the same sample
+        self.assertEqual(ClusterSample(clusters, 0.25, seed=7).entries(), entries)
+        # nothing selected yet
+        self.assertEqual(sample.weight(), 0.)
+        full = ClusterSample(clusters, 1.)
+        full.counts = [3]*len(full.sampled)
+        self.assertEqual(full.weight(), 1.)
+
+    def test_weight_agrees_with_estimate(self):
+        # 2 of 7 and 3 of 11 clusters sampled, the strata have different sampled fractions
+        sample = ClusterSample(make_clusters(4, 7)[:25], 0.3, seed=5)
+        self.assertEqual([(n_clusters, len(idcs)) for n_clusters, idcs in sample.strata], [(7, 2), (7, 2), (11, 3)])
+        sample.counts = [2, 0, 5, 1, 1, 3, 7]
+        estimate, uncertainty = sample.estimate()
+        self.assertAlmostEqual(sample.weight()*sum(sample.counts), estimate)
+        self.assertNotAlmostEqual(sample.weight(), float(sample.total_entries)/sample.sampled_entries)
+
+    def test_parameters(self):
+        class Param(object):
+            def __init__(self, value):
+                self.value = value
+            def GetVal(self):
+                return self.value
+        class Directory(object):
+            def __init__(self, params):
+                self.params = dict(params)
+            def Get(self, name):
+                return Param(self.params[name]) if name in self.params else None
+        sample = ClusterSample(make_clusters(10, 5), 0.2, seed=3)
+        sample.counts = [1, 3]*5
+        weight, estimate, uncertainty = read_sample(Directory(sample.parameters()))
+        self.assertAlmostEqual(weight, sample.weight())
+        self.assertEqual((estimate, uncertainty), sample.estimate())
+        # the parameters of two jobs add up when their outputs are merged
+        other = ClusterSample(make_clusters(10, 5), 0.4, seed=4)
+        other.counts = [2]*len(other.sampled)
+        merged = [(name, v1+v2) for (name, v1), (name, v2) in zip(sample.parameters(), other.parameters())]
+        weight, estimate, uncertainty = read_sample(Directory(merged))
+        self.assertAlmostEqual(estimate, sample.estimate()[0]+other.estimate()[0])
+        self.assertAlmostEqual(weight*(sum(sample.counts)+sum(other.counts)), estimate)
+        self.assertAlmostEqual(uncertainty, math.hypot(sample.estimate()[1], other.estimate()[1]))
+        self.assertIsNone(read_sample(Directory(merged[:2])))
+        self.assertEqual([name for name, value in merged], list(SAMPLE_PARAMS))
+
+    def test_count(self):
+        sample = ClusterSample(make_clusters(4, 10), 0.5, seed=2)
+        for first, last in sample.sampled:
+            sample.count(first)
+            sample.count(last-1)
+        self.assertEqual(sample.counts, [2]*len(sample.sampled))
+        other = [1]*len(sample.sampled)
+        sample.add_counts(other)
+        self.assertEqual(sample.counts, [3]*len(sample.sampled))
+
+    def test_estimate(self):
+        sample = ClusterSample(make_clusters(10, 5), 0.2, seed=3)
+        # counts 1, 3 in every stratum of 10 clusters
+        for n_clusters, (i, j) in sample.strata:
+            sample.counts[i] = 1
+            sample.counts[j] = 3
+        total, error = sample.estimate()
+        self.assertAlmostEqual(total, 5*10*2.)
+        # N_h^2 * (1 - n_h/N_h) * s_h^2 / n_h per stratum with s_h^2 = 2
+        self.assertAlmostEqual(error, math.sqrt(5 * 10**2 * (1.-2./10) * 2./2))
+
+    def test_full_sample(self):
+        # all clusters sampled: the estimate is the count without uncertainty
+        sample = ClusterSample(make_clusters(3, 4), 1.)
+        sample.counts = range(len(sample.sampled))
+        total, error = sample.estimate()
+        self.assertAlmostEqual(total, sum(range(12)))
+        self.assertEqual(error, 0.)
+
+    def test_unbiased(self):
+        clusters = make_clusters(20, 10)
+        rng = random.Random(1)
+        # selected events per cluster, with a trend over the files
+        true_counts = [rng.randint(0, 20) + tree_number for tree_number, first, last in clusters]
+        first_entries = [first for tree_number, first, last in clusters]
+        true_total = sum(true_counts)
+        totals = []
+        pulls = []
+        for seed in range(400):
+            sample = ClusterSample(clusters, 0.2, seed=seed)
+            sample.counts = [true_counts[first_entries.index(first)] for first, last in sample.sampled]
+            total, error = sample.estimate()
+            totals.append(total)
+            pulls.append((total-true_total)/error)
+        mean = sum(totals)/len(totals)
+        spread = math.sqrt(sum((t-mean)**2 for t in totals)/(len(totals)-1))
+        # the mean of the estimates agrees with the true total within its uncertainty
+        self.assertLess(abs(mean-true_total), 4*spread/math.sqrt(len(totals)))
+        # the estimated uncertainty describes the spread of the estimates
+        pull_rms = math.sqrt(sum(p*p for p in pulls)/len(pulls))
+        self.assertTrue(0.8 < pull_rms < 1.25, pull_rms)
+
+
+if __name__ == '__main__':
+    unittest.main()